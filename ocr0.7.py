@@ -1,6 +1,7 @@
 import sys
 import os
-import pytesseract 
+import time
+_STARTUP_STARTED = time.perf_counter() # 起動時間の計測の基準 (このモジュールの読み込み開始)
 
 def resource_path(relative_path):
     """ PyInstallerでバンドルされたファイルへのパスを取得 """
@@ -12,50 +13,94 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-# --- Tesseract OCRのパス設定 ---
-# アプリ(.exe)と同じ階層に 'tesseract_engine' というフォルダを作り、
-# その中にtesseract.exeやtessdataを置いたと仮定
-bundled_tesseract_path = resource_path(os.path.join("tesseract_engine", "tesseract.exe"))
-
-if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'): # PyInstallerで実行されているかチェック
-    print(f"PyInstaller環境を検出。Tesseractのパスを検索: {bundled_tesseract_path}")
-    if os.path.exists(bundled_tesseract_path):
-        pytesseract.pytesseract.tesseract_cmd = bundled_tesseract_path
-        # tessdataのパスも指定する必要がある場合がある (tesseract.exeと同じ階層にtessdataがあれば通常は不要)
-        # tessdata_dir_config = f'--tessdata-dir "{resource_path(os.path.join("tesseract_engine", "tessdata"))}"'
-        # print(f"Tesseractのtessdataパス設定(試行): {tessdata_dir_config}")
-        # (pytesseract.image_to_string の config に tessdata_dir_config を追加することも検討)
-        print(f"同梱Tesseractを使用: {pytesseract.pytesseract.tesseract_cmd}")
-    else:
-        print(f"警告: 同梱Tesseractが見つかりません ({bundled_tesseract_path})。システムPATHのTesseractを探します。")
-        # ここでエラーにするか、ユーザーに設定を促すなどの処理が必要
-        # もし同梱しない場合は、以下のハードコードされたパスやPATH通しに依存する
-        default_tesseract_path = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-        if os.path.exists(default_tesseract_path):
-             pytesseract.pytesseract.tesseract_cmd = default_tesseract_path
-        else:
-            print("エラー: Tesseract OCRがシステムPATHにもデフォルトパスにも見つかりません。")
-            # messagebox.showerror("エラー", "Tesseract OCRが見つかりません。") # GUI起動前なのでmessageboxはまだ使えない
-else: # 通常のPython環境で実行されている場合
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe' # 開発時のパス
-    print(f"開発環境。Tesseractのパス: {pytesseract.pytesseract.tesseract_cmd}")
-
-# この後に import pytesseract を書くか、既に書かれている場合はこのコードブロックをそれより前に移動
-# import pytesseract # ← ここで改めてインポートするか、この設定ブロックを既存のimportより前に
-
-from PIL import Image, UnidentifiedImageError, ImageTk
-import requests 
-from bs4 import BeautifulSoup 
-import urllib.parse 
-from googlesearch import search # Google検索用ライブラリ
-import pygetwindow # ウィンドウ情報取得用
-import mss # スクリーンキャプチャ用
-# import mss.tools # Pillow Image変換に直接は不要
+def app_data_path(relative_path):
+    """キャッシュなど再起動後も残すデータの保存先 (exeと同じ階層。開発時はカレントディレクトリ)"""
+    if getattr(sys, 'frozen', False): base_path = os.path.dirname(sys.executable)
+    else: base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
 
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext # scrolledtext をインポート
 import re # 正規表現モジュール
 import threading # スレッド処理用
+import json
+import unicodedata
+import difflib
+import hashlib
+import sqlite3
+import argparse
+import tracemalloc
+import contextlib
+import io
+import statistics
+import functools
+import ctypes
+import multiprocessing
+import importlib
+import importlib.util
+import shutil
+import typing
+import abc
+import atexit
+import tempfile
+import codecs
+import html.parser
+import urllib.parse 
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# --- 重いモジュールの遅延読み込み ---
+# OCR・画像処理・HTTP・HTML解析・Google検索・ウィンドウ取得のモジュールは、最初に属性を参照したとき
+# (= その処理段階が初めて動いたとき) に読み込む。GUIのウィンドウは読み込みを待たずに表示される
+startup_timings = [] # (起動からの経過ms, 内容, 所要ms, スレッド名)。--startup-report で表示する
+_startup_timings_lock = threading.Lock()
+
+def record_startup_event(label, duration_ms=None):
+    with _startup_timings_lock:
+        startup_timings.append(((time.perf_counter() - _STARTUP_STARTED) * 1000, label, duration_ms, threading.current_thread().name))
+
+class _LazyModule:
+    """属性を初めて参照したときに本物のモジュールを import して、以降はそのモジュールに委ねる代理オブジェクト"""
+    def __init__(self, module_name):
+        self.__dict__["_module_name"] = module_name; self.__dict__["_module"] = None
+        self.__dict__["_load_lock"] = threading.Lock()
+
+    def load(self):
+        module = self.__dict__["_module"]
+        if module is not None: return module
+        with self.__dict__["_load_lock"]:
+            if self.__dict__["_module"] is None:
+                started = time.perf_counter()
+                module = importlib.import_module(self._module_name)
+                record_startup_event(f"import {self._module_name}", (time.perf_counter() - started) * 1000)
+                self.__dict__["_module"] = module
+            return self.__dict__["_module"]
+
+    @property
+    def loaded(self): return self.__dict__["_module"] is not None
+
+    def __getattr__(self, name): return getattr(self.load(), name)
+
+    def __repr__(self): return f"<遅延モジュール {self._module_name} ({'読み込み済み' if self.loaded else '未読み込み'})>"
+
+if typing.TYPE_CHECKING: # PyInstallerの依存解析・型チェッカー向け (実行時はここでは読み込まない)
+    import pytesseract, requests, bs4, googlesearch, pygetwindow, mss, asyncio
+    from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+pytesseract = _LazyModule("pytesseract")
+Image = _LazyModule("PIL.Image")
+ImageChops = _LazyModule("PIL.ImageChops")
+ImageFilter = _LazyModule("PIL.ImageFilter")
+ImageOps = _LazyModule("PIL.ImageOps")
+requests = _LazyModule("requests")
+bs4 = _LazyModule("bs4") # BeautifulSoup / SoupStrainer / Tag
+googlesearch = _LazyModule("googlesearch") # Google検索用ライブラリ
+pygetwindow = _LazyModule("pygetwindow") # ウィンドウ情報取得用
+mss = _LazyModule("mss") # スクリーンキャプチャ用
+asyncio = _LazyModule("asyncio") # 情報源の決定 (zekamashi検索とGoogle検索の競争) でだけ使う
+# 起動後のウォームアップで読み込むモジュール。最初のキャプチャ -> OCR(エンジンの初期化) -> 検索・取得 の順に必要になる
+STARTUP_WARMUP_CAPTURE_MODULES = [Image, ImageChops, ImageOps, ImageFilter, pygetwindow, mss]
+STARTUP_WARMUP_LOOKUP_MODULES = [requests, bs4, asyncio, googlesearch]
 
 # Tesseract OCRのパス指定
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
@@ -69,7 +114,104 @@ MISSION_SLOT_COORDINATES = [
     (670, 677, 1417, 703),  # 4番目の任務名領域 (ユーザー設定値に置き換えてください)
     (670, 779, 1417, 805)   # 5番目の任務名領域 (ユーザー設定値に置き換えてください)
 ]
-captured_kancolle_image_for_gui = None # キャプチャした画像を保持するグローバル変数
+# スロット位置の自動検出: "auto" はキャプチャからゲーム画面(5:3)の位置を検出し、上の座標をその大きさに合わせて拡大縮小する
+# 上の座標は、最初に検出に成功し、かつ上の座標のスロットが任務名として読めたキャプチャで、ゲーム画面に対する相対位置として記録される (キャリブレーション)。
+# "manual" は常に上の座標をそのまま使う
+SLOT_LAYOUT_MODE = "auto" # "auto" / "manual"
+SLOT_LAYOUT_CACHE_FILE = app_data_path(os.path.join("ocr_cache", "slot_layout.json")) # (ウィンドウ幅, 高さ, DPI) ごとの検出結果
+SLOT_LAYOUT_ASPECT_RATIO = 5 / 3 # ゲーム画面の縦横比 (1200x720)
+SLOT_LAYOUT_DETECT_WIDTH = 960 # 検出はこの幅まで縮小した画像で行う
+SLOT_LAYOUT_CANVAS_TOLERANCE = 8 # キャッシュ済みのゲーム画面の矩形とのずれがこの画素数以内なら同じ配置とみなす (超えたらズーム変更として再計算)
+# 複数スロット選択時は切り抜きを1枚の合成画像にまとめ、Tesseractの呼び出し(=jpn学習データの読み込み)を1回で済ませる
+OCR_BATCH_MODE = True
+OCR_BATCH_SLOT_GAP = 40 # 合成画像内でスロット同士の間に入れる余白(px)
+# OCRバックエンド: "auto" は常駐エンジン(tesserocr)が使えればそれを、無ければ pytesseract を使う
+OCR_BACKEND_PREFERENCE = "auto" # "auto" / "tesserocr" / "pytesseract"
+OCR_LANG = 'jpn'
+# Tesseractの場所: 同梱の tesseract_engine フォルダ -> 標準のインストール先 -> PATH の順に探し、見つけた場所を保存して次回の探索を省く
+TESSERACT_BUNDLED_PATH = resource_path(os.path.join("tesseract_engine", "tesseract.exe")) # アプリ(.exe)と同じ階層の tesseract_engine フォルダ
+TESSERACT_DEFAULT_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+TESSERACT_CONFIG_CACHE_FILE = app_data_path(os.path.join("ocr_cache", "tesseract_config.json"))
+# 起動の高速化: ウィンドウ表示後、少し待ってから重いモジュールとOCRエンジンをバックグラウンドで読み込んでおく
+STARTUP_WARMUP_ENABLED = True
+STARTUP_WARMUP_DELAY_MS = 300 # ウィンドウの最初の描画が終わるのを待つ時間
+# OCRの段階的な再試行: 軽い前処理で読んだ結果が任務名らしくなく、単語の信頼度も低ければ、
+# 拡大・二値化・白黒反転・別のページ分割モードの順に前処理を強めて読み直す
+OCR_CASCADE_ENABLED = True
+OCR_CASCADE_MIN_CONFIDENCE = 70 # 任務名らしいパターンでなくても、単語の平均信頼度(0〜100)がこれ以上なら採用する (下の長さ・日本語の割合を満たすか、任務名索引に一致する場合)
+OCR_CASCADE_MIN_CONFIDENT_LENGTH = 6 # 信頼度だけで採用するときの最低文字数 (空白を詰めた後)
+OCR_CASCADE_MIN_JAPANESE_RATIO = 0.6 # 信頼度だけで採用するときの、かな・漢字の割合の下限
+OCR_CASCADE_UPSCALE = 2 # 強い前処理で拡大する倍率
+# スロット画像の内容のハッシュ (画素の完全一致) によるOCR結果キャッシュ
+OCR_CACHE_ENABLED = True
+OCR_CACHE_CAPACITY = 256 # メモリ・ディスクとも、この件数を超えたら古いものから削除
+OCR_CACHE_FILE = app_data_path(os.path.join("ocr_cache", "slot_ocr_cache.json"))
+STORE_FLUSH_DELAY_SECONDS = 2.0 # キャッシュ類は変更のたびに書き出さず、最初の変更からこの秒数後 (と終了時) にまとめて保存する
+# ローカル任務名索引 (任務名 -> 攻略ページURL)。十分な一致度ならWeb検索を省略する
+QUEST_INDEX_FILE = app_data_path(os.path.join("ocr_cache", "quest_index.json")) # 検索で解決した任務を学習して追記する
+QUEST_INDEX_BUNDLED_FILE = resource_path("quest_index.json") # 同梱の索引 (任意・読み取り専用)
+QUEST_INDEX_MIN_SCORE = 0.9 # 任務名らしいOCR結果に対する採用スコア (0〜1)。数字・漢数字が一致しない候補はスコアに関係なく採用しない
+QUEST_INDEX_MIN_SCORE_IMPLAUSIBLE = 0.95 # 任務名らしくないOCR結果はより厳しく判定する
+# HTTP通信の共通設定 (全ての取得処理で1つのセッションを共有し、接続を使い回す)
+LOOKUP_MAX_WORKERS = 5 # 同時に処理する任務の数 (= 接続プールの大きさの目安)
+HTTP_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+HTTP_TIMEOUTS = {"site_search": 10, "page": 15} # 用途ごとのタイムアウト (秒)
+HTTP_ENABLE_COMPRESSION = True # gzip (brotliがインストールされていれば br も) で転送量を減らす
+# 攻略ページの逐次取得: 受信しながら解析し、主要コンテンツエリアが閉じたらそれ以降 (コメント欄・関連記事など) は読まない
+HTTP_STREAMING_ENABLED = True
+HTTP_STREAM_CHUNK_BYTES = 16 * 1024
+HTTP_PARTIAL_MAX_SECTIONS = 8 # 途中結果 (任務内容と報酬) を探すのはこの数の節まで (節ごとに受信済みの部分を解析し直すため)
+# 攻略ページ・サイト内検索結果のディスクキャッシュ
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_DIR = app_data_path(os.path.join("ocr_cache", "http"))
+HTTP_CACHE_MAX_BYTES = 200 * 1024 * 1024 # 合計サイズがこれを超えたら最近使われていないものから削除
+HTTP_CACHE_DEFAULT_TTL = 6 * 60 * 60 # この秒数以内に取得したものはネットワークに問い合わせずそのまま使う
+HTTP_CACHE_TTL_BY_DOMAIN = {"zekamashi.net": 3 * 24 * 60 * 60} # ドメインごとのTTL (秒)。攻略ページはほとんど更新されない
+# 情報源の決定: zekamashi.net内検索とGoogle検索を同時に行い、先に決め手となる候補を返した方を使う
+RESOLVE_DEADLINE_SECONDS = 12.0 # 情報源の決定全体の締め切り (秒)。過ぎたらその時点の候補で決める
+RESOLVE_GOOGLE_TIMEOUT = 8 # Google検索1回のタイムアウト (秒)
+GOOGLE_SEARCH_HOST = "www.google.com" # googlesearch の問い合わせ先 (応答時間と遮断の記録に使う)
+# 1任務あたりの締め切り: 情報源の決定・ページ取得・解析の合計をこの秒数に収める
+LOOKUP_DEADLINE_SECONDS = 20.0
+LOOKUP_STAGE_RESERVE_SECONDS = {"fetch": 5.0, "parse": 1.0} # 前の段階が使い切らずに、後の段階のために残しておく時間
+LOOKUP_MIN_STAGE_SECONDS = 0.5 # 残り時間がこれ未満なら、その段階は始めずに締め切り超過とする
+# ホストごとの適応タイムアウト: 観測した応答時間の指数移動平均と揺らぎから決める (TCPの再送タイムアウトと同じ式)。上限は HTTP_TIMEOUTS
+HTTP_ADAPTIVE_TIMEOUT_ENABLED = True
+HTTP_TIMEOUT_MIN_SECONDS = 2.0
+# ホストごとの遮断 (サーキットブレーカー): 連続で失敗したか、429/503 で制限されたホストにはしばらく問い合わせず即座に失敗させる
+CIRCUIT_FAILURE_THRESHOLD = 3 # 連続でこの回数失敗したら遮断する
+CIRCUIT_OPEN_SECONDS = 30.0 # 遮断する時間。遮断明けの試行にも失敗したら倍にする
+CIRCUIT_MAX_OPEN_SECONDS = 300.0
+# 攻略ページの先読み: 一覧ページをたどって任務ページを取得・抽出し、HTTPキャッシュ・抽出結果・任務名索引を温めておく
+PREFETCH_INDEX_URLS = ["https://zekamashi.net/?s=" + urllib.parse.quote("任務")] # たどる一覧ページ (「次へ」のリンクも順にたどる)
+PREFETCH_MAX_INDEX_PAGES = 50 # たどる一覧ページの上限
+PREFETCH_MIN_INTERVAL_SECONDS = 3.0 # 同じホストへのリクエストの最小間隔 (サイトに負荷をかけないため)
+PREFETCH_IDLE_POLL_SECONDS = 1.0 # 通常の検索が動いている間、この間隔で空くのを待つ
+PREFETCH_REFRESH_SECONDS = 7 * 24 * 60 * 60 # 先読みを完了してからこの秒数が過ぎたら一覧をたどり直す
+PREFETCH_MAX_ATTEMPTS = 3 # 取得に失敗したページを諦めるまでの試行回数
+PREFETCH_PROGRESS_FILE = app_data_path(os.path.join("ocr_cache", "prefetch_progress.json")) # 中断しても続きから再開できるよう進捗を保存する
+# 抽出済みの任務詳細の保存先 (URL・ページ内容のハッシュ・抽出処理のバージョンが一致すれば解析を省略する)
+DETAILS_STORE_ENABLED = True
+DETAILS_STORE_FILE = app_data_path(os.path.join("ocr_cache", "mission_details.sqlite3"))
+EXTRACTOR_VERSION = 3 # extract_specific_mission_details の抽出結果が変わる修正をしたら上げる (保存済みの結果は自動的に無効になる)
+# 処理段階ごとの時間計測 (環境変数 OCR_TRACE_FILE か --trace でJSONLのトレースを出力する。無効時はほぼコストなし)
+TRACE_FILE = os.environ.get("OCR_TRACE_FILE")
+TRACE_SUMMARY_WINDOW = 50 # 段階ごとの集計に使う直近の件数
+# キャプチャ対象ウィンドウの探し方 (完全一致するタイトルが無ければ、汎用ヒントとブラウザ名の両方を含むタイトルを探す)
+KANCOLLE_EXACT_TITLE = "艦隊これくしょん -艦これ- - オンラインゲーム - DMM GAMES"
+KANCOLLE_GENERIC_HINTS = ["艦隊これくしょん -艦これ-", "「艦隊これくしょん -艦これ-」"]
+KANCOLLE_BROWSER_HINTS = ["Google Chrome", "Microsoft Edge"]
+# 監視モード: 一定間隔でウィンドウを取得し、内容が変わったスロットだけOCR・検索する
+WATCH_FPS = 1.0 # 1秒あたりのキャプチャ回数
+WATCH_DEBOUNCE_FRAMES = 1 # 変化後、この回数だけ連続で同じ内容が続いたら確定とみなす (切り替えアニメーション中のOCRを避ける)
+WATCH_DIFF_THRESHOLD = 24 # 縮小したスロット画像の画素差(0〜255)の最大値がこれを超えたら「変化あり」
+WATCH_LAYOUT_RECHECK_SECONDS = 10.0 # 監視モードで、ウィンドウ全体をキャプチャしてゲーム画面の位置 (ブラウザのズーム) を確かめ直す間隔
+WATCH_SIGNATURE_SIZE = (256, 16) # 比較用にスロット画像を縮小するサイズ (縮小で平均化されるので多少のノイズは無視される)
+# メモリ使用量: キャプチャはスロットの切り抜きだけを残し、結果は直近の任務だけを履歴に残す
+CAPTURE_RETAIN_GRAYSCALE = True # 残す切り抜きをグレースケールにする (OCRの前処理はどの段階もグレースケールで行う)
+RESULT_HISTORY_CAPACITY = 64 # 検索結果を覚えておく任務の数。超えたら最近使っていないものから捨てる
+captured_kancolle_image_for_gui = None # 最後のキャプチャのスロット切り抜き (RetainedSlotCrops)
+current_slot_coordinates = list(MISSION_SLOT_COORDINATES) # キャプチャ画像に合わせて解決したスロット座標
 ocr_results_for_selection = [] # OCR結果をGUI間で共有するためのリスト（現在は直接使われていない）
 
 # --- グローバル変数 (GUIウィジェットとStringVar) ---
@@ -79,15 +221,362 @@ slot_entry_var = None
 mission_name_var = None
 site_name_var = None
 url_var = None
-content_text = None
-rewards_text = None
-sortie_info_text = None
-expedition_info_text = None
-arsenal_info_text = None
+results_notebook = None # 任務ごとの結果ペインを並べるNotebook
+mission_result_panes = {} # スロット番号(0始まり) -> MissionResultPane
 capture_button_widget = None
 slot_entry_widget = None
 process_slots_button_widget = None
+trace_enabled_var = None
+watch_mode_var = None
+watch_controller = None
+prefetch_enabled_var = None
+guide_prefetcher = None
+
+
+# --- 処理時間の計測 (トレース) ---
+class _NullSpan:
+    """計測が無効なときに返す何もしないスパン"""
+    def __enter__(self): return self
+    def __exit__(self, *exc_info): return False
+    def set(self, **attrs): pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, tracer, stage, attrs):
+        self.tracer = tracer; self.stage = stage; self.attrs = attrs
+
+    def __enter__(self):
+        stack = self.tracer._stack(); self.parent = stack[-1].stage if stack else None; stack.append(self)
+        self.start_wall = time.time(); self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        self.tracer._stack().pop()
+        if exc_type: self.attrs["error"] = exc_type.__name__
+        self.tracer._record(self, duration_ms)
+        return False
 
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class StageTracer:
+    """capture / ocr / resolve / fetch / parse / extract / render などの処理段階の時間を計測する
+    有効時は段階ごとの直近の処理時間を保持し、ファイルが指定されていればJSONLで1スパン1行を書き出す"""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock(); self._local = threading.local()
+        self._file = None; self._recent = {}
+
+    def enable(self, path=None):
+        with self._lock:
+            if path and self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._file = open(path, "a", encoding="utf-8")
+            self.enabled = True
+        if multiprocessing.parent_process() is None: # --batch の標準出力はJSONL専用。OCR用の子プロセス (spawnでは読み込み時にここを通る) は知らせない
+            print("処理時間の計測を開始しました。" + (f" (トレース出力: {path})" if path else ""), file=sys.stderr)
+
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+            if self._file: self._file.close(); self._file = None
+
+    def span(self, stage, **attrs):
+        if not self.enabled: return _NULL_SPAN
+        return _Span(self, stage, attrs)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"): self._local.stack = []
+        return self._local.stack
+
+    def _record(self, span, duration_ms):
+        record = {"stage": span.stage, "start": round(span.start_wall, 6), "duration_ms": round(duration_ms, 3), "thread": threading.current_thread().name, "parent": span.parent, **span.attrs}
+        with self._lock:
+            self._recent.setdefault(span.stage, deque(maxlen=TRACE_SUMMARY_WINDOW)).append(duration_ms)
+            if self._file:
+                self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n"); self._file.flush()
+
+    def summary(self):
+        """段階ごとの直近の処理時間の集計 {段階: {"count", "p50_ms", "p95_ms", "max_ms"}}"""
+        with self._lock: recent = {stage: sorted(durations) for stage, durations in self._recent.items()}
+        return {stage: {"count": len(d), "p50_ms": round(d[len(d) // 2], 1), "p95_ms": round(d[round((len(d) - 1) * 0.95)], 1), "max_ms": round(d[-1], 1)}
+                for stage, d in recent.items() if d}
+
+stage_tracer = StageTracer()
+if TRACE_FILE: stage_tracer.enable(TRACE_FILE)
+
+def trace_span(stage, **attrs):
+    """with trace_span("fetch", url=...) as span: ... の形で処理時間を計測する"""
+    return stage_tracer.span(stage, **attrs)
+
+def traced_stage(stage):
+    """関数全体を1つの段階として計測するデコレータ (計測が無効なら関数をそのまま呼ぶだけ)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not stage_tracer.enabled: return func(*args, **kwargs)
+            with stage_tracer.span(stage, function=func.__name__): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Tesseractの場所の設定 ---
+_tesseract_config = None
+_tesseract_config_lock = threading.Lock()
+
+def _tesseract_candidates():
+    """探索するTesseractの候補 (順番が優先度)。開発時は標準のインストール先をそのまま使う"""
+    if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'): return [TESSERACT_BUNDLED_PATH, TESSERACT_DEFAULT_PATH]
+    return [TESSERACT_DEFAULT_PATH]
+
+def _probe_tesseract_config(candidates):
+    tesseract_cmd = next((path for path in candidates if os.path.exists(path)), None)
+    if tesseract_cmd is None and getattr(sys, 'frozen', False):
+        print(f"警告: 同梱Tesseractが見つかりません ({TESSERACT_BUNDLED_PATH})。システムPATHのTesseractを探します。", file=sys.stderr)
+        tesseract_cmd = shutil.which("tesseract")
+        if tesseract_cmd is None: print("エラー: Tesseract OCRがシステムPATHにもデフォルトパスにも見つかりません。", file=sys.stderr); tesseract_cmd = "tesseract"
+    if tesseract_cmd is None: tesseract_cmd = candidates[-1] # 開発時は存在確認なしで標準のインストール先を使う
+    # tessdataの場所 (tesseract.exeと同じ階層のtessdata)。常駐OCRエンジンの初期化でも同じ設定を使う
+    return {"candidates": candidates, "tesseract_cmd": tesseract_cmd, "tessdata_dir": os.path.join(os.path.dirname(tesseract_cmd), "tessdata")}
+
+def get_tesseract_config():
+    """{"tesseract_cmd", "tessdata_dir"} を返す。初回に pytesseract へ設定する
+    前回の結果が保存されていて、候補が同じで保存したパスがまだ存在すれば探索を省く"""
+    global _tesseract_config
+    with _tesseract_config_lock:
+        if _tesseract_config is not None: return _tesseract_config
+        candidates = _tesseract_candidates(); config = None
+        try:
+            with open(TESSERACT_CONFIG_CACHE_FILE, encoding="utf-8") as f: cached = json.load(f)
+            if cached.get("candidates") == candidates and os.path.exists(cached.get("tesseract_cmd", "")): config = cached
+        except (OSError, ValueError): pass
+        if config is None:
+            config = _probe_tesseract_config(candidates)
+            if os.path.exists(config["tesseract_cmd"]): # 見つからなかった結果は保存しない (インストール後に探し直す)
+                try:
+                    os.makedirs(os.path.dirname(TESSERACT_CONFIG_CACHE_FILE), exist_ok=True)
+                    tmp_path = f"{TESSERACT_CONFIG_CACHE_FILE}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f: json.dump(config, f, ensure_ascii=False)
+                    os.replace(tmp_path, TESSERACT_CONFIG_CACHE_FILE)
+                except OSError as e: print(f"警告: Tesseractの設定の保存に失敗: {e}", file=sys.stderr)
+        config = dict(config, tessdata_dir=os.environ.get("TESSDATA_PREFIX") or config["tessdata_dir"])
+        pytesseract.pytesseract.tesseract_cmd = config["tesseract_cmd"]
+        # 診断メッセージは標準エラーに出す (--batch の標準出力をJSONL専用にするため)
+        print(f"Tesseractのパス: {config['tesseract_cmd']}", file=sys.stderr)
+        _tesseract_config = config
+        return config
+
+# --- OCRバックエンド ---
+class OcrBackend(abc.ABC):
+    """OCRエンジンの共通インターフェース。呼び出しごとの処理時間を記録する (latency_summary で集計。1回ごとの表示は計測が有効なときだけ)"""
+    name = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.call_count = 0; self.total_seconds = 0.0; self.last_seconds = 0.0
+
+    @abc.abstractmethod
+    def image_to_string(self, img, psm=7): ...
+
+    @abc.abstractmethod
+    def image_to_data(self, img, psm=6):
+        """pytesseract.Output.DICT と同じキー (text, conf, left, top, width, height) の辞書を返す"""
+
+    def _record_latency(self, started, what):
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.call_count += 1; self.total_seconds += elapsed; self.last_seconds = elapsed
+        if stage_tracer.enabled: print(f"OCR({self.name}) {what}: {elapsed * 1000:.0f}ms")
+
+    def latency_summary(self):
+        with self._stats_lock:
+            avg_ms = (self.total_seconds / self.call_count * 1000) if self.call_count else 0.0
+            return {"backend": self.name, "calls": self.call_count, "avg_ms": round(avg_ms, 1), "last_ms": round(self.last_seconds * 1000, 1)}
+
+class PytesseractBackend(OcrBackend):
+    """従来のpytesseract経由のOCR (呼び出しごとにtesseractプロセスを起動する)。フォールバック用"""
+    name = "pytesseract"
+
+    def image_to_string(self, img, psm=7):
+        started = time.perf_counter()
+        try: return pytesseract.image_to_string(img, lang=OCR_LANG, config=f'--psm {psm}').strip()
+        finally: self._record_latency(started, "image_to_string")
+
+    def image_to_data(self, img, psm=6):
+        started = time.perf_counter()
+        try: return pytesseract.image_to_data(img, lang=OCR_LANG, config=f'--psm {psm}', output_type=pytesseract.Output.DICT)
+        finally: self._record_latency(started, "image_to_data")
+
+class TesserocrBackend(OcrBackend):
+    """tesserocr(Tesseract APIバインディング)による常駐OCRエンジン
+    jpnの学習データは初期化時に1回だけ読み込み、画像は一時ファイルを介さず生バッファで渡す"""
+    name = "tesserocr"
+
+    def __init__(self, tessdata_dir=None, lang=OCR_LANG):
+        super().__init__()
+        if tessdata_dir is None: tessdata_dir = get_tesseract_config()["tessdata_dir"]
+        import tesserocr # 任意の依存。無ければ ImportError で pytesseract にフォールバック
+        self._tesserocr = tesserocr
+        self._api_lock = threading.Lock() # TessBaseAPI はスレッドセーフではない
+        init_args = {"lang": lang}
+        if tessdata_dir and os.path.isdir(tessdata_dir): init_args["path"] = tessdata_dir
+        self._api = tesserocr.PyTessBaseAPI(**init_args)
+
+    def _set_image(self, img, psm):
+        if img.mode not in ("L", "RGB"): img = img.convert("RGB")
+        bytes_per_pixel = 1 if img.mode == "L" else 3
+        self._api.SetPageSegMode(psm)
+        self._api.SetImageBytes(img.tobytes(), img.width, img.height, bytes_per_pixel, img.width * bytes_per_pixel)
+
+    def image_to_string(self, img, psm=7):
+        started = time.perf_counter()
+        try:
+            with self._api_lock:
+                self._set_image(img, psm)
+                return self._api.GetUTF8Text().strip()
+        finally: self._record_latency(started, "image_to_string")
+
+    def image_to_data(self, img, psm=6):
+        started = time.perf_counter()
+        data = {"text": [], "conf": [], "left": [], "top": [], "width": [], "height": []}
+        try:
+            with self._api_lock:
+                self._set_image(img, psm)
+                self._api.Recognize()
+                level = self._tesserocr.RIL.WORD
+                result_iter = self._api.GetIterator()
+                if result_iter is None: return data
+                for word_iter in self._tesserocr.iterate_level(result_iter, level):
+                    word = word_iter.GetUTF8Text(level); box = word_iter.BoundingBox(level)
+                    if not word or not box: continue
+                    x1, y1, x2, y2 = box
+                    data["text"].append(word); data["conf"].append(word_iter.Confidence(level))
+                    data["left"].append(x1); data["top"].append(y1); data["width"].append(x2 - x1); data["height"].append(y2 - y1)
+            return data
+        finally: self._record_latency(started, "image_to_data")
+
+_ocr_backend = None
+_ocr_backend_lock = threading.Lock()
+
+def get_ocr_backend():
+    """OCRバックエンドを1度だけ初期化して返す (起動時のウォームアップでも呼ばれる)"""
+    global _ocr_backend
+    with _ocr_backend_lock:
+        if _ocr_backend is None:
+            init_started = time.perf_counter(); get_tesseract_config()
+            if OCR_BACKEND_PREFERENCE in ("auto", "tesserocr"):
+                try:
+                    started = time.perf_counter()
+                    _ocr_backend = TesserocrBackend()
+                    print(f"常駐OCRエンジン(tesserocr)を初期化しました ({(time.perf_counter() - started) * 1000:.0f}ms)。")
+                except Exception as e: print(f"常駐OCRエンジンを使用できません。pytesseractにフォールバックします: {e}")
+            if _ocr_backend is None: _ocr_backend = PytesseractBackend()
+            record_startup_event(f"OCRエンジン初期化 ({_ocr_backend.name})", (time.perf_counter() - init_started) * 1000)
+        return _ocr_backend
+
+# --- キャッシュ類の遅延保存 ---
+class DeferredSaver:
+    """変更のたびにファイルを書き直さず、最初の変更から delay 秒後とプロセス終了時にまとめて save() を呼ぶ
+    save は lock を取った状態で呼ばれる。mark_dirty() は lock を取った状態で呼ぶ"""
+    def __init__(self, save, lock, delay=STORE_FLUSH_DELAY_SECONDS):
+        self._save = save; self._lock = lock; self.delay = delay
+        self._timer = None; self.dirty = False
+        atexit.register(self.flush)
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self.flush); self._timer.daemon = True; self._timer.start()
+
+    def flush(self):
+        """未保存の変更があれば今すぐ保存する (lock を持ったまま呼ばないこと)"""
+        with self._lock:
+            if self._timer: self._timer.cancel(); self._timer = None
+            if self.dirty: self.dirty = False; self._save()
+
+# --- スロットOCR結果キャッシュ ---
+class SlotOcrCache:
+    """スロット画像の内容のハッシュをキーにしたOCR結果のLRUキャッシュ (JSONファイルに永続化)
+    画素が完全に一致する画像だけを同じ任務名とみなし、OCRを省略する
+    (縮小したハッシュの近似一致では「1-4」と「1-5」や「第二」と「第三」のような1文字違いの任務名を区別できないため)"""
+    def __init__(self, path=OCR_CACHE_FILE, capacity=OCR_CACHE_CAPACITY, persist=True):
+        self.path = path; self.capacity = capacity
+        self.persist = persist # False ならファイルに書かず、追加分を take_updates() で渡す (一括処理の子プロセス用)
+        self._entries = OrderedDict() # (幅, 高さ, ハッシュ) -> テキスト
+        self._updates = []
+        self._lock = threading.Lock()
+        self._saver = DeferredSaver(self._save_locked, self._lock)
+        self.hits = 0; self.misses = 0
+        self._load()
+
+    @staticmethod
+    def content_hash(img):
+        """グレースケールにしたスロット画像の全画素のハッシュ (128ビット) を整数で返す"""
+        return int.from_bytes(hashlib.blake2b(img.convert("L").tobytes(), digest_size=16).digest(), "big")
+
+    def key_for(self, img):
+        return (img.width, img.height, self.content_hash(img))
+
+    def get(self, key):
+        """キャッシュ済みのテキストを返す。見つからなければ None"""
+        with self._lock:
+            if not self._entries.get(key): self.misses += 1; return None # "" は読み取り失敗なのでヒットにしない
+            self.hits += 1; self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, text):
+        if not text: return # 読み取り失敗は次回やり直せるようにキャッシュしない
+        with self._lock:
+            self._entries[key] = text; self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity: self._entries.popitem(last=False)
+            if self.persist: self._saver.mark_dirty()
+            else: self._updates.append((key, text))
+
+    def take_updates(self):
+        """persist=False のとき、前回から追加したエントリを返して空にする"""
+        with self._lock: updates, self._updates = self._updates, []
+        return updates
+
+    def merge(self, updates):
+        """子プロセスが take_updates() で返したエントリを取り込む (保存はこのプロセスで行う)"""
+        for key, text in updates: self.put(tuple(key), text)
+
+    def flush(self):
+        self._saver.flush()
+
+    def stats(self):
+        with self._lock: return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f: records = json.load(f)
+            for rec in records[-self.capacity:]:
+                if rec.get("text") and rec.get("digest"): self._entries[(rec["w"], rec["h"], int(rec["digest"], 16))] = rec["text"] # 以前のdHashの記録 ("hash") は近似一致用なので使わない
+            print(f"OCRキャッシュを読み込みました: {len(self._entries)}件")
+        except FileNotFoundError: pass
+        except Exception as e: print(f"警告: OCRキャッシュの読み込みに失敗 (無視して続行): {e}")
+
+    def _save_locked(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            records = [{"w": w, "h": h, "digest": f"{digest:x}", "text": text} for (w, h, digest), text in self._entries.items()]
+            tmp_path = f"{self.path}.{os.getpid()}.tmp" # 一括処理ではOCRを複数プロセスで行うため、一時ファイル名をプロセスごとに分ける
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump(records, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e: print(f"警告: OCRキャッシュの保存に失敗: {e}")
+
+_slot_ocr_cache = None
+_slot_ocr_cache_lock = threading.Lock()
+
+def get_slot_ocr_cache():
+    """OCRキャッシュを返す (無効化されている場合は None)"""
+    global _slot_ocr_cache
+    if not OCR_CACHE_ENABLED: return None
+    with _slot_ocr_cache_lock:
+        if _slot_ocr_cache is None: _slot_ocr_cache = SlotOcrCache()
+        return _slot_ocr_cache
 
 # --- OCRとウェブページ解析のためのヘルパー関数群 ---
 
@@ -121,46 +610,417 @@ def is_plausible_title_pattern(line_text):
     if line == "敵艦隊を撃破せよ!" or line == "敵艦隊を撃破せよ": return True
     return False
 
+def find_kancolle_window(exact_kancolle_title=KANCOLLE_EXACT_TITLE, generic_kancolle_hints=KANCOLLE_GENERIC_HINTS, browser_hints=KANCOLLE_BROWSER_HINTS, log=print):
+    """艦これのウィンドウを探して返す。見つからなければ None (pygetwindow の例外はそのまま送出)"""
+    all_windows = pygetwindow.getAllWindows(); target_window = None
+    log(f"ステップ1: 「{exact_kancolle_title}」に完全一致するウィンドウを検索します...")
+    for window in all_windows:
+        if window.title == exact_kancolle_title:
+            if window.visible and not window.isMinimized: target_window = window; log(f"  -> 発見: 「{target_window.title}」"); break
+    if not target_window:
+        log(f"ステップ1では見つかりませんでした。ステップ2: 汎用ヒントで検索します...")
+        # log(f"  (汎用タイトルヒント: {generic_kancolle_hints}, ブラウザヒント: {browser_hints})") # 詳細ログは必要なら
+        possible_windows = []
+        for window in all_windows:
+            if any(hint in window.title for hint in generic_kancolle_hints) and \
+               any(browser_hint in window.title for browser_hint in browser_hints):
+                if window.visible and not window.isMinimized: possible_windows.append(window)
+        if possible_windows: target_window = possible_windows[0]; log(f"  -> 汎用ヒントで発見: 「{target_window.title}」")
+    if not target_window: 
+        log("エラー: 対象の艦これウィンドウが見つかりませんでした。\n以下の点を確認してください:")
+        log("  - 艦これが起動しており、ウィンドウが表示されている（最小化されていない）。")
+        log(f"  - ウィンドウタイトルが「{exact_kancolle_title}」であるか、")
+        log(f"    または、タイトルに「{generic_kancolle_hints}」のいずれかと「{browser_hints}」のいずれかが含まれている。")
+    return target_window
+
+def get_window_dpi(window):
+    """ウィンドウのDPI (Windowsの表示スケール)。取得できない環境では96"""
+    try: return int(ctypes.windll.user32.GetDpiForWindow(window._hWnd)) or 96
+    except Exception: return 96
+
+@traced_stage("capture")
 def capture_kancolle_window(
-    exact_kancolle_title="艦隊これくしょん -艦これ- - オンラインゲーム - DMM GAMES", 
-    generic_kancolle_hints=["艦隊これくしょん -艦これ-", "「艦隊これくしょん -艦これ-」"], 
-    browser_hints=["Google Chrome", "Microsoft Edge"]):
-    print("\n艦これウィンドウを検索中...")
+    exact_kancolle_title=KANCOLLE_EXACT_TITLE, 
+    generic_kancolle_hints=KANCOLLE_GENERIC_HINTS, 
+    browser_hints=KANCOLLE_BROWSER_HINTS,
+    activate_window=True, verbose=True): # 監視モードではフォーカスを奪わず、ログも出さない
+    log = print if verbose else (lambda *args, **kwargs: None)
+    log("\n艦これウィンドウを検索中...")
     try:
-        all_windows = pygetwindow.getAllWindows(); target_window = None
-        print(f"ステップ1: 「{exact_kancolle_title}」に完全一致するウィンドウを検索します...")
-        for window in all_windows:
-            if window.title == exact_kancolle_title:
-                if window.visible and not window.isMinimized: target_window = window; print(f"  -> 発見: 「{target_window.title}」"); break
-        if not target_window:
-            print(f"ステップ1では見つかりませんでした。ステップ2: 汎用ヒントで検索します...")
-            # print(f"  (汎用タイトルヒント: {generic_kancolle_hints}, ブラウザヒント: {browser_hints})") # 詳細ログは必要なら
-            possible_windows = []
-            for window in all_windows:
-                if any(hint in window.title for hint in generic_kancolle_hints) and \
-                   any(browser_hint in window.title for browser_hint in browser_hints):
-                    if window.visible and not window.isMinimized: possible_windows.append(window)
-            if possible_windows: target_window = possible_windows[0]; print(f"  -> 汎用ヒントで発見: 「{target_window.title}」")
-        if not target_window: 
-            print("エラー: 対象の艦これウィンドウが見つかりませんでした。\n以下の点を確認してください:")
-            print("  - 艦これが起動しており、ウィンドウが表示されている（最小化されていない）。")
-            print(f"  - ウィンドウタイトルが「{exact_kancolle_title}」であるか、")
-            print(f"    または、タイトルに「{generic_kancolle_hints}」のいずれかと「{browser_hints}」のいずれかが含まれている。")
-            return None
-        print(f"キャプチャ対象ウィンドウ: 「{target_window.title}」 (サイズ: {target_window.width}x{target_window.height})")
-        try:
-            if target_window.isMinimized: target_window.restore()
-            target_window.activate()
-        except Exception as e_act: print(f"警告: ウィンドウのアクティブ化に失敗 (無視して続行): {e_act}")
+        target_window = find_kancolle_window(exact_kancolle_title, generic_kancolle_hints, browser_hints, log)
+        if not target_window: return None
+        log(f"キャプチャ対象ウィンドウ: 「{target_window.title}」 (サイズ: {target_window.width}x{target_window.height})")
+        if activate_window:
+            try:
+                if target_window.isMinimized: target_window.restore()
+                target_window.activate()
+            except Exception as e_act: log(f"警告: ウィンドウのアクティブ化に失敗 (無視して続行): {e_act}")
         monitor_region = {"top": target_window.top, "left": target_window.left, "width": target_window.width, "height": target_window.height}
         with mss.mss() as sct:
             sct_img = sct.grab(monitor_region)
-            img = Image.frombytes("RGB", (sct_img.width, sct_img.height), sct_img.rgb); return img
+            img = Image.frombytes("RGB", (sct_img.width, sct_img.height), sct_img.rgb)
+            img.info["window_dpi"] = get_window_dpi(target_window); return img
     except pygetwindow.PyGetWindowException as e_gw: print(f"ウィンドウ情報取得エラー (pygetwindow): {e_gw}"); return None
-    except UnidentifiedImageError: print("エラー: キャプチャ画像をPillowが認識できませんでした。"); return None
+    except Image.UnidentifiedImageError: print("エラー: キャプチャ画像をPillowが認識できませんでした。"); return None
     except Exception as e: print(f"ウィンドウキャプチャ中に予期せぬエラー: {e}"); return None
 
-def ocr_specific_slot(base_image, slot_coords, slot_number_for_debug=0): # デバッグ用引数追加
+class SlotRegionCapture:
+    """スロット領域を囲む最小の矩形だけを取得したグレースケール画像と、そのウィンドウ内での左上座標"""
+    __slots__ = ("image", "origin")
+    def __init__(self, image, origin): self.image = image; self.origin = origin
+
+    def local_coords(self, slot_coords):
+        """ウィンドウ基準のスロット座標を、この画像内の座標に変換する"""
+        ox, oy = self.origin; x1, y1, x2, y2 = slot_coords
+        return (x1 - ox, y1 - oy, x2 - ox, y2 - oy)
+
+    def crop(self, slot_coords): return self.image.crop(self.local_coords(slot_coords))
+
+class RetainedSlotCrops:
+    """キャプチャ画像からスロットの切り抜きだけを残したもの (ウィンドウ全体のRGB画像は保持しない)
+    OCR関数には元の画像の代わりにそのまま渡せる。crop() は切り抜いたときと同じ座標だけに対応する"""
+    __slots__ = ("crops", "mode", "source_size")
+
+    def __init__(self, crops, mode, source_size):
+        self.crops = crops; self.mode = mode; self.source_size = source_size
+
+    @classmethod
+    def from_image(cls, img, slot_coords_list, grayscale=CAPTURE_RETAIN_GRAYSCALE):
+        crops = {}
+        for coords in slot_coords_list:
+            x1, y1, x2, y2 = coords
+            if x1 >= x2 or y1 >= y2: continue # 不正な座標は ocr_specific_slot が警告する
+            slot_img = img.crop(tuple(coords))
+            crops[tuple(coords)] = slot_img.convert("L") if grayscale else slot_img
+        return cls(crops, "L" if grayscale else img.mode, img.size)
+
+    @classmethod
+    def from_region(cls, frame, slot_coords_list):
+        """監視モードのスロット領域キャプチャ (SlotRegionCapture) から作る。座標はウィンドウ基準のまま使える"""
+        crops = {tuple(coords): frame.crop(coords) for coords in slot_coords_list if coords[0] < coords[2] and coords[1] < coords[3]}
+        return cls(crops, frame.image.mode, None)
+
+    def crop(self, box):
+        slot_img = self.crops.get(tuple(box))
+        if slot_img is None: raise ValueError(f"座標 {box} の切り抜きは保持していません。")
+        return slot_img
+
+    @property
+    def nbytes(self): return sum(len(c.getbands()) * c.width * c.height for c in self.crops.values())
+
+class RegionCapturer:
+    """繰り返しキャプチャ用: 見つけたウィンドウを覚えておき、スレッドごとに1つの mss インスタンスを使い回して
+    指定スロットを囲む範囲だけを直接グレースケールで取得する (ウィンドウ全体をRGBで取得するより大幅に軽い)"""
+    def __init__(self):
+        self._window = None; self._lock = threading.Lock()
+        self._local = threading.local() # mss はスレッドをまたいで使えないため、スレッドごとに持つ
+
+    def _grabber(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None: sct = self._local.sct = mss.mss()
+        return sct
+
+    def _resolve_window(self):
+        with self._lock:
+            window = self._window
+            if window is not None:
+                try:
+                    if window.visible and not window.isMinimized: return window
+                except Exception: pass # ウィンドウが閉じられた等。探し直す
+            self._window = find_kancolle_window(log=lambda *args, **kwargs: None)
+            return self._window
+
+    def invalidate(self):
+        with self._lock: self._window = None
+
+    def window_key(self):
+        """現在のウィンドウの (幅, 高さ, DPI)。スロット配置のキャッシュ参照に使う。ウィンドウが無ければ None"""
+        window = self._resolve_window()
+        if window is None: return None
+        try: return (window.width, window.height, get_window_dpi(window))
+        except Exception: self.invalidate(); return None
+
+    @staticmethod
+    def union_bbox(slot_coords_list):
+        valid = [c for c in slot_coords_list if c[0] < c[2] and c[1] < c[3]]
+        if not valid: return None
+        return (min(c[0] for c in valid), min(c[1] for c in valid), max(c[2] for c in valid), max(c[3] for c in valid))
+
+    @traced_stage("capture_region")
+    def grab_slots(self, slot_coords_list):
+        """スロット群を囲む範囲を取得して SlotRegionCapture を返す。ウィンドウが無い・取得失敗時は None"""
+        bbox = self.union_bbox(slot_coords_list)
+        if bbox is None: return None
+        window = self._resolve_window()
+        if window is None: return None
+        try:
+            left, top = window.left, window.top
+            region = {"left": left + bbox[0], "top": top + bbox[1], "width": bbox[2] - bbox[0], "height": bbox[3] - bbox[1]}
+            sct_img = self._grabber().grab(region)
+            # BGRA の生データをそのまま読み、すぐ1チャンネルにする (RGBのバイト列を作り直さない)
+            gray = Image.frombuffer("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX", 0, 1).convert("L")
+            return SlotRegionCapture(gray, (bbox[0], bbox[1]))
+        except Exception as e:
+            print(f"領域キャプチャ中にエラー: {e}"); self.invalidate(); return None
+
+# --- スロット位置の自動検出 ---
+def _longest_active_run(profile, threshold, max_gap):
+    """プロファイル値が threshold 以上の区間のうち最長のもの (max_gap 以下の途切れは繋げる) を (開始, 終了) で返す"""
+    best = None; start = None; last_active = None
+    for i, value in enumerate(profile):
+        if value < threshold: continue
+        if start is None or i - last_active > max_gap + 1:
+            if start is not None and (best is None or last_active - start > best[1] - best[0]): best = (start, last_active + 1)
+            start = i
+        last_active = i
+    if start is not None and (best is None or last_active - start >= best[1] - best[0]): best = (start, last_active + 1)
+    return best
+
+def detect_game_canvas(img, aspect_ratio=SLOT_LAYOUT_ASPECT_RATIO, detect_width=SLOT_LAYOUT_DETECT_WIDTH):
+    """ウィンドウのキャプチャからゲーム画面の矩形 (左, 上, 右, 下) を推定する。見つからなければ None
+    エッジ画像の列・行ごとの密度 (射影プロファイル) を Pillow の縮小処理で求める。
+    横方向は模様の多い最長の列区間、縦方向は縦横比から決まる高さの窓を、左右の余白にも模様がある行
+    (ブラウザのツールバーやページのリンク) を避けつつ、模様のある行が最も多くなる位置に置く"""
+    scale = max(1, -(-img.width // detect_width))
+    small = img.convert("L").reduce(scale) if scale > 1 else img.convert("L")
+    edges = small.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v > 24 else 0)
+    w, h = edges.size
+    column_profile = list(edges.resize((w, 1), Image.BOX).getdata()) # 各列で「模様あり」の行の割合 x255
+    columns = _longest_active_run(column_profile, 0.25 * 255, max_gap=2)
+    if not columns or columns[1] - columns[0] < w * 0.2: return None
+    expected_height = round((columns[1] - columns[0]) / aspect_ratio)
+    if expected_height > h: return None
+    band_profile = list(edges.crop((columns[0], 0, columns[1], h)).resize((1, h), Image.BOX).getdata())
+    margin_width = w - (columns[1] - columns[0])
+    if margin_width >= w * 0.05:
+        margins = edges.copy(); margins.paste(0, (columns[0], 0, columns[1], h))
+        margin_profile = [v * w / margin_width for v in margins.resize((1, h), Image.BOX).getdata()]
+    else: margin_profile = [0] * h
+    # 行ごとの得点: ゲーム画面内らしい行 +1 / 余白まで模様が続く行 -1 。累積和で窓の合計を求める
+    scores = [(-1 if m >= 0.05 * 255 else 1 if b >= 0.05 * 255 else 0) for b, m in zip(band_profile, margin_profile)]
+    prefix = [0]
+    for score in scores: prefix.append(prefix[-1] + score)
+    best_top, best_score = None, None
+    for top in range(h - expected_height + 1):
+        window_score = prefix[top + expected_height] - prefix[top]
+        if best_score is None or window_score >= best_score: best_top, best_score = top, window_score # 同点なら下寄せ
+    if best_score < expected_height * 0.6: return None # 模様の少ない領域はゲーム画面ではない
+    return (columns[0] * scale, best_top * scale, min(img.width, columns[1] * scale), min(img.height, (best_top + expected_height) * scale))
+
+class SlotLayoutDetector:
+    """(ウィンドウ幅, 高さ, DPI) ごとにスロット座標を解決し、JSONファイルにキャッシュする
+    手動座標 (MISSION_SLOT_COORDINATES) を基準とし、ゲーム画面に対する相対位置でほかの大きさに拡大縮小する
+    基準は verify_calibration(画像, 手動座標) が真を返したキャプチャでだけ記録する (手動座標を作ったときと別のズームのキャプチャを基準にしないため)"""
+    def __init__(self, path=SLOT_LAYOUT_CACHE_FILE, manual_coords=MISSION_SLOT_COORDINATES, mode=SLOT_LAYOUT_MODE, persist=True, verify_calibration=None):
+        self.path = path; self.manual_coords = [tuple(c) for c in manual_coords]; self.mode = mode
+        self.verify_calibration = verify_calibration or manual_slots_readable
+        self.persist = persist # False ならファイルに書かず、検出結果を take_updates() で渡す (一括処理の子プロセス用)
+        self._updated_keys = set()
+        self._lock = threading.Lock()
+        self._saver = DeferredSaver(self._save_locked, self._lock)
+        self._layouts = {} # "幅x高さ@DPI" -> {"canvas": 検出したゲーム画面の矩形, "coords": スロット座標のリスト}
+        self._reference = None # ゲーム画面の大きさを1としたときの各スロットの相対座標
+        self._load()
+
+    @staticmethod
+    def key_for(size, dpi): return f"{size[0]}x{size[1]}@{dpi}"
+
+    def cached(self, window_key):
+        """キャッシュ済みのスロット座標 (検出不要)。未検出の大きさなら None"""
+        if self.mode == "manual": return list(self.manual_coords)
+        if window_key is None: return None
+        with self._lock:
+            layout = self._layouts.get(self.key_for(window_key[:2], window_key[2]))
+            return [tuple(c) for c in layout["coords"]] if layout else None
+
+    @staticmethod
+    def same_canvas(a, b, tolerance=SLOT_LAYOUT_CANVAS_TOLERANCE):
+        return a is not None and b is not None and all(abs(p - q) <= tolerance for p, q in zip(a, b))
+
+    def resolve(self, img):
+        """キャプチャ画像に対するスロット座標を返す。検出できなければ手動座標
+        同じウィンドウの大きさでもブラウザのズームでゲーム画面の位置は変わるため、毎回ゲーム画面を検出し、
+        キャッシュ済みの矩形と一致するときだけキャッシュの座標を使う"""
+        if self.mode == "manual": return list(self.manual_coords)
+        dpi = img.info.get("window_dpi", 96); layout_key = self.key_for(img.size, dpi)
+        canvas = detect_game_canvas(img)
+        with self._lock: cached_layout = self._layouts.get(layout_key)
+        if cached_layout and (canvas is None or self.same_canvas(canvas, cached_layout["canvas"])):
+            return [tuple(c) for c in cached_layout["coords"]]
+        if canvas is None:
+            print(f"スロット位置: ゲーム画面を検出できませんでした ({img.width}x{img.height})。手動設定の座標を使います。")
+            return list(self.manual_coords)
+        if cached_layout: print(f"スロット位置: ゲーム画面の位置が変わりました {tuple(cached_layout['canvas'])} -> {canvas} (ズームの変更など)。")
+        with self._lock:
+            if self._reference is None:
+                if not all(canvas[0] <= c[0] and canvas[1] <= c[1] and c[2] <= canvas[2] and c[3] <= canvas[3] for c in self.manual_coords):
+                    print(f"スロット位置: 手動設定の座標が検出したゲーム画面 {canvas} の外にあるため、キャリブレーションしません。")
+                    return list(self.manual_coords)
+                try: verified = self.verify_calibration(img, self.manual_coords)
+                except Exception as e: print(f"スロット位置: キャリブレーションの確認に失敗: {e}"); verified = False
+                if not verified: # ズームが手動座標を作ったときと違うか、任務画面でない
+                    print(f"スロット位置: 手動設定の座標から任務名を読み取れないため、ゲーム画面 {canvas} ではキャリブレーションしません。")
+                    return list(self.manual_coords)
+                cw, ch = canvas[2] - canvas[0], canvas[3] - canvas[1]
+                self._reference = [((c[0] - canvas[0]) / cw, (c[1] - canvas[1]) / ch, (c[2] - canvas[0]) / cw, (c[3] - canvas[1]) / ch) for c in self.manual_coords]
+                layout = list(self.manual_coords)
+                print(f"スロット位置: ゲーム画面 {canvas} を基準に手動設定の座標を記録しました。")
+            else:
+                layout = self.scale_reference(canvas)
+                print(f"スロット位置: ゲーム画面 {canvas} に合わせて座標を計算しました。")
+            self._layouts[layout_key] = {"canvas": list(canvas), "coords": [list(c) for c in layout]}
+            if self.persist: self._saver.mark_dirty()
+            else: self._updated_keys.add(layout_key)
+        return layout
+
+    def take_updates(self):
+        """persist=False のとき、前回から検出した配置とキャリブレーション結果を返して空にする"""
+        with self._lock:
+            updates = {"reference": self._reference, "layouts": {key: self._layouts[key] for key in self._updated_keys}}
+            self._updated_keys = set()
+        return updates
+
+    def merge(self, updates):
+        """子プロセスが take_updates() で返した検出結果を取り込む (保存はこのプロセスで行う)"""
+        if not updates["layouts"]: return
+        with self._lock:
+            if self._reference is None and updates["reference"]: self._reference = [tuple(r) for r in updates["reference"]]
+            self._layouts.update(updates["layouts"])
+            if self.persist: self._saver.mark_dirty()
+
+    def scale_reference(self, canvas):
+        cw, ch = canvas[2] - canvas[0], canvas[3] - canvas[1]
+        return [(canvas[0] + round(r[0] * cw), canvas[1] + round(r[1] * ch), canvas[0] + round(r[2] * cw), canvas[1] + round(r[3] * ch)) for r in self._reference]
+
+    def clear(self):
+        """検出結果を捨てる (ブラウザのズームを変えた時など)。キャリブレーション結果は残す"""
+        with self._lock: self._layouts.clear(); self._saver.mark_dirty()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f: data = json.load(f)
+            if [list(c) for c in self.manual_coords] != data.get("manual_coords"): # 手動座標が変わったらキャリブレーションし直す
+                print("スロット位置: 手動設定の座標が変更されたため、保存済みの検出結果を破棄します。"); return
+            if not data.get("reference_verified"): # 読み取りを確かめずに記録した以前の基準は、別のズームのキャプチャから作られた可能性がある
+                print("スロット位置: 確認されていない基準のため、保存済みの検出結果を破棄します。"); return
+            self._reference = [tuple(r) for r in data["reference"]] if data.get("reference") else None
+            # 以前の形式 (座標のリストだけ) はゲーム画面の矩形が無く照合できないため読み込まない
+            self._layouts = {key: layout for key, layout in data.get("layouts", {}).items() if isinstance(layout, dict)}
+        except FileNotFoundError: pass
+        except Exception as e: print(f"警告: スロット位置キャッシュの読み込みに失敗 (無視して続行): {e}")
+
+    def _save_locked(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            data = {"manual_coords": [list(c) for c in self.manual_coords], "reference": self._reference, "reference_verified": True, "layouts": self._layouts}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e: print(f"警告: スロット位置キャッシュの保存に失敗: {e}")
+
+_slot_layout_detector = None
+_slot_layout_detector_lock = threading.Lock()
+
+def get_slot_layout_detector():
+    global _slot_layout_detector
+    with _slot_layout_detector_lock:
+        if _slot_layout_detector is None: _slot_layout_detector = SlotLayoutDetector(mode=SLOT_LAYOUT_MODE)
+        return _slot_layout_detector
+
+# --- OCRの段階的な再試行 (カスケード) ---
+def compact_ocr_text(text):
+    """日本語のOCR結果に入る文字間の空白を詰める (英数字どうしの間の空白は残す)"""
+    return re.sub(r"(?<=[^\x00-\x7f])\s+|\s+(?=[^\x00-\x7f])", "", " ".join(text.split())) # 記号は残す (「[」「]」は is_plausible_title_pattern が鉤括弧として扱う)
+
+def words_to_text_and_confidence(words):
+    """[(テキスト, 信頼度), ...] から (連結テキスト, 平均信頼度) を返す。信頼度 -1 (単語でない) は除く"""
+    texts = [w for w, _ in words if w.strip()]
+    confidences = [c for w, c in words if w.strip() and c >= 0]
+    return " ".join(texts).strip(), (sum(confidences) / len(confidences) if confidences else 0.0)
+
+def manual_slots_readable(img, slot_coords_list):
+    """キャリブレーションの確認: 手動座標のスロットのどれかが、速い前処理で任務名として読めるか"""
+    backend = get_ocr_backend()
+    for coords in slot_coords_list:
+        data = backend.image_to_data(preprocess_slot_light(img.crop(coords)), psm=7)
+        text, confidence = words_to_text_and_confidence(list(zip(data["text"], (float(c) for c in data["conf"]))))
+        if is_acceptable_ocr_result(text, confidence): return True
+    return False
+
+_JAPANESE_CHAR_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uff66-\uff9f々〆「」『』]")
+
+def japanese_char_ratio(text):
+    """かな・漢字 (と鉤括弧) が文字数に占める割合"""
+    return len(_JAPANESE_CHAR_RE.findall(text)) / len(text) if text else 0.0
+
+def is_acceptable_ocr_result(text, confidence):
+    """カスケードを打ち切ってよい結果か: 任務名らしいパターンか、十分に高い信頼度
+    パターンに合わない任務名のための信頼度での採用は、十分な長さで大半がかな・漢字の結果か、任務名索引に一致する結果に限る
+    (信頼度の高い記号や英字の読み取りでWeb検索しないため)"""
+    if not text: return False
+    compact = compact_ocr_text(text)
+    if is_plausible_title_pattern(compact): return True
+    if confidence < OCR_CASCADE_MIN_CONFIDENCE: return False
+    if len(compact) >= OCR_CASCADE_MIN_CONFIDENT_LENGTH and japanese_char_ratio(compact) >= OCR_CASCADE_MIN_JAPANESE_RATIO: return True
+    return get_quest_index().lookup(normalize_mission_name(text))[0] is not None
+
+def _otsu_threshold(gray_img):
+    """グレースケール画像のヒストグラムから大津の方法で二値化のしきい値を求める"""
+    histogram = gray_img.histogram(); total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_bg = 0.0; weight_bg = 0; best_threshold = 127; best_variance = -1.0
+    for i, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0: continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0: break
+        sum_bg += i * count
+        mean_bg = sum_bg / weight_bg; mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance: best_variance, best_threshold = variance, i
+    return best_threshold
+
+def preprocess_slot_light(slot_img):
+    return ImageOps.autocontrast(slot_img.convert("L"))
+
+def preprocess_slot_binarized(slot_img, invert=False):
+    """拡大してから二値化し、背景が白・文字が黒になるよう向きを揃える (invert=True ならその逆)"""
+    gray = ImageOps.autocontrast(slot_img.convert("L"))
+    gray = gray.resize((gray.width * OCR_CASCADE_UPSCALE, gray.height * OCR_CASCADE_UPSCALE), Image.LANCZOS)
+    threshold = _otsu_threshold(gray)
+    binary = gray.point([0 if v <= threshold else 255 for v in range(256)])
+    border = [binary.getpixel((x, y)) for x in (0, binary.width - 1) for y in (0, binary.height // 2, binary.height - 1)]
+    dark_background = sum(1 for v in border if v == 0) > len(border) // 2
+    return ImageOps.invert(binary) if dark_background != invert else binary
+
+# (段階名, 前処理, Tesseractのページ分割モード)。上から順に試し、採用できる結果が出たら打ち切る
+OCR_CASCADE_TIERS = [
+    ("fast", preprocess_slot_light, 7),
+    ("binarized", preprocess_slot_binarized, 7),
+    ("inverted", lambda img: preprocess_slot_binarized(img, invert=True), 7),
+    ("raw_line", preprocess_slot_binarized, 13),
+]
+
+def ocr_slot_cascade(slot_img, slot_number_for_debug=0, start_tier=0):
+    """スロット画像を段階的にOCRし、(テキスト, 段階名, 平均信頼度) を返す
+    どの段階でも採用できなければ、任務名索引に一致した場合のみ最も信頼度の高い結果を返し、それ以外は "" を返す
+    (読み取りに失敗したゴミ文字列でWeb検索しないため)"""
+    backend = get_ocr_backend(); best = ("", None, -1.0)
+    tiers = OCR_CASCADE_TIERS[start_tier:] if OCR_CASCADE_ENABLED else OCR_CASCADE_TIERS[:1]
+    for tier_name, preprocess, psm in tiers:
+        data = backend.image_to_data(preprocess(slot_img), psm=psm)
+        text, confidence = words_to_text_and_confidence(list(zip(data["text"], (float(c) for c in data["conf"]))))
+        if not OCR_CASCADE_ENABLED: return text, tier_name, confidence
+        if stage_tracer.enabled: print(f"スロット {slot_number_for_debug}: OCR段階「{tier_name}」 信頼度{confidence:.0f}「{text}」") # 段階ごとの途中経過は計測中だけ表示する
+        if is_acceptable_ocr_result(text, confidence): return text, tier_name, confidence
+        if text and confidence > best[2]: best = (text, tier_name, confidence)
+    if best[0] and get_quest_index().lookup(best[0])[0]:
+        print(f"スロット {slot_number_for_debug}: 任務名らしくない結果ですが、任務名索引に一致したため採用します「{best[0]}」"); return best
+    print(f"スロット {slot_number_for_debug}: どの段階でも任務名らしい結果が得られなかったため、検索しません。")
+    return "", None, best[2]
+
+@traced_stage("ocr")
+def ocr_specific_slot(base_image, slot_coords, slot_number_for_debug=0, start_tier=0): # デバッグ用引数追加
     if not base_image: print("エラー: ocr_specific_slot 画像がありません。"); return ""
     try:
         x1, y1, x2, y2 = slot_coords
@@ -169,98 +1029,760 @@ def ocr_specific_slot(base_image, slot_coords, slot_number_for_debug=0): # デ
         # デバッグ用にスロット画像を保存したい場合は以下のコメントを解除
         # slot_img.save(f"debug_slot_{slot_number_for_debug}.png")
         # print(f"デバッグ: スロット{slot_number_for_debug}の画像を debug_slot_{slot_number_for_debug}.png として保存しました。")
-        text = pytesseract.image_to_string(slot_img, lang='jpn', config='--psm 7').strip()
+        cache = get_slot_ocr_cache(); cache_key = cache.key_for(slot_img) if cache else None
+        if cache:
+            cached_text = cache.get(cache_key)
+            if cached_text:
+                if stage_tracer.enabled: print(f"スロット {slot_number_for_debug}: OCRキャッシュヒット {cache.stats()}")
+                return cached_text
+        with trace_span("ocr_cascade", slot=slot_number_for_debug) as span:
+            text, tier_name, confidence = ocr_slot_cascade(slot_img, slot_number_for_debug, start_tier)
+            span.set(tier=tier_name, confidence=round(confidence, 1))
+        if tier_name: print(f"スロット {slot_number_for_debug}: 段階「{tier_name}」で確定 (信頼度{confidence:.0f})")
+        if cache and text: cache.put(cache_key, text) # 読み取れなかった結果はキャッシュしない (次のキャプチャで読み直す)
         return text
     except Exception as e: print(f"スロット {slot_number_for_debug} (座標 {slot_coords}) のOCRエラー: {e}"); return ""
 
-def find_mission_page_url_on_zekamashi(mission_name): # zekamashi.net 直接検索
+def build_slot_composite(base_image, slot_coords_list, gap=OCR_BATCH_SLOT_GAP, preprocess=None):
+    """各スロットの切り抜き (preprocess があればそれを通したもの) を縦に並べた合成画像を作り、(合成画像, [(y開始, y終了), ...]) を返す
+    座標が不正なスロットは範囲が None になる"""
+    crops = []
+    for coords in slot_coords_list:
+        x1, y1, x2, y2 = coords
+        crop = base_image.crop((x1, y1, x2, y2)) if x1 < x2 and y1 < y2 else None
+        crops.append(preprocess(crop) if crop is not None and preprocess else crop)
+    valid_crops = [c for c in crops if c is not None]
+    if not valid_crops: return None, [None] * len(crops)
+    width = max(c.width for c in valid_crops) + gap * 2
+    height = sum(c.height for c in valid_crops) + gap * (len(valid_crops) + 1)
+    composite = Image.new(valid_crops[0].mode, (width, height), "white")
+    y_ranges = []; y = gap
+    for crop in crops:
+        if crop is None: y_ranges.append(None); continue
+        # スロットごとの背景色(左上の画素)で帯を塗ってから貼り付け、切り抜きの縁が文字として誤認識されないようにする
+        composite.paste(crop.getpixel((0, 0)), (0, y - gap // 2, width, y + crop.height + gap // 2))
+        composite.paste(crop, (gap, y))
+        y_ranges.append((y - gap // 2, y + crop.height + gap // 2)); y += crop.height + gap
+    return composite, y_ranges
+
+@traced_stage("ocr_batch")
+def ocr_slots_batched(base_image, slot_coords_list):
+    """複数スロットを1回のTesseract呼び出しでOCRし、単語ごとのバウンディングボックスから各スロットへ振り分ける
+    戻り値は (slot_coords_list と同じ順のテキストのリスト, 一括OCRで読んだが任務名らしくなかった位置の集合)。
+    合成画像はカスケードの最初の段階と同じ前処理 (preprocess_slot_light) を通した切り抜きで作る。
+    採用しなかったスロットのテキストは ""。集合に入った位置は速い前処理を試し済みなので、呼び出し側は
+    ocr_specific_slot(..., start_tier=1) で強い前処理から読み直す。それ以外の "" (一括OCRが失敗した等) は最初の段階から読む"""
+    texts = [""] * len(slot_coords_list); rejected = set()
+    if not base_image: print("エラー: ocr_slots_batched 画像がありません。"); return texts, rejected
+    try:
+        # キャッシュに一致するスロットは合成画像に含めない
+        cache = get_slot_ocr_cache(); cache_keys = {}; pending_positions = []
+        for slot_pos, (x1, y1, x2, y2) in enumerate(slot_coords_list):
+            if cache and x1 < x2 and y1 < y2:
+                cache_keys[slot_pos] = cache.key_for(base_image.crop((x1, y1, x2, y2)))
+                cached_text = cache.get(cache_keys[slot_pos])
+                if cached_text: texts[slot_pos] = cached_text; continue
+            pending_positions.append(slot_pos)
+        if cache: print(f"一括OCR: キャッシュヒット {len(slot_coords_list) - len(pending_positions)}件 {cache.stats()}")
+        if not pending_positions: return texts, rejected
+        composite, y_ranges = build_slot_composite(base_image, [slot_coords_list[p] for p in pending_positions], preprocess=preprocess_slot_light)
+        if composite is None: print("警告: 一括OCRの対象となる有効なスロットがありません。"); return texts, rejected
+        data = get_ocr_backend().image_to_data(composite, psm=6)
+        words_per_slot = [[] for _ in pending_positions]
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            if not word: continue
+            center_y = data['top'][i] + data['height'][i] / 2
+            for slot_pos, y_range in enumerate(y_ranges):
+                if y_range and y_range[0] <= center_y < y_range[1]:
+                    words_per_slot[slot_pos].append((data['left'][i], word, float(data['conf'][i]))); break
+        for pending_idx, words in enumerate(words_per_slot):
+            slot_pos = pending_positions[pending_idx]
+            text, confidence = words_to_text_and_confidence([(w, c) for _, w, c in sorted(words, key=lambda lwc: lwc[0])])
+            if (OCR_CASCADE_ENABLED and not is_acceptable_ocr_result(text, confidence)) or not text:
+                print(f"一括OCR: {slot_pos + 1}番目の結果「{text}」は任務名らしくないため、個別に読み直します。"); rejected.add(slot_pos); continue
+            texts[slot_pos] = text
+            if cache and slot_pos in cache_keys: cache.put(cache_keys[slot_pos], texts[slot_pos])
+        return texts, rejected
+    except Exception as e: print(f"一括OCRエラー: {e}"); return texts, set() # 途中で失敗したスロットは最初の段階から個別に読む
+
+def ocr_selected_slots(base_image, slot_coords_list, selected_indices):
+    """選択されたスロットをOCRし {スロット番号(0始まり): テキスト} を返す (読み取れなかったスロットは "")
+    2つ以上なら一括OCRし、一括で読めなかったスロットだけ強い前処理から個別に読み直す"""
+    batched_texts = {}; batch_rejected = set()
+    if OCR_BATCH_MODE and len(selected_indices) > 1:
+        batch_result, rejected_positions = ocr_slots_batched(base_image, [slot_coords_list[i] for i in selected_indices])
+        batched_texts = dict(zip(selected_indices, batch_result)); batch_rejected = {selected_indices[p] for p in rejected_positions}
+    texts = {}
+    for slot_idx in selected_indices:
+        # 一括OCRで速い前処理を試して不採用だったスロットだけ、次の段階から読み直す
+        texts[slot_idx] = batched_texts.get(slot_idx) or ocr_specific_slot(base_image, slot_coords_list[slot_idx], slot_idx + 1, start_tier=1 if slot_idx in batch_rejected else 0)
+    return texts
+
+def parse_slot_spec(choice_str, slot_count):
+    """スロット指定 ("all" または "1,3" のようなカンマ区切り) を0始まりの番号の昇順リストにする
+    範囲外の番号や数字でない指定は ValueError。有効な番号が1つも無ければ空リスト"""
+    if choice_str.strip().lower() == 'all': return list(range(slot_count))
+    indices = []
+    for p_str in choice_str.split(','):
+        s_idx_str = p_str.strip()
+        if not s_idx_str: continue
+        try: idx = int(s_idx_str) - 1
+        except ValueError: raise ValueError("番号をカンマ区切りで。例:1,2,3 or all")
+        if not 0 <= idx < slot_count: raise ValueError(f"{idx+1}は無効な番号。")
+        if idx not in indices: indices.append(idx)
+    return sorted(indices)
+
+# --- 共有HTTPセッション ---
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def _accept_encoding():
+    encodings = ["gzip", "deflate"]
+    for brotli_module in ("brotli", "brotlicffi"): # urllib3 はどちらかがあれば br を展開できる
+        try: __import__(brotli_module); encodings.append("br"); break
+        except ImportError: continue
+    return ", ".join(encodings)
+
+def get_http_session():
+    """全スレッドで共有する requests.Session を返す (キープアライブで同じホストへの接続を使い回す)"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=LOOKUP_MAX_WORKERS, pool_maxsize=LOOKUP_MAX_WORKERS * 2)
+            session.mount("https://", adapter); session.mount("http://", adapter)
+            session.headers.update(HTTP_HEADERS)
+            session.headers["Accept-Encoding"] = _accept_encoding() if HTTP_ENABLE_COMPRESSION else "identity"
+            _http_session = session
+        return _http_session
+
+# --- 締め切りとホストごとの応答時間・遮断 ---
+class LookupDeadlineExceeded(Exception):
+    """任務1件の検索に割り当てた時間を使い切ったことを表す"""
+
+class HostUnavailable(Exception):
+    """ホストが遮断中 (直前に失敗が続いたか、アクセスを制限された) のため問い合わせなかったことを表す"""
+    def __init__(self, host, retry_after):
+        super().__init__(f"{host} は一時的に遮断中です (あと{retry_after:.0f}秒)"); self.host = host; self.retry_after = retry_after
+
+class LookupBudget:
+    """任務1件の検索 (情報源の決定 -> ページ取得 -> 解析) 全体の締め切り
+    各段階は stage() で、後の段階の分を残した短い締め切りを受け取る"""
+    def __init__(self, seconds=LOOKUP_DEADLINE_SECONDS, deadline=None):
+        self.deadline = deadline if deadline is not None else time.monotonic() + seconds
+
+    def remaining(self): return max(0.0, self.deadline - time.monotonic())
+
+    def stage(self, limit, reserve=0.0):
+        """limit 秒以内かつ、全体の締め切りの reserve 秒前までの締め切りを返す。時間が足りなければ LookupDeadlineExceeded"""
+        available = self.remaining() - reserve
+        if available < LOOKUP_MIN_STAGE_SECONDS: raise LookupDeadlineExceeded(f"残り{self.remaining():.1f}秒では次の段階を始められません。")
+        return LookupBudget(deadline=time.monotonic() + min(limit, available))
+
+    def timeout(self, ceiling):
+        """1回のリクエストに使うタイムアウト (ceiling 以下、残り時間以下)"""
+        remaining = self.remaining()
+        if remaining < LOOKUP_MIN_STAGE_SECONDS: raise LookupDeadlineExceeded(f"残り{remaining:.1f}秒ではリクエストできません。")
+        return min(ceiling, remaining)
+
+class HostHealth:
+    """1つのホストの応答時間 (指数移動平均と揺らぎ) と遮断状態"""
+    __slots__ = ("smoothed", "variance", "samples", "consecutive_failures", "open_until", "open_seconds", "probing", "failures", "rejected")
+    def __init__(self):
+        self.smoothed = None; self.variance = 0.0; self.samples = 0
+        self.consecutive_failures = 0; self.open_until = 0.0; self.open_seconds = CIRCUIT_OPEN_SECONDS; self.probing = False
+        self.failures = 0; self.rejected = 0
+
+class HostHealthRegistry:
+    """ホストごとに応答時間からタイムアウトを決め、失敗や制限が続くホストを一時的に遮断する
+    遮断が明けたら1件だけ試し (半開状態)、成功すれば元に戻し、失敗すれば遮断時間を倍にする"""
+    def __init__(self):
+        self._hosts = {}; self._lock = threading.Lock()
+
+    @staticmethod
+    def host_of(url): return urllib.parse.urlparse(url).netloc or url
+
+    def _health(self, host):
+        health = self._hosts.get(host)
+        if health is None: health = self._hosts[host] = HostHealth()
+        return health
+
+    def acquire(self, host):
+        """問い合わせてよければ何もしない。遮断中 (または遮断明けの試行中) なら HostUnavailable"""
+        with self._lock:
+            health = self._health(host); now = time.monotonic()
+            if health.open_until:
+                if now < health.open_until or health.probing:
+                    health.rejected += 1; raise HostUnavailable(host, max(health.open_until - now, 0.0))
+                health.probing = True # 遮断明けの最初の1件だけ通す
+
+    def timeout_for(self, host, ceiling):
+        """観測した応答時間から決めたタイムアウト (HTTP_TIMEOUT_MIN_SECONDS 〜 ceiling)。観測が無ければ ceiling"""
+        if not HTTP_ADAPTIVE_TIMEOUT_ENABLED: return ceiling
+        with self._lock:
+            health = self._hosts.get(host)
+            if not health or health.smoothed is None: return ceiling
+            return min(ceiling, max(HTTP_TIMEOUT_MIN_SECONDS, health.smoothed + 4 * health.variance))
+
+    def record_success(self, host, elapsed):
+        with self._lock:
+            health = self._health(host)
+            if health.smoothed is None: health.smoothed = elapsed; health.variance = elapsed / 2
+            else:
+                health.variance = 0.75 * health.variance + 0.25 * abs(health.smoothed - elapsed)
+                health.smoothed = 0.875 * health.smoothed + 0.125 * elapsed
+            health.samples += 1; health.consecutive_failures = 0
+            if health.open_until: print(f"{host}: 遮断明けの試行に成功したため、遮断を解除します。")
+            health.open_until = 0.0; health.open_seconds = CIRCUIT_OPEN_SECONDS; health.probing = False
+
+    def record_failure(self, host, throttled=False, retry_after=None):
+        """失敗を記録する。throttled (429/503 など) なら回数に関係なく直ちに遮断する"""
+        with self._lock:
+            health = self._health(host); health.failures += 1; health.consecutive_failures += 1
+            was_probing = health.probing; health.probing = False
+            if not (throttled or was_probing or health.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD): return
+            if was_probing: health.open_seconds = min(health.open_seconds * 2, CIRCUIT_MAX_OPEN_SECONDS)
+            open_seconds = min(max(health.open_seconds, retry_after or 0.0), CIRCUIT_MAX_OPEN_SECONDS)
+            health.open_until = time.monotonic() + open_seconds
+            print(f"{host}: {'アクセス制限' if throttled else f'{health.consecutive_failures}回連続の失敗'}のため {open_seconds:.0f}秒間遮断します。")
+
+    def is_open(self, host):
+        with self._lock:
+            health = self._hosts.get(host)
+            return bool(health and health.open_until and (time.monotonic() < health.open_until or health.probing))
+
+    def stats(self):
+        """{ホスト: {"timeout_s", "avg_ms", "samples", "failures", "rejected", "open_s"}}"""
+        with self._lock: hosts = list(self._hosts.items())
+        now = time.monotonic(); result = {}
+        for host, health in hosts:
+            result[host] = {"timeout_s": round(self.timeout_for(host, max(HTTP_TIMEOUTS.values())), 1), "avg_ms": round((health.smoothed or 0.0) * 1000, 1), "samples": health.samples,
+                            "failures": health.failures, "rejected": health.rejected, "open_s": round(max(health.open_until - now, 0.0), 1)}
+        return result
+
+host_health = HostHealthRegistry()
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After") if response is not None else None
+    try: return float(value) if value else None
+    except ValueError: return None # HTTP日付形式は扱わず、既定の遮断時間を使う
+
+def call_with_host_health(host, func, timeout_ceiling, budget=None):
+    """func(timeout) を遮断・適応タイムアウト・締め切りの下で呼ぶ (requests を直接使わない googlesearch 用)"""
+    timeout = host_health.timeout_for(host, timeout_ceiling)
+    if budget: timeout = budget.timeout(timeout)
+    host_health.acquire(host)
+    started = time.monotonic()
+    try: result = func(timeout)
+    except Exception as e:
+        response = getattr(e, "response", None); status = getattr(response, "status_code", None)
+        host_health.record_failure(host, throttled=status in (429, 503), retry_after=_retry_after_seconds(response)); raise
+    host_health.record_success(host, time.monotonic() - started)
+    return result
+
+# --- HTTPレスポンスキャッシュ ---
+class FetchedPage:
+    """fetch_page の結果。from_cache は本文をキャッシュから返したかどうか (304での再検証を含む)
+    truncated はコンテンツエリアの終わりで読むのをやめた (text がそこまでしか無い) かどうか"""
+    def __init__(self, url, text, status_code=200, from_cache=False, revalidated=False, truncated=False, bytes_read=None):
+        self.url = url; self.text = text; self.status_code = status_code
+        self.from_cache = from_cache; self.revalidated = revalidated
+        self.truncated = truncated; self.bytes_read = bytes_read
+
+class HttpResponseCache:
+    """URLをキーにしたレスポンス本文のディスクキャッシュ
+    ETag/Last-Modified を保存して条件付きリクエストに使い、合計サイズの上限を超えたらLRUで削除する"""
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir; self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None # キー -> [本文サイズ, 最終アクセス時刻] (初回使用時にディレクトリを走査して作る)
+        self._pending_meta = {} # キー -> まだ書き出していないメタ情報 (最終アクセス時刻・再検証時刻の更新)
+        self._saver = DeferredSaver(self._save_pending_meta_locked, self._lock)
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".body"
+
+    @staticmethod
+    def key_for(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def ttl_for(url):
+        host = urllib.parse.urlparse(url).netloc.lower()
+        for domain, ttl in HTTP_CACHE_TTL_BY_DOMAIN.items():
+            if host == domain or host.endswith("." + domain): return ttl
+        return HTTP_CACHE_DEFAULT_TTL
+
+    def _ensure_index_locked(self):
+        if self._index is not None: return
+        self._index = {}
+        if not os.path.isdir(self.cache_dir): return
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".json"): continue
+            try:
+                with open(os.path.join(self.cache_dir, file_name), encoding="utf-8") as f: meta = json.load(f)
+                self._index[file_name[:-5]] = [meta["size"], meta["last_access"]]
+            except Exception: continue
+
+    def get(self, url):
+        """(メタ情報, 本文bytes) を返す。無ければ None"""
+        key = self.key_for(url); meta_path, body_path = self._paths(key)
+        with self._lock:
+            try:
+                meta = self._pending_meta.get(key)
+                if meta is None:
+                    with open(meta_path, encoding="utf-8") as f: meta = json.load(f)
+                with open(body_path, "rb") as f: body = f.read()
+            except (FileNotFoundError, ValueError): return None
+            self._touch_locked(key, meta)
+            return meta, body
+
+    def is_fresh(self, url, meta):
+        return time.time() - meta["fetched_at"] < self.ttl_for(url)
+
+    def mark_revalidated(self, url, meta):
+        """304 Not Modified を受け取ったエントリの取得時刻を更新する"""
+        with self._lock:
+            meta["fetched_at"] = time.time()
+            self._touch_locked(self.key_for(url), meta)
+
+    def store(self, url, body, encoding, etag=None, last_modified=None, truncated=False):
+        key = self.key_for(url); meta_path, body_path = self._paths(key); now = time.time()
+        meta = {"url": url, "encoding": encoding, "etag": etag, "last_modified": last_modified, "fetched_at": now, "last_access": now, "size": len(body), "truncated": truncated}
+        with self._lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True); self._ensure_index_locked()
+                with open(body_path + ".tmp", "wb") as f: f.write(body)
+                os.replace(body_path + ".tmp", body_path)
+                self._write_meta_locked(meta_path, meta); self._pending_meta.pop(key, None)
+                self._index[key] = [len(body), now]
+                self._evict_locked()
+            except Exception as e: print(f"警告: HTTPキャッシュへの保存に失敗: {e}")
+
+    def _touch_locked(self, key, meta):
+        """メタ情報の更新はメモリ上に留め、DeferredSaver でまとめて書き出す (読むたびにファイルを書き直さない)"""
+        meta["last_access"] = time.time(); self._pending_meta[key] = meta
+        self._ensure_index_locked(); self._index[key] = [meta["size"], meta["last_access"]]
+        self._saver.mark_dirty()
+
+    def _save_pending_meta_locked(self):
+        for key, meta in self._pending_meta.items():
+            meta_path = self._paths(key)[0]
+            if not os.path.exists(meta_path): continue # 削除済みのエントリは書き戻さない
+            try: self._write_meta_locked(meta_path, meta)
+            except Exception as e: print(f"警告: HTTPキャッシュのメタ情報更新に失敗: {e}")
+        self._pending_meta.clear()
+
+    @staticmethod
+    def _write_meta_locked(meta_path, meta):
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _evict_locked(self):
+        total = sum(size for size, _ in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k][1]):
+            if total <= self.max_bytes: break
+            total -= self._index.pop(key)[0]; self._pending_meta.pop(key, None)
+            for path in self._paths(key):
+                try: os.remove(path)
+                except OSError: pass
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+def get_http_cache():
+    """HTTPキャッシュを返す (無効化されている場合は None)"""
+    global _http_cache
+    if not HTTP_CACHE_ENABLED: return None
+    with _http_cache_lock:
+        if _http_cache is None: _http_cache = HttpResponseCache()
+        return _http_cache
+
+def fetch_page(url, headers=None, timeout=HTTP_TIMEOUTS["page"], before_request=None, budget=None, stream=False, on_section=None, accept_truncated=True):
+    """URLのHTMLを取得する。TTL内のキャッシュはネットワークを使わずに返し、
+    期限切れのものは If-None-Match / If-Modified-Since で再検証する (304なら本文は再取得しない)
+    timeout はタイムアウトの上限で、実際にはホストの応答時間と budget (LookupBudget) の残り時間から決める。
+    ホストが遮断中か時間が足りないときは、期限切れのキャッシュがあればそれを返し、無ければ HostUnavailable / LookupDeadlineExceeded
+    before_request は実際にネットワークへ問い合わせる直前に呼ばれる (先読みの間隔調整用)
+    stream=True なら本文を受信しながら解析し、コンテンツエリアが閉じたところで読むのをやめる (read_until_content_end)
+    accept_truncated=False なら途中で打ち切ったキャッシュは無いものとして扱い、全体を取得し直す"""
+    cache = get_http_cache()
+    cached = cache.get(url) if cache else None
+    if cached and not accept_truncated and cached[0].get("truncated"): cached = None
+    request_headers = dict(headers or {})
+    if cached:
+        meta, body = cached
+        if cache.is_fresh(url, meta):
+            print(f"HTTPキャッシュヒット: {url}")
+            return FetchedPage(url, body.decode(meta["encoding"] or "utf-8", errors="replace"), from_cache=True, truncated=meta.get("truncated", False))
+        if not meta.get("truncated"): # 途中で打ち切った本文は304で延命せず、期限が切れたら取り直す (打ち切り位置の判定が誤っていた場合に備える)
+            if meta.get("etag"): request_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"): request_headers["If-Modified-Since"] = meta["last_modified"]
+    host = HostHealthRegistry.host_of(url)
+    try:
+        request_timeout = host_health.timeout_for(host, timeout)
+        if budget: request_timeout = budget.timeout(request_timeout)
+        host_health.acquire(host)
+    except (HostUnavailable, LookupDeadlineExceeded) as e:
+        if not cached: raise
+        meta, body = cached
+        print(f"HTTPキャッシュ (期限切れ) を使用: {e}")
+        return FetchedPage(url, body.decode(meta["encoding"] or "utf-8", errors="replace"), from_cache=True, truncated=meta.get("truncated", False))
+    if before_request: before_request()
+    started = time.monotonic()
+    try: response = get_http_session().get(url, headers=request_headers, timeout=request_timeout, stream=stream)
+    except requests.RequestException: host_health.record_failure(host); raise
+    if response.status_code in (429, 503): host_health.record_failure(host, throttled=True, retry_after=_retry_after_seconds(response))
+    elif response.status_code >= 500: host_health.record_failure(host)
+    else: host_health.record_success(host, time.monotonic() - started) # 404なども「ホストは応答している」とみなす
+    if response.status_code == 304 and cached:
+        response.close(); meta, body = cached; cache.mark_revalidated(url, meta)
+        print(f"HTTPキャッシュ再検証 (304 Not Modified): {url}")
+        return FetchedPage(url, body.decode(meta["encoding"] or "utf-8", errors="replace"), from_cache=True, revalidated=True, truncated=meta.get("truncated", False))
+    if stream:
+        try:
+            response.raise_for_status()
+            adapter = get_site_adapter(url) # 打ち切るのはサイト用の計画が探すコンテンツエリアの終わり (見つからなければ全体を読むので、汎用の計画で探し直せる)
+            text, truncated, bytes_read = read_until_content_end(response, on_section, area_classes=adapter.content_area_classes, area_tag_name=adapter.content_area_tag)
+        except requests.HTTPError: raise # ステータスコードの分は上で記録済み (二重に失敗を数えない)
+        except requests.RequestException: host_health.record_failure(host); raise # 受信途中の切断など
+        finally: response.close() # 途中でやめた場合は接続ごと閉じる (残りは受信しない)
+        if truncated: print(f"コンテンツエリアの終わりで受信を終了しました ({bytes_read // 1024}KB): {url}")
+        if cache: cache.store(url, text.encode("utf-8"), "utf-8", response.headers.get("ETag"), response.headers.get("Last-Modified"), truncated=truncated)
+        return FetchedPage(url, text, status_code=response.status_code, truncated=truncated, bytes_read=bytes_read)
+    response.raise_for_status(); response.encoding = response.apparent_encoding
+    if cache: cache.store(url, response.content, response.encoding, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return FetchedPage(url, response.text, status_code=response.status_code, bytes_read=len(response.content))
+
+# --- 攻略ページの逐次取得 ---
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_-]+)""", re.IGNORECASE)
+
+def _stream_encoding(response, first_chunk):
+    """Content-Type の charset、無ければ先頭の <meta charset> から文字コードを決める (apparent_encoding は本文全体が要るため使わない)"""
+    content_type = response.headers.get("Content-Type", "")
+    if "charset=" in content_type: return content_type.split("charset=")[-1].split(";")[0].strip().strip('"') or "utf-8"
+    meta_match = _META_CHARSET_RE.search(first_chunk[:4096])
+    encoding = meta_match.group(1).decode("ascii") if meta_match else "utf-8"
+    try: codecs.lookup(encoding); return encoding
+    except LookupError: return "utf-8"
+
+class ContentAreaTracker(html.parser.HTMLParser):
+    """受信途中のHTMLを少しずつ受け取り、主要コンテンツエリア (area_classes を持つ最初の要素。area_tag_name があればその要素名のものに限る) の
+    開始・節 (h2見出し) の区切り・終了の位置 (文字オフセット) を記録する。木は作らない"""
+    def __init__(self, on_section=None, area_classes=None, area_tag_name=None):
+        super().__init__(convert_charrefs=False)
+        self.area_classes = area_classes or CONTENT_AREA_CLASSES; self.area_tag_name = area_tag_name
+        self.on_section = on_section # on_section(その節の直前までのHTML) を h2 の開始ごとに呼ぶ
+        self._parts = []; self._length = 0; self._line_starts = [0]
+        self.area_tag = None; self.area_depth = 0; self.area_start = None; self.area_end = None
+        self.section_starts = []
+
+    @property
+    def text(self):
+        if len(self._parts) > 1: self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def feed_text(self, chunk):
+        for newline in re.finditer("\n", chunk): self._line_starts.append(self._length + newline.end())
+        self._parts.append(chunk); self._length += len(chunk)
+        if self.area_end is None: self.feed(chunk)
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if self.area_end is not None: return
+        if self.area_tag is None:
+            if self.area_tag_name and tag != self.area_tag_name: return
+            classes = (dict(attrs).get("class") or "").split()
+            if any(cls in self.area_classes for cls in classes): self.area_tag = tag; self.area_depth = 1; self.area_start = self._offset()
+            return
+        if tag == self.area_tag: self.area_depth += 1
+        elif tag == "h2":
+            section_start = self._offset(); self.section_starts.append(section_start)
+            if self.on_section: self.on_section(self.text[:section_start])
+
+    def handle_endtag(self, tag):
+        if self.area_end is not None or tag != self.area_tag: return
+        self.area_depth -= 1
+        if self.area_depth == 0: self.area_end = self.text.index(">", self._offset()) + 1
+
+def read_until_content_end(response, on_section=None, chunk_bytes=HTTP_STREAM_CHUNK_BYTES, area_classes=None, area_tag_name=None):
+    """ストリーミングのレスポンスを読み、コンテンツエリアが閉じたらそこで打ち切る
+    戻り値は (コンテンツエリアの終わりまでのHTML, 打ち切ったか, 読んだバイト数)。
+    コンテンツエリアが見つからないページは最後まで読む (parse_guide_page が全体を解析するため)"""
+    tracker = ContentAreaTracker(on_section, area_classes, area_tag_name); decoder = None; bytes_read = 0
+    for chunk in response.iter_content(chunk_size=chunk_bytes):
+        if not chunk: continue
+        if decoder is None: decoder = codecs.getincrementaldecoder(_stream_encoding(response, chunk))(errors="replace")
+        bytes_read += len(chunk); tracker.feed_text(decoder.decode(chunk))
+        if tracker.area_end is not None: return tracker.text[:tracker.area_end], True, bytes_read
+    if decoder: tracker.feed_text(decoder.decode(b"", final=True))
+    return tracker.text, False, bytes_read
+
+# --- ローカル任務名索引 ---
+def normalize_mission_name(mission_name):
+    """OCRで読み取った任務名から検索の邪魔になる記号を除き、空白を詰める"""
     cleaned_name = mission_name.replace("|", " ").replace("!", "").replace("[", "").replace("]", "")
-    cleaned_name = " ".join(cleaned_name.split()).strip()
+    return " ".join(cleaned_name.split()).strip()
+
+_QUEST_KEY_DROP_CHARS = set("「」『』【】[]()（）〈〉<>|!?！？.,、。・ 　\"'")
+
+def quest_match_key(mission_name):
+    """索引照合用のキー。全角/半角を統一し、OCRで化けやすい括弧・記号・空白を取り除く"""
+    text = unicodedata.normalize("NFKC", normalize_mission_name(mission_name))
+    return "".join(ch for ch in text if ch not in _QUEST_KEY_DROP_CHARS and not ch.isspace())
+
+_QUEST_NUMERAL_RE = re.compile(r"\d+|[〇一二三四五六七八九十百千]+")
+
+def quest_numerals(key):
+    """任務名に含まれる数字・漢数字の並び (「第二駆逐隊」と「第三駆逐隊」のような1字違いの別任務を区別する)"""
+    return _QUEST_NUMERAL_RE.findall(key)
+
+def quest_keys_match(key, cand_key, min_score=QUEST_INDEX_MIN_SCORE):
+    """照合キー同士の類似度 (0〜1) を返す。数字・漢数字が一致しないか min_score に届かなければ 0"""
+    if key == cand_key: return 1.0
+    if quest_numerals(key) != quest_numerals(cand_key): return 0.0
+    score = difflib.SequenceMatcher(None, key, cand_key).ratio()
+    return score if score >= min_score else 0.0
+
+def quest_name_from_page_title(title):
+    """攻略ページの <title> や一覧のリンク文字列 (例:「【艦これ】任務「「第六駆逐隊」を編成せよ！」の攻略｜...」) から任務名の部分を取り出す"""
+    text = re.split(r"の攻略|｜|\|| - ", re.sub(r"【[^】]*】", "", title))[0].strip()
+    wrapped = re.fullmatch(r"任務[「『](.+)[」』]", text)
+    return wrapped.group(1) if wrapped else text
+
+def _char_bigrams(key):
+    return {key[i:i + 2] for i in range(len(key) - 1)} if len(key) > 1 else {key}
+
+class QuestNameIndex:
+    """任務名 -> 攻略ページURL のローカル索引
+    文字バイグラムで候補を絞り込み、編集距離ベースの類似度 (difflib) で最終スコアを付ける"""
+
+    def __init__(self, path=QUEST_INDEX_FILE, bundled_path=QUEST_INDEX_BUNDLED_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._saver = DeferredSaver(self._save_locked, self._lock)
+        self._entries = {} # URL -> {"title", "url", "site", "aliases"}
+        self._keys = {} # 照合キー -> URL
+        self._bigram_postings = {} # バイグラム -> 照合キーの集合
+        for file_path in (bundled_path, path):
+            self._load(file_path)
+
+    def _load(self, file_path):
+        try:
+            with open(file_path, encoding="utf-8") as f: records = json.load(f).get("entries", [])
+            for rec in records: self._add_locked(rec["title"], rec["url"], rec.get("site", ""), rec.get("aliases", []))
+            print(f"任務名索引を読み込みました: {file_path} ({len(records)}件)")
+        except FileNotFoundError: pass
+        except Exception as e: print(f"警告: 任務名索引の読み込みに失敗 (無視して続行): {file_path}: {e}")
+
+    def _add_locked(self, title, url, site, aliases=()):
+        entry = self._entries.setdefault(url, {"title": title, "url": url, "site": site, "aliases": []})
+        for name in [title, *aliases]:
+            if name != entry["title"] and name not in entry["aliases"]: entry["aliases"].append(name)
+            key = quest_match_key(name)
+            if not key: continue
+            self._keys[key] = url
+            for bigram in _char_bigrams(key): self._bigram_postings.setdefault(bigram, set()).add(key)
+
+    def add(self, title, url, site, aliases=()):
+        """検索で解決できた任務名を索引に追加する (保存は DeferredSaver でまとめて行う)"""
+        with self._lock:
+            self._add_locked(title, url, site, aliases)
+            self._saver.mark_dirty()
+
+    def lookup(self, mission_name, candidate_limit=10):
+        """最も近い登録済み任務を (エントリ, スコア) で返す。採用スコアに届かなければ (None, 最高スコア)"""
+        key = quest_match_key(mission_name)
+        if not key: return None, 0.0
+        # OCR結果が任務名のパターンに合わないときは誤照合を避けるため閾値を上げる
+        plausible = is_plausible_title_pattern(normalize_mission_name(mission_name))
+        min_score = QUEST_INDEX_MIN_SCORE if plausible else QUEST_INDEX_MIN_SCORE_IMPLAUSIBLE
+        with self._lock:
+            if key in self._keys: return self._entries[self._keys[key]], 1.0
+            query_bigrams = _char_bigrams(key); overlap_counts = {}
+            for bigram in query_bigrams:
+                for cand_key in self._bigram_postings.get(bigram, ()): overlap_counts[cand_key] = overlap_counts.get(cand_key, 0) + 1
+            # バイグラムのDice係数で上位候補を選び、編集距離ベースの類似度で並べ直す
+            shortlist = sorted(overlap_counts, key=lambda k: -2 * overlap_counts[k] / (len(query_bigrams) + len(_char_bigrams(k))))[:candidate_limit]
+            best_key, best_score = None, 0.0; query_numerals = quest_numerals(key)
+            for cand_key in shortlist:
+                if quest_numerals(cand_key) != query_numerals: continue # 数字違いは別の任務
+                score = difflib.SequenceMatcher(None, key, cand_key).ratio()
+                if score > best_score: best_key, best_score = cand_key, score
+            if best_key is None or best_score < min_score: return None, best_score
+            return self._entries[self._keys[best_key]], best_score
+
+    def _save_locked(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump({"entries": list(self._entries.values())}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception as e: print(f"警告: 任務名索引の保存に失敗: {e}")
+
+_quest_index = None
+_quest_index_lock = threading.Lock()
+
+def get_quest_index():
+    global _quest_index
+    with _quest_index_lock:
+        if _quest_index is None: _quest_index = QuestNameIndex()
+        return _quest_index
+
+ZEKAMASHI_MIN_SEARCH_SCORE = 3 # サイト内検索結果を採用する最低スコア (調整可能)
+
+def is_zekamashi_no_results_page(soup):
+    """サイト内検索が「結果なし」ページを返したかどうか"""
+    no_results_tag = soup.find(string=lambda text: text and ("何も見つかりませんでした" in text or "お探しのページは見つかりませんでした" in text))
+    return bool(no_results_tag and (soup.find(class_="no-results") or soup.find(id="content", class_="no-results") or soup.find("div", class_="error404"))) # 色々な「結果なし」パターン
+
+def search_result_link_tags(soup):
+    """検索結果・一覧ページの各記事からタイトルのリンク (a要素) を順に返す"""
+    search_results_articles = soup.select('article.post, article.page, div.search-entry, div.post-item') # 一般的なコンテナ
+    if not search_results_articles : search_results_articles = soup.find_all('article') # フォールバック
+    for article in search_results_articles:
+        title_tag = article.find(['h1', 'h2', 'h3'], class_='entry-title') 
+        if not title_tag: title_tag = article.find(['h1', 'h2', 'h3']) # クラスなしも
+        link_tag = None
+        if title_tag:
+            link_tag = title_tag.find('a', href=True)
+            if not link_tag and title_tag.name == 'a' and title_tag.has_attr('href'): link_tag = title_tag
+        if not link_tag: link_tag = article.find('a', href=True) # article直下の最初のリンクも候補に
+        if link_tag and link_tag.has_attr('href'): yield link_tag
+
+def score_zekamashi_search_results(soup, cleaned_name):
+    """サイト内検索結果の各記事リンクを任務名のキーワード一致で採点し、(最良のURL, スコア) を返す"""
+    query_keywords = [kw for kw in cleaned_name.split() if len(kw) > 1 and not kw.isdigit()]
+    best_match_url = None; highest_score = 0
+
+    for link_tag in search_result_link_tags(soup):
+        link_text = link_tag.get_text(strip=True); href = link_tag['href']; current_score = 0
+        for kw in query_keywords:
+            if kw in link_text: current_score += 3 # タイトルテキストの一致を重視
+            elif kw.lower() in link_text.lower(): current_score +=2 # 小文字での一致も少し加点
+            elif kw in href: current_score +=1 
+        if "任務" in link_text or "/任務" in href or "quest" in href.lower(): current_score += 2
+        if "編成例" in link_text: current_score +=1 # 編成例ページは関連性が高いかも
+        
+        if current_score > highest_score:
+            highest_score = current_score; best_match_url = urllib.parse.urljoin("https://zekamashi.net/", href)
+    return best_match_url, highest_score
+
+def find_mission_page_url_on_zekamashi(mission_name, budget=None, stop_event=None): # zekamashi.net 直接検索 (stop_event がセットされたら結果を捨てる)
+    cleaned_name = normalize_mission_name(mission_name)
     if not cleaned_name: print("エラー: 検索名が空(zekamashi)"); return None
     print(f"\n「{cleaned_name}」で「zekamashi.net」内を検索中...")
     encoded_query = urllib.parse.quote(cleaned_name)
     search_url = f"https://zekamashi.net/?s={encoded_query}"
     print(f"検索URL (zekamashi): {search_url}")
+    if stop_event and stop_event.is_set(): print("zekamashi.net: ほかの情報源で確定したため検索しません。"); return None
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(search_url, headers=headers, timeout=10)
-        response.raise_for_status(); response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, 'html.parser')
-        no_results_tag = soup.find(string=lambda text: text and ("何も見つかりませんでした" in text or "お探しのページは見つかりませんでした" in text))
-        if no_results_tag and (soup.find(class_="no-results") or soup.find(id="content", class_="no-results") or soup.find("div", class_="error404")): # 色々な「結果なし」パターン
+        response = fetch_page(search_url, timeout=HTTP_TIMEOUTS["site_search"], budget=budget)
+        if stop_event and stop_event.is_set(): print("zekamashi.net: ほかの情報源で確定したため結果を破棄しました。"); return None
+        soup = parse_search_results_page(response.text)
+        if is_zekamashi_no_results_page(soup):
             print("zekamashi.net: 指定された条件では何も見つかりませんでした。"); return None
         
-        search_results_articles = soup.select('article.post, article.page, div.search-entry, div.post-item') # 一般的なコンテナ
-        if not search_results_articles : search_results_articles = soup.find_all('article') # フォールバック
-
-        query_keywords = [kw for kw in cleaned_name.split() if len(kw) > 1 and not kw.isdigit()]
-        best_match_url = None; highest_score = 0
-
-        for article in search_results_articles:
-            title_tag = article.find(['h1', 'h2', 'h3'], class_='entry-title') 
-            if not title_tag: title_tag = article.find(['h1', 'h2', 'h3']) # クラスなしも
-            link_tag = None
-            if title_tag:
-                link_tag = title_tag.find('a', href=True)
-                if not link_tag and title_tag.name == 'a' and title_tag.has_attr('href'): link_tag = title_tag
-            if not link_tag: link_tag = article.find('a', href=True) # article直下の最初のリンクも候補に
-
-            if link_tag and link_tag.has_attr('href'):
-                link_text = link_tag.get_text(strip=True); href = link_tag['href']; current_score = 0
-                for kw in query_keywords:
-                    if kw in link_text: current_score += 3 # タイトルテキストの一致を重視
-                    elif kw.lower() in link_text.lower(): current_score +=2 # 小文字での一致も少し加点
-                    elif kw in href: current_score +=1 
-                if "任務" in link_text or "/任務" in href or "quest" in href.lower(): current_score += 2
-                if "編成例" in link_text: current_score +=1 # 編成例ページは関連性が高いかも
-                
-                if current_score > highest_score:
-                    highest_score = current_score; best_match_url = urllib.parse.urljoin("https://zekamashi.net/", href)
-        
-        if best_match_url and highest_score >= 3: # 最低スコアを設定 (調整可能)
+        best_match_url, highest_score = score_zekamashi_search_results(soup, cleaned_name)
+        if best_match_url and highest_score >= ZEKAMASHI_MIN_SEARCH_SCORE:
             print(f"zekamashi.net: 最も関連性の高いページ候補 -> {best_match_url} (スコア: {highest_score})"); return best_match_url
         print(f"zekamashi.net: 関連性の高いページは見つかりませんでした (最高スコア: {highest_score})。"); return None
     except Exception as e: print(f"zekamashi.net 検索エラー: {e}"); return None
 
-def get_mission_source_urls(selected_mission_name):
-    # zekamashi直接検索をまず試す（スコアが良ければそれを採用する改良も可能）
-    # direct_zekamashi_url = find_mission_page_url_on_zekamashi(selected_mission_name)
-    # if direct_zekamashi_url: # もしここで十分なスコアならGoogle検索をスキップする判断もできる
-    #     return [(direct_zekamashi_url, "zekamashi.net")]
-
-    google_query = f"{selected_mission_name} 艦これ 攻略" 
-    print(f"\nGoogleで「{google_query}」を検索し、結果を解析します...")
-    google_results_urls_from_lib = []
+def search_google_urls(google_query, stop_event=None, max_results=5, budget=None):
+    """googlesearch で上位 max_results 件のURLを取得する。stop_event がセットされたら途中で打ち切る
+    Googleが遮断中 (直前に制限された等) なら問い合わせずに HostUnavailable"""
+    print("  Google検索ライブラリで検索実行中..."); temp_results = []
+    def collect(results):
+        for url in results:
+            if stop_event and stop_event.is_set(): print("  Google検索: ほかの情報源で確定したため打ち切りました。"); break
+            temp_results.append(url)
+            if len(temp_results) >= max_results: break # 上位5件まで
+    def run_search(timeout):
+        try: collect(googlesearch.search(google_query, num_results=max_results, timeout=timeout))
+        except TypeError as te: # search()関数の引数に関するエラー (古いgooglesearchはtimeout等を受け付けない)
+            print(f"  Google検索関数の呼び出しで引数エラーが発生しました (引数なしで再試行): {te}")
+            temp_results.clear(); collect(googlesearch.search(google_query)) # 途中まで集めた分は捨てて取り直す (重複させない)
+    call_with_host_health(GOOGLE_SEARCH_HOST, run_search, RESOLVE_GOOGLE_TIMEOUT, budget)
+    if temp_results: print(f"  Google検索から {len(temp_results)} 件のURL候補を取得。")
+    else: print("  Google検索結果なし。")
+    return temp_results
+
+_resolver_executor = None
+_resolver_executor_lock = threading.Lock()
+
+def get_resolver_executor():
+    """情報源の並行検索用スレッドプール (初回使用時に作る。--batch のワーカープロセスなどでは作られない)"""
+    global _resolver_executor
+    with _resolver_executor_lock:
+        if _resolver_executor is None: _resolver_executor = ThreadPoolExecutor(max_workers=LOOKUP_MAX_WORKERS * 2, thread_name_prefix="source_resolver")
+        return _resolver_executor
+
+async def resolve_mission_sources_hedged(selected_mission_name, deadline=None, budget=None):
+    """zekamashi.net のサイト内検索とGoogle検索を同時に走らせ、先に十分な候補を返した方を採用する
+    (負けた方は取り消す)。どちらも決め手にならなければ、締め切りまでに得たGoogleの上位サイトか手動確認用URLを返す
+    budget (LookupBudget) を渡すと、締め切りと各リクエストのタイムアウトをその残り時間に収める"""
+    if budget is None: budget = LookupBudget(RESOLVE_DEADLINE_SECONDS if deadline is None else deadline)
+    deadline = budget.remaining()
+    loop = asyncio.get_running_loop(); stop_event = threading.Event(); started = loop.time()
+    google_query = f"{selected_mission_name} 艦これ 攻略"
     manual_google_url = f"https://www.google.com/search?q={urllib.parse.quote(google_query)}"
+    print(f"\nzekamashi.net内検索とGoogle検索「{google_query}」を並行して実行します (締め切り {deadline:.1f}秒)...")
+    executor = get_resolver_executor()
+    tasks = {
+        loop.run_in_executor(executor, find_mission_page_url_on_zekamashi, selected_mission_name, budget, stop_event): "zekamashi",
+        loop.run_in_executor(executor, functools.partial(search_google_urls, google_query, stop_event, budget=budget)): "google",
+    }
+    google_results_urls = []; pending = set(tasks)
     try:
-        print("  Google検索ライブラリで検索実行中..."); temp_results = []
-        for url in search(google_query): # 最もシンプルな呼び出し
-            temp_results.append(url)
-            if len(temp_results) >= 5: break # 上位5件まで
-        google_results_urls_from_lib = temp_results
-        if google_results_urls_from_lib: print(f"  Google検索から {len(google_results_urls_from_lib)} 件のURL候補を取得。")
-        else: print("  Google検索結果なし。")
-    except TypeError as te: # search()関数の引数に関するエラーの場合
-        print(f"  Google検索関数の呼び出しで引数エラーが発生しました: {te}")
-    except Exception as e_general: print(f"  Google検索ライブラリ使用中に予期せぬエラー: {e_general}")
-
-    if not google_results_urls_from_lib:
+        while pending:
+            remaining = deadline - (loop.time() - started)
+            if remaining <= 0: print(f"情報源の決定が締め切り ({deadline:.1f}秒) に達しました。未完了: {[tasks[t] for t in pending]}"); break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                source = tasks[task]
+                try: result = task.result()
+                except Exception as e: print(f"  {source} の検索でエラー: {e}"); continue
+                print(f"  {source} の検索が完了 ({(loop.time() - started) * 1000:.0f}ms)")
+                if source == "zekamashi" and result: return [(result, "zekamashi.net")]
+                if source == "google":
+                    google_results_urls = result or []
+                    for url in google_results_urls:
+                        if url and "zekamashi.net" in urllib.parse.urlparse(url).netloc:
+                            print(f"Google検索結果からzekamashi.netのページを優先的に使用: {url}")
+                            return [(url, "zekamashi.net (via Google)")]
+    finally:
+        stop_event.set()
+        for task in tasks:
+            if not task.done(): task.cancel()
+
+    if not google_results_urls:
         print("プログラムによるGoogle検索に失敗したか、結果がありませんでした。手動確認用のURLを提示します。")
         return [(manual_google_url, "Google検索 (手動確認用)")]
-
-    for url in google_results_urls_from_lib:
-        if url and "zekamashi.net" in urllib.parse.urlparse(url).netloc:
-            print(f"Google検索結果からzekamashi.netのページを優先的に使用: {url}")
-            return [(url, "zekamashi.net (via Google)")] 
-
-    print(f"Google検索結果にzekamashi.netは見つかりませんでした。他の上位サイトを提示します (最大3件):")
-    top_results_to_return = []
-    for url in google_results_urls_from_lib[:3]:
-        if url: domain = urllib.parse.urlparse(url).netloc; top_results_to_return.append((url, domain))
+    print(f"zekamashi.netの候補は見つかりませんでした。Google検索の上位サイトを提示します (最大3件):")
+    top_results_to_return = [(url, urllib.parse.urlparse(url).netloc) for url in google_results_urls[:3] if url]
     if top_results_to_return: return top_results_to_return
     print("Google検索で有望な結果が見つかりませんでした（フィルタリング後）。")
     return [(manual_google_url, "Google検索 (手動確認用)")]
 
+@traced_stage("resolve")
+def get_mission_source_urls(selected_mission_name, budget=None):
+    # ローカル索引で十分に一致すればネットワークを使わずにURLを確定する
+    indexed_entry, index_score = get_quest_index().lookup(selected_mission_name)
+    if indexed_entry:
+        print(f"任務名索引で「{indexed_entry['title']}」に一致 (スコア: {index_score:.2f}) -> {indexed_entry['url']}")
+        return [(indexed_entry["url"], indexed_entry["site"] or urllib.parse.urlparse(indexed_entry["url"]).netloc)]
+    if index_score: print(f"任務名索引の一致度が低いためWeb検索を行います (最高スコア: {index_score:.2f})")
+    # 呼び出し元は検索スレッドなので、スレッドごとに短命のイベントループで並行検索を回す
+    resolve_budget = budget.stage(RESOLVE_DEADLINE_SECONDS, reserve=sum(LOOKUP_STAGE_RESERVE_SECONDS.values())) if budget else None
+    return asyncio.run(resolve_mission_sources_hedged(selected_mission_name, budget=resolve_budget))
+
 def parse_tablepress_table(table_soup):
     data = []; headers = []
     if not table_soup: return data
@@ -283,328 +1805,997 @@ def parse_tablepress_table(table_soup):
             if row: data.append(row)
     return data
 
-def extract_specific_mission_details(soup, mission_details):
-    print("\n詳細情報の抽出を開始します...")
-    main_content_area = soup.find(class_=["entry-content", "post-content", "article-body", "main-content", "td-post-content"]) # td-post-content も追加
-    if not main_content_area: main_content_area = soup.body
-    if not main_content_area: print("エラー: 主要コンテンツエリアが見つかりません。"); return
-
-    # --- 1. 基本的な任務内容と報酬の抽出 ---
-    if not mission_details.get("任務内容") and main_content_area: 
-        current_mission_content = []; condition_heading_keywords = ["任務情報", "任務内容", "達成条件", "クリア条件", "出現条件", "概要", "任務概要"]; condition_section_found = False
-        for kw in condition_heading_keywords:
-            heading_tag = main_content_area.find(['h2', 'h3', 'h4'], string=lambda text: text and kw in text.strip())
+# --- HTML解析 ---
+def _detect_html_parser():
+    """lxml (C実装) があれば使い、無ければ標準の html.parser を使う (起動を遅らせないよう、ここでは import しない)"""
+    return "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+HTML_PARSER = _detect_html_parser()
+SEARCH_RESULT_CLASSES = ["search-entry", "post-item", "no-results", "error404"]
+
+@functools.lru_cache(maxsize=None)
+def _region_strainer_class():
+    """RegionStrainer クラスを作る。bs4 の読み込みを最初のHTML解析まで遅らせるため、クラス定義も初回呼び出し時に行う"""
+    if not hasattr(bs4.SoupStrainer, "allow_tag_creation"): # フックは beautifulsoup4 4.13 以降 (rib.txt では 4.13.4)
+        print(f"警告: beautifulsoup4 {getattr(bs4, '__version__', '?')} は部分解析に対応していないため、攻略ページを全体解析します (4.13以上を推奨)。")
+    class RegionStrainer(bs4.SoupStrainer):
+        """指定したタグ名・クラスを持つ要素 (とその子孫) だけを木にする SoupStrainer
+        ヘッダー・サイドバー・コメント欄などは Python のオブジェクトとして作らない"""
+
+        def __init__(self, tag_names=(), classes=()):
+            super().__init__()
+            self.keep_tag_names = set(tag_names); self.keep_classes = set(classes)
+
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            if name in self.keep_tag_names: return True
+            class_value = (attrs or {}).get("class")
+            if not class_value: return False
+            if isinstance(class_value, str): class_value = class_value.split()
+            return any(cls in self.keep_classes for cls in class_value)
+
+        def allow_string_creation(self, string):
+            return False # 対象要素の外にある文字列は捨てる
+    return RegionStrainer
+
+def make_region_strainer(tag_names=(), classes=()):
+    return _region_strainer_class()(tag_names=tag_names, classes=classes)
+
+def parse_guide_page(html, area_classes=None):
+    """攻略ページを解析する。<title> と主要コンテンツエリア (area_classes を持つ要素、省略時は CONTENT_AREA_CLASSES) だけを木にし、
+    コンテンツエリアが見つからないページは従来どおり全体を解析する (soup.body へのフォールバック用)"""
+    area_classes = area_classes or CONTENT_AREA_CLASSES
+    soup = bs4.BeautifulSoup(html, HTML_PARSER, parse_only=make_region_strainer(tag_names=["title"], classes=area_classes))
+    if soup.find(class_=area_classes): return soup
+    return bs4.BeautifulSoup(html, HTML_PARSER)
+
+def parse_search_results_page(html):
+    """サイト内検索結果ページを解析する。検索結果の article 要素と「結果なし」表示だけを木にする"""
+    return bs4.BeautifulSoup(html, HTML_PARSER, parse_only=make_region_strainer(tag_names=["article"], classes=SEARCH_RESULT_CLASSES))
+
+def run_html_parse_benchmark(html_paths, repeat=5):
+    """保存した攻略ページについて、従来の全体解析 (html.parser) と parse_guide_page の
+    解析時間・ピークメモリを比較して表示する"""
+    print(f"HTML解析ベンチマーク (新方式のパーサ: {HTML_PARSER}, 繰り返し: {repeat}回)")
+    print(f"{'ファイル':<40} {'従来[ms]':>10} {'新方式[ms]':>10} {'従来[KB]':>10} {'新方式[KB]':>10}")
+    parse_variants = [("before", lambda html: bs4.BeautifulSoup(html, 'html.parser')), ("after", parse_guide_page)]
+    for path in html_paths:
+        with open(path, encoding="utf-8", errors="replace") as f: html = f.read()
+        results = {}
+        for label, parse_func in parse_variants:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter(); parse_func(html); timings.append(time.perf_counter() - started)
+            tracemalloc.start()
+            soup = parse_func(html); peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop(); del soup
+            results[label] = (min(timings) * 1000, peak_bytes / 1024)
+        print(f"{os.path.basename(path)[:40]:<40} {results['before'][0]:>10.1f} {results['after'][0]:>10.1f} {results['before'][1]:>10.0f} {results['after'][1]:>10.0f}")
+
+# --- 攻略ページの詳細抽出 ---
+CONTENT_AREA_CLASSES = ["entry-content", "post-content", "article-body", "main-content", "td-post-content"] # td-post-content も追加
+CONDITION_HEADING_KEYWORDS = ["任務情報", "任務内容", "達成条件", "クリア条件", "出現条件", "概要", "任務概要"]
+REWARD_PARAGRAPH_MARKERS = ("報酬は", "クリア報酬に")
+DEV_KEYWORDS = ["開発", "レシピ", "工廠", "改修"] # 「改修」も追加
+SECTION_BREAK_HEADINGS = ("h2", "h3", "h4")
+GENERIC_HEADING_MARKERS = ("とは？", "まとめ", "一覧", "について", "関連記事")
+SORTIE_GENERIC_HEADING_MARKERS = GENERIC_HEADING_MARKERS + ("その他", "コメント")
+SHIP_TYPE_MARKERS = ["駆","軽","重","戦","航","潜","母","巡","艦","海防"]
+EXPEDITION_HEADING_RE = re.compile(r"^(ID:)?([A-Z]?\d{1,2}(\-[A-Z\d]{1,2})?)\s?[:：]?\s*(.+)")
+MAP_HEADING_RE = re.compile(r"^(\d-\d(?:-\w)?|\d-\d\S*|\S*\d-\d\S*|EO海域|鎮守府海域(?:-\d)?|西方海域|中部海域|北方海域|南方海域|Extra Operation)", re.IGNORECASE)
+FLEET_LINE_RE = re.compile(r"^([^\s「【●※]+?\d{1,2})+.*")
+
+class ContentSectionIndex:
+    """主要コンテンツエリアを1回だけ走査して作る索引
+    要素の出現順リスト・見出しごとの兄弟要素ブロック・テキストのキャッシュを持ち、各抽出処理はこれを参照する"""
+
+    def __init__(self, content_area, adapter=None):
+        self.adapter = adapter or GENERIC_SITE_ADAPTER # 見出しの語句や正規表現はこの抽出計画のものを使う
+        self.tags = [] # 出現順の全要素 (content_area 自身は含まない)
+        self.tags_by_name = {}
+        self._children = {} # id(親要素) -> 子要素(Tagのみ)のリスト
+        self._position = {} # id(要素) -> 親の子要素リスト内の位置
+        self._text_cache = {}
+        self._block_cache = {}
+        for element in content_area.descendants:
+            if not isinstance(element, bs4.Tag): continue
+            siblings = self._children.setdefault(id(element.parent), [])
+            self._position[id(element)] = len(siblings); siblings.append(element)
+            self.tags.append(element); self.tags_by_name.setdefault(element.name, []).append(element)
+        self.reward_paragraph = next((p for p in self.tags_by_name.get("p", []) if self.is_reward_paragraph(p, strip=False)), None)
+
+    def text(self, tag, strip=True):
+        key = (id(tag), strip)
+        if key not in self._text_cache: self._text_cache[key] = tag.get_text(strip=True) if strip else tag.get_text()
+        return self._text_cache[key]
+
+    def is_reward_paragraph(self, tag, strip):
+        return tag.name == 'p' and self.adapter.reward_paragraph_re.search(self.text(tag, strip)) is not None
+
+    def tags_named(self, names):
+        """指定した名前の要素を出現順に返す"""
+        names = (names,) if isinstance(names, str) else names
+        return [tag for tag in self.tags if tag.name in names] if len(names) > 1 else self.tags_by_name.get(names[0], [])
+
+    def first_with_string(self, names, predicate):
+        """tag.string が predicate を満たす最初の要素 (find(names, string=...) と同じ判定)"""
+        for tag in self.tags_named(names):
+            tag_string = tag.string
+            if tag_string and predicate(tag_string): return tag
+        return None
+
+    def next_siblings(self, tag):
+        siblings = self._children[id(tag.parent)]
+        return siblings[self._position[id(tag)] + 1:]
+
+    def previous_siblings(self, tag):
+        siblings = self._children[id(tag.parent)]
+        return siblings[:self._position[id(tag)]][::-1]
+
+    def section_block(self, heading):
+        """見出しの後ろに続く兄弟要素のうち、次の h2/h3/h4 見出しの手前までを返す"""
+        if id(heading) not in self._block_cache:
+            block = []
+            for sibling in self.next_siblings(heading):
+                if sibling.name in self.adapter.section_break_headings: break
+                block.append(sibling)
+            self._block_cache[id(heading)] = block
+        return self._block_cache[id(heading)]
+
+def is_tablepress_table(tag):
+    return tag.name == 'table' and any('tablepress' in cls for cls in tag.get('class') or [])
+
+def extract_conditions_and_rewards(index, mission_details):
+    """任務内容 (達成条件) と報酬を抽出する"""
+    if not mission_details.get("任務内容"):
+        current_mission_content = []; condition_section_found = False
+        for kw in index.adapter.condition_heading_keywords:
+            heading_tag = index.first_with_string(index.adapter.section_break_headings, lambda text: kw in text.strip())
             if heading_tag:
-                # print(f"見出し「{heading_tag.get_text(strip=True)}」から任務内容を抽出試行...")
-                for sibling in heading_tag.find_next_siblings():
-                    if sibling.name in ['h2', 'h3', 'h4'] or (sibling.name == 'p' and ('報酬は' in sibling.get_text() or 'クリア報酬に' in sibling.get_text())): break
+                for sibling in index.section_block(heading_tag):
+                    if index.is_reward_paragraph(sibling, strip=False): break
                     if sibling.name == 'ul':
-                        for li in sibling.find_all('li', recursive=False): 
-                            clean_text = li.get_text(strip=True).replace('\n', ' '); 
+                        for li in sibling.find_all('li', recursive=False):
+                            clean_text = index.text(li).replace('\n', ' ')
                             if clean_text: current_mission_content.append(clean_text)
-                        if current_mission_content: condition_section_found = True; break 
+                        if current_mission_content: condition_section_found = True; break
                     elif sibling.name == 'p':
-                        clean_text = sibling.get_text(strip=True).replace('\n', ' '); 
-                        if clean_text: current_mission_content.append(clean_text); # 複数のpが続くことを許容するため、ここではbreakしない
+                        clean_text = index.text(sibling).replace('\n', ' ')
+                        if clean_text: current_mission_content.append(clean_text) # 複数のpが続くことを許容するため、ここではbreakしない
                 if current_mission_content: condition_section_found = True # ループ後にフラグを立てる
-                if condition_section_found and current_mission_content: break 
+                if condition_section_found and current_mission_content: break
         if current_mission_content: mission_details["任務内容"] = current_mission_content
-        elif not mission_details.get("任務内容") and main_content_area: 
-            reward_p_tag_for_content = main_content_area.find(lambda tag: tag.name == 'p' and ('報酬は' in tag.get_text() or 'クリア報酬に' in tag.get_text()))
-            if reward_p_tag_for_content:
-                candidate_uls = reward_p_tag_for_content.find_previous_siblings('ul')
-                if candidate_uls:
-                    condition_ul_tag = candidate_uls[0] 
-                    temp_content = [li.get_text(strip=True).replace('\n', ' ') for li in condition_ul_tag.find_all('li', recursive=False) if li.get_text(strip=True)]
-                    if temp_content: mission_details["任務内容"] = temp_content
-    
-    if not mission_details.get("報酬") and main_content_area: 
-        current_rewards = []
-        reward_p_tag = main_content_area.find(lambda tag: tag.name == 'p' and ('報酬は' in tag.get_text() or 'クリア報酬に' in tag.get_text()))
-        if reward_p_tag:
-            reward_ul_tag = reward_p_tag.find_next_sibling('ul')
-            if reward_ul_tag: current_rewards = [li.get_text(strip=True).replace('\n', ' ') for li in reward_ul_tag.find_all('li', recursive=False) if li.get_text(strip=True)]
-        if current_rewards: mission_details["報酬"] = current_rewards
-
-    # --- 2. 工廠任務特有のテーブル抽出 ---
-    dev_recipe_table_found = False; dev_keywords = ["開発", "レシピ", "工廠", "改修"] # 「改修」も追加
-    if main_content_area:
-        possible_headings_for_dev = main_content_area.find_all(['h2', 'h3', 'h4', 'h5'])
-        for heading in possible_headings_for_dev:
-            if any(kw in heading.get_text(strip=True) for kw in dev_keywords):
-                table = heading.find_next_sibling('table', class_=lambda x: x and 'tablepress' in x)
-                if table: mission_details["開発レシピ表"] = parse_tablepress_table(table); dev_recipe_table_found = True; break 
-    if not dev_recipe_table_found and main_content_area: 
-        all_tables = main_content_area.find_all('table', class_=lambda x: x and 'tablepress' in x)
-        for table_cand in all_tables: # ページ内の全てのtablepressをチェック
-            caption = table_cand.find('caption'); first_th = table_cand.find('th')
-            if (caption and any(kw in caption.get_text(strip=True) for kw in dev_keywords)) or \
-               (first_th and any(kw in first_th.get_text(strip=True) for kw in dev_keywords)):
-                mission_details["開発レシピ表"] = parse_tablepress_table(table_cand); break # 最初に見つかったものを採用
-
-    # --- 3. 遠征任務特有の情報抽出 ---
+        elif not mission_details.get("任務内容") and index.reward_paragraph:
+            # 条件の見出しが無いページでは「報酬は〜」の直前のリストを任務内容とみなす
+            candidate_uls = [tag for tag in index.previous_siblings(index.reward_paragraph) if tag.name == 'ul']
+            if candidate_uls:
+                temp_content = [index.text(li).replace('\n', ' ') for li in candidate_uls[0].find_all('li', recursive=False) if index.text(li)]
+                if temp_content: mission_details["任務内容"] = temp_content
+
+    if not mission_details.get("報酬") and index.reward_paragraph:
+        reward_ul_tag = next((tag for tag in index.next_siblings(index.reward_paragraph) if tag.name == 'ul'), None)
+        if reward_ul_tag:
+            current_rewards = [index.text(li).replace('\n', ' ') for li in reward_ul_tag.find_all('li', recursive=False) if index.text(li)]
+            if current_rewards: mission_details["報酬"] = current_rewards
+
+def extract_arsenal_tables(index, mission_details):
+    """工廠任務の開発レシピ表を抽出する"""
+    for heading in index.tags_named(('h2', 'h3', 'h4', 'h5')):
+        if index.adapter.dev_keyword_re.search(index.text(heading)):
+            table = next((tag for tag in index.next_siblings(heading) if is_tablepress_table(tag)), None)
+            if table: mission_details["開発レシピ表"] = parse_tablepress_table(table); return
+    for table_cand in index.tags_named('table'): # ページ内の全てのtablepressをチェック
+        if not is_tablepress_table(table_cand): continue
+        caption = table_cand.find('caption'); first_th = table_cand.find('th')
+        if (caption and index.adapter.dev_keyword_re.search(index.text(caption))) or \
+           (first_th and index.adapter.dev_keyword_re.search(index.text(first_th))):
+            mission_details["開発レシピ表"] = parse_tablepress_table(table_cand); return # 最初に見つかったものを採用
+
+def extract_expeditions(index, mission_details):
+    """遠征任務の遠征ごとの情報表を抽出する"""
     expedition_details_list = []
-    if main_content_area:
-        expedition_name_headings = main_content_area.find_all('h3') 
-        for h3_tag in expedition_name_headings:
-            h3_text = h3_tag.get_text(strip=True)
-            match = re.match(r"^(ID:)?([A-Z]?\d{1,2}(\-[A-Z\d]{1,2})?)\s?[:：]?\s*(.+)", h3_text)
-            is_generic_explanation = "とは？" in h3_text or "まとめ" in h3_text or "一覧" in h3_text or "について" in h3_text or "関連記事" in h3_text
-            if match and not is_generic_explanation :
-                expedition_name_from_h3 = h3_text
-                expedition_table = h3_tag.find_next_sibling('table', class_=lambda x: x and 'tablepress' in x)
-                if expedition_table:
-                    table_data = parse_tablepress_table(expedition_table)
-                    expedition_details_list.append({"遠征名": expedition_name_from_h3, "情報表": table_data})
+    for h3_tag in index.tags_named('h3'):
+        h3_text = index.text(h3_tag)
+        is_generic_explanation = index.adapter.generic_heading_re.search(h3_text) is not None
+        if index.adapter.expedition_heading_re.match(h3_text) and not is_generic_explanation:
+            expedition_table = next((tag for tag in index.next_siblings(h3_tag) if is_tablepress_table(tag)), None)
+            if expedition_table:
+                expedition_details_list.append({"遠征名": h3_text, "情報表": parse_tablepress_table(expedition_table)})
     if expedition_details_list: mission_details["遠征詳細"] = expedition_details_list
 
-    # --- 4. 出撃任務特有の情報抽出 ---
+def collect_fleet_section(index, heading, map_name):
+    """見出しに続くブロックから編成例と編成備考を集める"""
+    sortie_info = {"海域": map_name, "編成例": [], "編成備考": []}
+    for sibling in index.section_block(heading):
+        if index.is_reward_paragraph(sibling, strip=True): break
+        text_to_add = ""
+        if sibling.name == 'p': text_to_add = index.text(sibling).replace('\n', ' ')
+        elif sibling.name == 'ul':
+            for li in sibling.find_all('li', recursive=False):
+                li_text = index.text(li).replace('\n', ' ')
+                if li_text: sortie_info["編成備考"].append(li_text)
+            continue
+        if text_to_add:
+            is_primary_fleet = False
+            if ("【" in text_to_add and "】" in text_to_add and any(st in text_to_add for st in SHIP_TYPE_MARKERS)) or \
+               FLEET_LINE_RE.match(text_to_add):
+                if not (text_to_add.lstrip().startswith("●") or text_to_add.lstrip().startswith("※")): is_primary_fleet = True
+            if is_primary_fleet: sortie_info["編成例"].append(text_to_add)
+            else: sortie_info["編成備考"].append(text_to_add)
+    return sortie_info
+
+def extract_sorties(index, mission_details):
+    """出撃任務の海域ごとの編成例を抽出する"""
     sortie_details_list = []
-    processed_specific_map_sortie = False # 個別の海域名が見つかったかのフラグ
-    if main_content_area:
-        map_name_headings = main_content_area.find_all(['h3', 'h4']) 
-        
-        for h_tag in map_name_headings:
-            h_text = h_tag.get_text(strip=True)
-            map_match_pattern = r"^(\d-\d(?:-\w)?|\d-\d\S*|\S*\d-\d\S*|EO海域|鎮守府海域(?:-\d)?|西方海域|中部海域|北方海域|南方海域|Extra Operation)"
-            map_match = re.match(map_match_pattern, h_text, re.IGNORECASE)
-            span_id_match = h_tag.find('span', id=lambda x: x and x.startswith('i-'))
-            is_generic_heading = "とは？" in h_text or "まとめ" in h_text or "一覧" in h_text or "について" in h_text or "その他" in h_text or "関連記事" in h_text or "コメント" in h_text
-
-            if (map_match or span_id_match) and not is_generic_heading:
-                map_name = h_text
-                current_sortie_info = {"海域": map_name, "編成例": [], "編成備考": []}
-                
-                for sibling in h_tag.find_next_siblings():
-                    if sibling.name in ['h2','h3','h4'] or (sibling.name=='p' and ('報酬は' in sibling.get_text(strip=True) or 'クリア報酬に' in sibling.get_text(strip=True))): break
-                    text_to_add = ""
-                    if sibling.name == 'p': text_to_add = sibling.get_text(strip=True).replace('\n', ' ')
-                    elif sibling.name == 'ul':
-                        for li in sibling.find_all('li', recursive=False):
-                            li_text = li.get_text(strip=True).replace('\n', ' '); 
-                            if li_text: current_sortie_info["編成備考"].append(li_text)
-                        continue
-                    if text_to_add:
-                        is_primary_fleet = False
-                        if ("【" in text_to_add and "】" in text_to_add and any(st in text_to_add for st in ["駆","軽","重","戦","航","潜","母","巡","艦","海防"])) or \
-                           re.match(r"^([^\s「【●※]+?\d{1,2})+.*", text_to_add):
-                            if not (text_to_add.lstrip().startswith("●") or text_to_add.lstrip().startswith("※")): is_primary_fleet = True
-                        if is_primary_fleet: current_sortie_info["編成例"].append(text_to_add)
-                        else: current_sortie_info["編成備考"].append(text_to_add)
-                if current_sortie_info["編成例"] or current_sortie_info["編成備考"]:
-                    sortie_details_list.append(current_sortie_info)
-                    processed_specific_map_sortie = True # 個別海域情報を処理したフラグを立てる
-        
-        # --- ↓↓↓ もし上記のh3/h4での海域情報が見つからなかった場合のフォールバック ↓↓↓ ---
-        if not processed_specific_map_sortie: # (または sortie_details_list が空の場合)
-            # h2 タグなどで「編成例」という見出しを探す
-            general_fleet_heading = main_content_area.find(['h2', 'h3'], string=lambda text: text and "編成例" in text.strip() and not ("とは？" in text.strip() or "まとめ" in text.strip()))
-            if general_fleet_heading:
-                print(f"一般的な「{general_fleet_heading.get_text(strip=True)}」セクションから情報を抽出します。")
-                # この場合の「海域」名は、ページタイトルから取るか、固定の文字列にする
-                page_title_text = mission_details.get("タイトル", "").split('｜')[0].strip() # ページの主タイトル部分
-                map_name_for_general = page_title_text if page_title_text else "(主要攻略)" # タイトルが取れなければ汎用名
-
-                current_sortie_info = {"海域": map_name_for_general, "編成例": [], "編成備考": []}
-                for sibling in general_fleet_heading.find_next_siblings():
-                    if sibling.name in ['h2','h3','h4'] or (sibling.name=='p' and ('報酬は' in sibling.get_text(strip=True) or 'クリア報酬に' in sibling.get_text(strip=True))): break
-                    text_to_add = ""
-                    if sibling.name == 'p': text_to_add = sibling.get_text(strip=True).replace('\n', ' ')
-                    elif sibling.name == 'ul':
-                        for li in sibling.find_all('li', recursive=False):
-                            li_text = li.get_text(strip=True).replace('\n', ' '); 
-                            if li_text: current_sortie_info["編成備考"].append(li_text)
-                        continue
-                    if text_to_add:
-                        is_primary_fleet = False
-                        if ("【" in text_to_add and "】" in text_to_add and any(st in text_to_add for st in ["駆","軽","重","戦","航","潜","母","巡","艦","海防"])) or \
-                           re.match(r"^([^\s「【●※]+?\d{1,2})+.*", text_to_add):
-                            if not (text_to_add.lstrip().startswith("●") or text_to_add.lstrip().startswith("※")): is_primary_fleet = True
-                        if is_primary_fleet: current_sortie_info["編成例"].append(text_to_add)
-                        else: current_sortie_info["編成備考"].append(text_to_add)
-                if current_sortie_info["編成例"] or current_sortie_info["編成備考"]:
-                    sortie_details_list.append(current_sortie_info)
+    for h_tag in index.tags_named(('h3', 'h4')):
+        h_text = index.text(h_tag)
+        span_id_match = h_tag.find('span', id=lambda x: x and x.startswith('i-'))
+        is_generic_heading = index.adapter.sortie_generic_heading_re.search(h_text) is not None
+        if (index.adapter.map_heading_re.match(h_text) or span_id_match) and not is_generic_heading:
+            sortie_info = collect_fleet_section(index, h_tag, h_text)
+            if sortie_info["編成例"] or sortie_info["編成備考"]: sortie_details_list.append(sortie_info)
+
+    # 個別の海域見出しが見つからなかった場合は、「編成例」という見出しの内容を使う
+    if not sortie_details_list:
+        general_fleet_heading = index.first_with_string(('h2', 'h3'), lambda text: "編成例" in text.strip() and not ("とは？" in text.strip() or "まとめ" in text.strip()))
+        if general_fleet_heading:
+            print(f"一般的な「{index.text(general_fleet_heading)}」セクションから情報を抽出します。")
+            # この場合の「海域」名は、ページタイトルから取るか、固定の文字列にする
+            page_title_text = mission_details.get("タイトル", "").split('｜')[0].strip() # ページの主タイトル部分
+            map_name_for_general = page_title_text if page_title_text else "(主要攻略)" # タイトルが取れなければ汎用名
+            sortie_info = collect_fleet_section(index, general_fleet_heading, map_name_for_general)
+            if sortie_info["編成例"] or sortie_info["編成備考"]: sortie_details_list.append(sortie_info)
 
     if sortie_details_list:
         mission_details["出撃情報"] = sortie_details_list
 
+# --- 攻略サイトごとの抽出アダプタ ---
+def _keyword_re(keywords):
+    """キーワードのどれかを含むかを1回の検索で判定する正規表現"""
+    return re.compile("|".join(re.escape(kw) for kw in keywords))
+
+class SiteAdapter:
+    """攻略サイト1つぶんの抽出計画。コンテンツエリアの探し方・見出しの語句・正規表現・実行する抽出処理を持つ
+    正規表現は作成時に1回だけコンパイルしておく。引数を省略した部分は従来の汎用ヒューリスティックと同じ"""
+
+    def __init__(self, name, domains=(), content_area_tag=None, content_area_classes=CONTENT_AREA_CLASSES,
+                 condition_heading_keywords=CONDITION_HEADING_KEYWORDS, reward_paragraph_markers=REWARD_PARAGRAPH_MARKERS,
+                 dev_keywords=DEV_KEYWORDS, section_break_headings=SECTION_BREAK_HEADINGS,
+                 generic_heading_markers=GENERIC_HEADING_MARKERS, sortie_generic_heading_markers=SORTIE_GENERIC_HEADING_MARKERS,
+                 expedition_heading_re=EXPEDITION_HEADING_RE, map_heading_re=MAP_HEADING_RE, extractors=None, fallback=None):
+        self.name = name; self.domains = tuple(domain.lower() for domain in domains)
+        self.content_area_tag = content_area_tag; self.content_area_classes = list(content_area_classes)
+        # 部分解析で残す範囲。構造が違うページを fallback に任せられるよう汎用の候補も含める (逐次取得の打ち切りは content_area_classes だけで判定する)
+        self.area_classes = self.content_area_classes + [cls for cls in CONTENT_AREA_CLASSES if cls not in self.content_area_classes]
+        self.condition_heading_keywords = tuple(condition_heading_keywords)
+        self.section_break_headings = tuple(section_break_headings)
+        self.reward_paragraph_re = _keyword_re(reward_paragraph_markers)
+        self.dev_keyword_re = _keyword_re(dev_keywords)
+        self.generic_heading_re = _keyword_re(generic_heading_markers)
+        self.sortie_generic_heading_re = _keyword_re(sortie_generic_heading_markers)
+        self.expedition_heading_re = expedition_heading_re; self.map_heading_re = map_heading_re
+        # 1. 基本的な任務内容と報酬 2. 工廠任務特有のテーブル 3. 遠征任務特有の情報 4. 出撃任務特有の情報
+        self.extractors = tuple(extractors or (extract_conditions_and_rewards, extract_arsenal_tables, extract_expeditions, extract_sorties))
+        self.fallback = fallback # このサイトの構造に合わないページで使う抽出計画
+
+    def __repr__(self):
+        return f"SiteAdapter({self.name!r})"
+
+    def matches(self, host):
+        return any(host == domain or host.endswith("." + domain) for domain in self.domains)
+
+    def locate(self, soup):
+        """(使う抽出計画, コンテンツエリア) を返す。コンテンツエリアが見つからなければ fallback に任せ、それも無ければ body"""
+        content_area = soup.find(self.content_area_tag, class_=self.content_area_classes)
+        if content_area is not None: return self, content_area
+        if self.fallback: return self.fallback.locate(soup)
+        return self, soup.body
+
+    def extract(self, soup, mission_details):
+        adapter, content_area = self.locate(soup)
+        if not content_area: print("エラー: 主要コンテンツエリアが見つかりません。"); return
+        if adapter is not self: print(f"ページ構造が {self.name} 用の抽出計画と一致しないため、{adapter.name} の抽出計画を使います。")
+        # コンテンツエリアを1回だけ走査して索引を作り、各抽出処理はそれを参照する
+        index = ContentSectionIndex(content_area, adapter)
+        for extractor in adapter.extractors: extractor(index, mission_details)
+
+GENERIC_SITE_ADAPTER = SiteAdapter("generic") # どのアダプタにも一致しないサイト用 (従来のヒューリスティック)
+SITE_ADAPTERS = [] # 登録順にドメインを照合する
+
+def register_site_adapter(adapter):
+    """サイト用の抽出計画を登録する。同じドメインに一致するものは先に登録した方が優先"""
+    SITE_ADAPTERS.append(adapter); get_site_adapter.cache_clear()
+    return adapter
+
+@functools.lru_cache(maxsize=256)
+def get_site_adapter(url):
+    """URLのドメインに一致する抽出計画を返す (サブドメインも一致とみなす)。無ければ汎用の計画"""
+    host = (urllib.parse.urlparse(url or "").hostname or "").lower()
+    return next((adapter for adapter in SITE_ADAPTERS if adapter.matches(host)), GENERIC_SITE_ADAPTER)
+
+# zekamashi.net (WordPress + TablePress)。このアダプタが変えるのはコンテンツエリアの探し方だけで、本文を div.entry-content に固定し
+# (逐次取得もその終わりで打ち切る)、見つからないページは汎用の計画で探す。見出しの語句・正規表現・抽出処理は汎用の計画と同じ
+ZEKAMASHI_SITE_ADAPTER = register_site_adapter(SiteAdapter("zekamashi", domains=("zekamashi.net",), content_area_tag="div", content_area_classes=["entry-content"], fallback=GENERIC_SITE_ADAPTER))
+
+@traced_stage("extract")
+def extract_specific_mission_details(soup, mission_details, adapter=None):
+    """ページのURL (mission_details["URL"]) に合う抽出計画で詳細情報を抽出する"""
+    print("\n詳細情報の抽出を開始します...")
+    (adapter or get_site_adapter(mission_details.get("URL"))).extract(soup, mission_details)
+
+# --- 抽出済み任務詳細の保存 ---
+DETAIL_RECORD_KEYS = ("タイトル", "任務内容", "報酬", "出撃情報", "遠征詳細", "開発レシピ表") # ページ内容だけから決まる項目
+
+class MissionDetailsStore:
+    """抽出済みの任務詳細をSQLiteに保存する
+    キーはURLで、ページ内容のハッシュと EXTRACTOR_VERSION が一致するときだけ保存済みの結果を返す"""
+
+    def __init__(self, path=DETAILS_STORE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False) # 検索ジョブの各スレッドから使うためロックで保護する
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS mission_details (url TEXT PRIMARY KEY, content_hash TEXT NOT NULL, extractor_version INTEGER NOT NULL, details_json TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    @staticmethod
+    def content_hash(html):
+        return hashlib.sha1(html.encode("utf-8", errors="replace")).hexdigest()
+
+    def get(self, url, content_hash):
+        """保存済みの詳細 (DETAIL_RECORD_KEYS の辞書) を返す。無いか古ければ None"""
+        with self._lock:
+            row = self._conn.execute("SELECT details_json FROM mission_details WHERE url = ? AND content_hash = ? AND extractor_version = ?", (url, content_hash, EXTRACTOR_VERSION)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, url, content_hash, details):
+        record = {key: details.get(key) for key in DETAIL_RECORD_KEYS}
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO mission_details (url, content_hash, extractor_version, details_json, updated_at) VALUES (?, ?, ?, ?, ?)",
+                               (url, content_hash, EXTRACTOR_VERSION, json.dumps(record, ensure_ascii=False), time.time()))
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+_details_store = None
+_details_store_lock = threading.Lock()
+
+def get_details_store():
+    """任務詳細の保存先を返す (無効化されているか開けなかった場合は None)"""
+    global _details_store, DETAILS_STORE_ENABLED
+    if not DETAILS_STORE_ENABLED: return None
+    with _details_store_lock:
+        if _details_store is None:
+            try: _details_store = MissionDetailsStore()
+            except Exception as e: print(f"警告: 任務詳細の保存先を開けません。毎回解析します: {e}"); DETAILS_STORE_ENABLED = False; return None
+        return _details_store
+
+# --- 任務詳細のコンパクトな記録と履歴 ---
+# 抽出処理・保存・一括処理の出力は辞書のまま扱い、GUIと履歴に残すものだけを以下の記録型に変換する
+def _intern_short(text, max_length=64):
+    """同じ文字列が何度も現れる短い値 (表のヘッダー・「○」・資材の数など) を1つのオブジェクトで共有する"""
+    return sys.intern(text) if isinstance(text, str) and len(text) <= max_length else text
+
+class CompactTable:
+    """parse_tablepress_table の行辞書のリストを、ヘッダーのタプルと列ごとのタプルで持つ表
+    行ごとの辞書を作らず、ヘッダー文字列は intern して全ての表で共有する。その行に無いセルは None"""
+    __slots__ = ("headers", "columns")
+
+    def __init__(self, headers, columns): self.headers = headers; self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows):
+        headers = []; header_positions = {}
+        for row in rows:
+            for key in row:
+                if key not in header_positions: header_positions[key] = len(headers); headers.append(_intern_short(key))
+        columns = [[None] * len(rows) for _ in headers]
+        for row_idx, row in enumerate(rows):
+            for key, value in row.items(): columns[header_positions[key]][row_idx] = _intern_short(value)
+        return cls(tuple(headers), tuple(tuple(column) for column in columns))
+
+    def __len__(self): return len(self.columns[0]) if self.columns else 0
+
+    def rows(self):
+        """行ごとの {ヘッダー: 値} を順に返す (表示・JSON出力用。その都度作って使い捨てる)"""
+        for row_idx in range(len(self)):
+            yield {header: column[row_idx] for header, column in zip(self.headers, self.columns) if column[row_idx] is not None}
+
+class SortieRecord:
+    __slots__ = ("map_name", "fleet_examples", "fleet_notes")
+    def __init__(self, map_name, fleet_examples, fleet_notes): self.map_name = map_name; self.fleet_examples = fleet_examples; self.fleet_notes = fleet_notes
+
+class ExpeditionRecord:
+    __slots__ = ("name", "table")
+    def __init__(self, name, table): self.name = name; self.table = table
+
+class MissionDetails:
+    """1つの任務の抽出結果。リストはタプルに、表は CompactTable にして保持する"""
+    __slots__ = ("ocr_name", "title", "site", "url", "conditions", "rewards", "sorties", "expeditions", "arsenal")
+
+    @classmethod
+    def from_dict(cls, details):
+        record = cls()
+        record.ocr_name = details.get("OCR任務名"); record.title = details.get("タイトル") or "タイトル不明"
+        record.site = _intern_short(details.get("サイト名")); record.url = details.get("URL")
+        record.conditions = tuple(details.get("任務内容") or ()); record.rewards = tuple(details.get("報酬") or ())
+        record.sorties = tuple(SortieRecord(item.get("海域", "海域不明"), tuple(item.get("編成例") or ()), tuple(item.get("編成備考") or ())) for item in details.get("出撃情報") or ())
+        record.expeditions = tuple(ExpeditionRecord(item.get("遠征名", "遠征名不明"), CompactTable.from_rows(item.get("情報表") or [])) for item in details.get("遠征詳細") or ())
+        arsenal_items = details.get("開発レシピ表") or []
+        record.arsenal = CompactTable.from_rows(arsenal_items) if all(isinstance(item, dict) for item in arsenal_items) else tuple(arsenal_items)
+        return record
+
+    def to_dict(self):
+        """抽出処理と同じ形の辞書に戻す"""
+        return {"OCR任務名": self.ocr_name, "タイトル": self.title, "サイト名": self.site, "URL": self.url, "任務内容": list(self.conditions), "報酬": list(self.rewards),
+                "出撃情報": [{"海域": s.map_name, "編成例": list(s.fleet_examples), "編成備考": list(s.fleet_notes)} for s in self.sorties],
+                "遠征詳細": [{"遠征名": e.name, "情報表": list(e.table.rows())} for e in self.expeditions],
+                "開発レシピ表": list(self.arsenal.rows()) if isinstance(self.arsenal, CompactTable) else list(self.arsenal)}
+
+class MissionResultHistory:
+    """検索済みの任務の結果 (MissionDetails) を照合キーごとに覚えておく上限付きのLRU
+    同じ任務をもう一度表示するときは検索を省略する。上限を超えたら最近使っていないものから捨てるので、
+    長時間遊んでもメモリ使用量は一定に収まる"""
+    def __init__(self, capacity=RESULT_HISTORY_CAPACITY):
+        self.capacity = capacity; self._entries = OrderedDict(); self._lock = threading.Lock()
+        self.hits = 0; self.evictions = 0
+
+    @staticmethod
+    def _key(mission_name): return quest_match_key(mission_name) or mission_name
+
+    def get(self, mission_name):
+        with self._lock:
+            record = self._entries.get(self._key(mission_name))
+            if record is not None: self._entries.move_to_end(self._key(mission_name)); self.hits += 1
+            return record
+
+    def put(self, mission_name, details):
+        """抽出結果の辞書を記録型にして覚え、その記録を返す"""
+        record = details if isinstance(details, MissionDetails) else MissionDetails.from_dict(details)
+        if self.capacity <= 0: return record
+        with self._lock:
+            key = self._key(mission_name); self._entries[key] = record; self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity: self._entries.popitem(last=False); self.evictions += 1
+        return record
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+    def stats(self):
+        with self._lock: return {"entries": len(self._entries), "capacity": self.capacity, "hits": self.hits, "evictions": self.evictions}
+
+result_history = MissionResultHistory()
+
+# --- 任務検索ジョブのスケジューラ ---
+class LookupCancelled(Exception):
+    """新しいキャプチャ・処理開始により、実行中の検索ジョブが不要になったことを表す"""
+
+class MissionLookupScheduler:
+    """任務検索ジョブを上限付きのスレッドプールで実行するスケジューラ
+    - 同じ世代で同じ任務名 (照合キーが一致) のジョブは1つの Future を共有する
+    - new_generation() で世代を進めると、待機中の古いジョブは取り消され、実行中のジョブも次の段階で打ち切られる"""
+
+    def __init__(self, max_workers=LOOKUP_MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mission_lookup")
+        self._lock = threading.RLock() # Future.cancel() が完了コールバックを同じスレッドで呼ぶため再入可能にする
+        self._generation = 0
+        self._inflight = {} # (世代, 照合キー) -> Future
+        self._latencies = deque(maxlen=100) # 直近の実行時間 (秒)
+        self.submitted = 0; self.started = 0; self.finished = 0; self.deduplicated = 0; self.cancelled = 0
+
+    @property
+    def generation(self):
+        with self._lock: return self._generation
+
+    def is_current(self, generation):
+        with self._lock: return generation == self._generation
+
+    def new_generation(self):
+        """世代を進めて古いジョブを取り消す。新しい世代番号を返す"""
+        with self._lock:
+            self._generation += 1
+            stale_futures = list(self._inflight.values()); self._inflight.clear()
+            for future in stale_futures:
+                if future.cancel(): self.cancelled += 1
+            return self._generation
+
+    def is_busy(self):
+        """待機中・実行中の検索ジョブがあるか (先読みはこの間は止まる)"""
+        with self._lock: return bool(self._inflight)
+
+    def submit(self, mission_name, job_func):
+        """job_func(is_cancelled) をプールで実行する。同じ任務が実行中ならその Future を返す"""
+        with self._lock:
+            generation = self._generation
+            inflight_key = (generation, quest_match_key(mission_name) or mission_name)
+            existing = self._inflight.get(inflight_key)
+            if existing is not None and not existing.done():
+                self.deduplicated += 1; print(f"「{mission_name}」は検索中のジョブと同じため結果を共有します。")
+                return existing
+            self.submitted += 1
+            future = self._executor.submit(self._run, generation, job_func)
+            self._inflight[inflight_key] = future
+        future.add_done_callback(lambda f, k=inflight_key: self._on_done(k, f))
+        return future
+
+    def _run(self, generation, job_func):
+        with self._lock: self.started += 1
+        started = time.perf_counter()
+        def is_cancelled(): return not self.is_current(generation)
+        try:
+            if is_cancelled(): raise LookupCancelled()
+            return job_func(is_cancelled)
+        finally:
+            with self._lock: self._latencies.append(time.perf_counter() - started)
+
+    def _on_done(self, inflight_key, future):
+        with self._lock:
+            self.finished += 1
+            if self._inflight.get(inflight_key) is future: del self._inflight[inflight_key]
+        print(f"検索ジョブ終了: {self.stats()}")
+
+    def stats(self):
+        """待ち行列の長さ・実行中の数・実行時間などの統計を返す"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            running = self.started - (self.finished - self.cancelled)
+            return {
+                "generation": self._generation, "queued": self.submitted - self.started - self.cancelled, "running": max(running, 0),
+                "finished": self.finished, "deduplicated": self.deduplicated, "cancelled": self.cancelled,
+                "avg_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                "p95_ms": round(latencies[round((len(latencies) - 1) * 0.95)] * 1000, 1) if latencies else 0.0,
+            }
+
+lookup_scheduler = MissionLookupScheduler()
+
+def load_or_extract_details(ocr_name, chosen_url, chosen_site, html, store=None, tracer=None):
+    """ページ内容が同じなら保存済みの抽出結果を使い、無ければ解析・抽出して保存する
+    途中で打ち切ったページも受信した本文のハッシュで保存する (打ち切り位置が変われば別の内容として抽出し直す)
+    store / tracer を省略すると共有の保存先 (get_details_store) と計測 (stage_tracer) を使う"""
+    store = store or get_details_store(); tracer = tracer or stage_tracer; content_hash = MissionDetailsStore.content_hash(html) if store else None
+    stored_record = store.get(chosen_url, content_hash) if store else None
+    if stored_record:
+        print(f"保存済みの抽出結果を使用します (解析を省略): {chosen_url}")
+        return {"OCR任務名": ocr_name, "タイトル": stored_record["タイトル"], "サイト名": chosen_site, "URL": chosen_url, **stored_record}
+    adapter = get_site_adapter(chosen_url)
+    with tracer.span("parse", url=chosen_url): soup_obj = parse_guide_page(html, adapter.area_classes)
+    title_tag = soup_obj.find('title'); title = title_tag.get_text(strip=True) if title_tag else "タイトル不明"
+
+    final_details = {"OCR任務名": ocr_name, "タイトル": title, "サイト名": chosen_site, "URL": chosen_url, "任務内容": [], "報酬": [], "出撃情報": [], "遠征詳細": [], "開発レシピ表": []}
+    extract_specific_mission_details(soup_obj, final_details, adapter)
+    if store: store.put(chosen_url, content_hash, final_details)
+    return final_details
+
+def partial_details_reporter(ocr_name, chosen_url, chosen_site, on_partial):
+    """逐次取得中の節の区切りごとに呼ばれる関数を返す。受信済みの部分から任務内容と報酬が
+    両方取れたら、その時点の詳細辞書で on_partial を1回だけ呼ぶ (出撃情報などは後から届く)
+    HTTP_PARTIAL_MAX_SECTIONS 節を過ぎるか、報酬の節を過ぎても任務内容が無ければ探すのをやめる。
+    途中結果は付加的なものなので、解析・抽出のエラーはここで握りつぶし、ページの取得は続ける"""
+    done = False; sections = 0; site_adapter = get_site_adapter(chosen_url)
+    def on_section(html_so_far):
+        nonlocal done, sections
+        if done: return
+        sections += 1
+        if sections > HTTP_PARTIAL_MAX_SECTIONS: done = True; return
+        try:
+            soup_obj = parse_guide_page(html_so_far, site_adapter.area_classes)
+            if not soup_obj.find(class_=site_adapter.area_classes): return # コンテンツエリアの開始タグがまだ届いていない
+            adapter, content_area = site_adapter.locate(soup_obj)
+            title_tag = soup_obj.find('title')
+            partial = {"OCR任務名": ocr_name, "タイトル": title_tag.get_text(strip=True) if title_tag else "タイトル不明", "サイト名": chosen_site, "URL": chosen_url, "任務内容": [], "報酬": [], "出撃情報": [], "遠征詳細": [], "開発レシピ表": []}
+            extract_conditions_and_rewards(ContentSectionIndex(content_area, adapter), partial)
+            if partial["任務内容"] and partial["報酬"]:
+                done = True; print(f"任務内容と報酬を受信しました (残りを受信中): {chosen_url}"); on_partial(partial)
+            elif partial["報酬"]: done = True # 報酬の節より後に任務内容は来ない
+        except Exception as e: done = True; print(f"警告: 途中結果の抽出に失敗 (ページの取得は続けます): {e}")
+    return on_section
+
+def learn_quest_page(ocr_name, details):
+    """攻略ページと確認でき、ページの題名の任務名がOCR結果と一致するときだけ索引に学習させる
+    (Google検索の上位などで別の任務のページを取得した場合は学習しない)。見出しは題名の任務名、OCR結果は別名にする"""
+    if not (details["任務内容"] or details["報酬"]): return
+    page_quest_name = quest_name_from_page_title(details["タイトル"])
+    ocr_key = quest_match_key(ocr_name); page_key = quest_match_key(page_quest_name)
+    if not ocr_key or not page_key: return
+    if not quest_keys_match(ocr_key, page_key) and not (ocr_key in page_key and quest_numerals(ocr_key) == quest_numerals(page_key)):
+        print(f"任務名索引: ページの題名「{page_quest_name}」がOCR結果「{ocr_name}」と一致しないため学習しません。"); return
+    aliases = [normalize_mission_name(ocr_name)] if ocr_key != page_key else []
+    get_quest_index().add(page_quest_name, details["URL"], details["サイト名"] or urllib.parse.urlparse(details["URL"]).netloc, aliases)
+
+@traced_stage("lookup")
+def lookup_mission_details(ocr_name, report_status=None, is_cancelled=None, budget=None, on_partial=None):
+    """OCRで読んだ任務名から情報源の決定・ページ取得・詳細抽出までを行う (GUIには触れない)
+    全体を budget (省略時は LOOKUP_DEADLINE_SECONDS) の締め切りに収め、ページを取得できなければそのURLを手動確認用として返す
+    ページは逐次取得し、on_partial があれば任務内容と報酬が揃った時点の途中結果をそれに渡す
+    戻り値は {"status": "ok" / "manual" / "no_source", "details": 詳細辞書, "url": URL}"""
+    def check_cancelled():
+        if is_cancelled and is_cancelled(): raise LookupCancelled()
+    def status(msg):
+        if report_status: report_status(msg)
+
+    if budget is None: budget = LookupBudget()
+    source_opts = get_mission_source_urls(ocr_name, budget)
+    check_cancelled()
+    if not source_opts: return {"status": "no_source", "details": None, "url": None}
+
+    chosen_url, chosen_site = source_opts[0] # 最初の候補を使用
+    if "Google検索 (手動確認用)" in chosen_site: return {"status": "manual", "details": None, "url": chosen_url}
+
+    status(f"「{chosen_site}」から取得中...")
+    with trace_span("fetch", url=chosen_url) as span:
+        on_section = partial_details_reporter(ocr_name, chosen_url, chosen_site, on_partial) if on_partial else None
+        try: page_resp = fetch_page(chosen_url, timeout=HTTP_TIMEOUTS["page"], budget=budget.stage(HTTP_TIMEOUTS["page"], reserve=LOOKUP_STAGE_RESERVE_SECONDS["parse"]), stream=HTTP_STREAMING_ENABLED, on_section=on_section)
+        except (HostUnavailable, LookupDeadlineExceeded, requests.Timeout, requests.ConnectionError) as e:
+            print(f"「{chosen_url}」を取得できないため、手動確認用として返します: {e}"); span.set(degraded=type(e).__name__)
+            return {"status": "manual", "details": None, "url": chosen_url}
+        span.set(from_cache=page_resp.from_cache, revalidated=page_resp.revalidated, truncated=page_resp.truncated, bytes_read=page_resp.bytes_read)
+    check_cancelled()
+    final_details = load_or_extract_details(ocr_name, chosen_url, chosen_site, page_resp.text)
+    learn_quest_page(ocr_name, final_details)
+    return {"status": "ok", "details": final_details, "url": chosen_url}
+
+# --- 攻略ページの先読み ---
+class HostRateLimiter:
+    """ホストごとにリクエストの間隔を min_interval 秒以上空ける"""
+    def __init__(self, min_interval=PREFETCH_MIN_INTERVAL_SECONDS):
+        self.min_interval = min_interval; self._lock = threading.Lock()
+        self._next_allowed = {} # ホスト -> 次にリクエストしてよい時刻 (time.monotonic)
+
+    def wait(self, url, stop_event=None):
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic(); scheduled = max(now, self._next_allowed.get(host, 0.0))
+            self._next_allowed[host] = scheduled + self.min_interval
+        if scheduled > now:
+            if stop_event: stop_event.wait(scheduled - now)
+            else: time.sleep(scheduled - now)
+
+def next_index_page_url(soup, current_url):
+    """一覧ページの「次へ」リンク (rel="next" / a.next) のURL。無ければ None"""
+    next_tag = soup.find("link", rel="next") or soup.find("a", rel="next") or soup.select_one("a.next")
+    return urllib.parse.urljoin(current_url, next_tag["href"]) if next_tag and next_tag.get("href") else None
+
+class GuidePrefetcher:
+    """攻略サイトの一覧ページをたどり、任務ページを通常の検索と同じ経路 (fetch_page -> 抽出 -> 保存) で先読みする
+    - 1本の低優先スレッドで動き、通常の検索ジョブがある間は待つ
+    - ホストごとに間隔を空けてリクエストする (キャッシュで済む場合は待たない)
+    - 進捗をJSONに保存し、次回起動時は続きから再開する"""
+    def __init__(self, index_urls=PREFETCH_INDEX_URLS, progress_path=PREFETCH_PROGRESS_FILE, min_interval=PREFETCH_MIN_INTERVAL_SECONDS, max_index_pages=PREFETCH_MAX_INDEX_PAGES):
+        self.index_urls = list(index_urls); self.progress_path = progress_path; self.max_index_pages = max_index_pages
+        self.rate_limiter = HostRateLimiter(min_interval)
+        self._stop_event = threading.Event(); self._thread = None; self._lock = threading.RLock() # finished/stats はロック中からも呼ぶ
+        self.progress = self._load_progress()
+
+    def _new_progress(self):
+        return {"index_queue": list(self.index_urls), "index_seen": list(self.index_urls), "page_queue": [], "pages_done": [], "failures": {}, "completed_at": None}
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_path, encoding="utf-8") as f: progress = json.load(f)
+            if progress.get("completed_at") and time.time() - progress["completed_at"] > PREFETCH_REFRESH_SECONDS:
+                print("先読み: 前回の完了から時間が経っているため、一覧と任務ページを取得し直します。")
+                progress.update(index_queue=list(self.index_urls), index_seen=list(self.index_urls), pages_done=[], failures={}, completed_at=None) # 任務ページも再取得する (HTTPキャッシュの再検証で済むものは本文を受信しない)
+            return progress
+        except FileNotFoundError: return self._new_progress()
+        except Exception as e: print(f"警告: 先読みの進捗の読み込みに失敗 (最初から実行): {e}"); return self._new_progress()
+
+    def _save_progress_locked(self):
+        try:
+            os.makedirs(os.path.dirname(self.progress_path), exist_ok=True)
+            tmp_path = f"{self.progress_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump(self.progress, f, ensure_ascii=False)
+            os.replace(tmp_path, self.progress_path)
+        except Exception as e: print(f"警告: 先読みの進捗の保存に失敗: {e}")
+
+    @property
+    def running(self): return self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set()
+
+    @property
+    def finished(self):
+        with self._lock: return not self.progress["index_queue"] and not self.progress["page_queue"]
+
+    def start(self):
+        if self.running: return
+        self._stop_event = threading.Event() # 停止済みのスレッドがまだ動いていても、そちらのイベントは立てたままにする
+        self._thread = threading.Thread(target=self.run, kwargs={"stop_event": self._stop_event}, name="guide-prefetch", daemon=True); self._thread.start()
+
+    def stop(self):
+        """停止を指示してすぐ戻る (GUIスレッドから呼ぶため待たない)。スレッドは処理中の1件を終えて自分で終わる"""
+        self._stop_event.set(); self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {"index_pending": len(self.progress["index_queue"]), "pages_pending": len(self.progress["page_queue"]), "pages_done": len(self.progress["pages_done"])}
+
+    def run(self, page_limit=None, stop_event=None):
+        """キューが空になるか stop() されるまで、1件ずつ先読みする。page_limit 件処理したら終わる"""
+        stop_event = stop_event or self._stop_event
+        print(f"先読み開始: {self.stats()}"); processed = 0
+        while not stop_event.is_set() and not self.finished and (page_limit is None or processed < page_limit):
+            while lookup_scheduler.is_busy() and not stop_event.is_set(): # 通常の検索を優先する
+                stop_event.wait(PREFETCH_IDLE_POLL_SECONDS)
+            if stop_event.is_set(): break
+            with self._lock:
+                index_url = self.progress["index_queue"][0] if self.progress["index_queue"] else None
+                page_entry = None if index_url else self.progress["page_queue"][0]
+            try:
+                if index_url: self._crawl_index_page(index_url, stop_event)
+                else: self._prefetch_page(*page_entry, stop_event=stop_event); processed += 1
+                self._finish_item(index_url, page_entry, failed=False)
+            except HostUnavailable as e: # 遮断中は失敗として数えず、遮断が明けるまで待つ
+                print(f"先読み: {e}。待機します。"); stop_event.wait(max(e.retry_after, PREFETCH_IDLE_POLL_SECONDS))
+            except Exception as e:
+                print(f"先読み: {index_url or page_entry[0]} の処理に失敗: {e}")
+                self._finish_item(index_url, page_entry, failed=True)
+        with self._lock:
+            if self.finished and not self.progress["completed_at"]: self.progress["completed_at"] = time.time(); self._save_progress_locked()
+        print(f"先読み{'完了' if self.finished else '中断'}: {self.stats()}")
+
+    def _finish_item(self, index_url, page_entry, failed):
+        with self._lock:
+            url = index_url or page_entry[0]
+            if failed:
+                attempts = self.progress["failures"][url] = self.progress["failures"].get(url, 0) + 1
+                if attempts < PREFETCH_MAX_ATTEMPTS: self._save_progress_locked(); return # キューに残して後で再試行
+            queue = self.progress["index_queue"] if index_url else self.progress["page_queue"]
+            if queue and queue[0] == (index_url or page_entry): queue.pop(0)
+            if page_entry and not failed: self.progress["pages_done"].append(page_entry[0])
+            self._save_progress_locked()
+
+    def _fetch(self, url, timeout, stream=False, stop_event=None, accept_truncated=True):
+        return fetch_page(url, timeout=timeout, before_request=lambda: self.rate_limiter.wait(url, stop_event or self._stop_event), stream=stream, accept_truncated=accept_truncated)
+
+    def _crawl_index_page(self, index_url, stop_event=None):
+        page = self._fetch(index_url, HTTP_TIMEOUTS["site_search"], stop_event=stop_event)
+        soup = bs4.BeautifulSoup(page.text, HTML_PARSER) # 一覧ページは「次へ」リンクも要るので全体を解析する
+        added = 0
+        with self._lock:
+            known = set(self.progress["pages_done"]) | {u for u, _ in self.progress["page_queue"]}
+            for link_tag in search_result_link_tags(soup):
+                link_text = link_tag.get_text(strip=True); href = urllib.parse.urljoin(index_url, link_tag["href"])
+                if not ("任務" in link_text or "/任務" in href or "quest" in href.lower()) or href in known: continue
+                self.progress["page_queue"].append([href, quest_name_from_page_title(link_text)]); known.add(href); added += 1
+            next_url = next_index_page_url(soup, index_url)
+            if next_url and next_url not in self.progress["index_seen"] and len(self.progress["index_seen"]) < self.max_index_pages:
+                self.progress["index_seen"].append(next_url); self.progress["index_queue"].append(next_url)
+        print(f"先読み: 一覧 {index_url} から任務ページ {added}件を追加 {self.stats()}")
+
+    def _prefetch_page(self, url, title, stop_event=None):
+        page = self._fetch(url, HTTP_TIMEOUTS["page"], stop_event=stop_event, accept_truncated=False) # 通常の検索が打ち切ったキャッシュがあっても、全体を受信し直す
+        site = urllib.parse.urlparse(url).netloc
+        details = load_or_extract_details(title, url, site, page.text)
+        if title and (details["任務内容"] or details["報酬"]): get_quest_index().add(title, url, site) # 攻略ページと確認できたものだけ索引に載せる
+
+def build_bundled_quest_index(output_path=QUEST_INDEX_BUNDLED_FILE, index_urls=PREFETCH_INDEX_URLS):
+    """攻略サイトの一覧ページだけをたどり、同梱用の任務名索引 (任務名 -> 攻略ページURL) を作る。任務ページ自体は取得しない
+    配布物を作る前にネットワークのある環境で実行し、できたファイルを一緒に配布する。戻り値は終了コード"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        crawler = GuidePrefetcher(index_urls, progress_path=os.path.join(tmp_dir, "progress.json"))
+        while crawler.progress["index_queue"]:
+            index_url = crawler.progress["index_queue"][0]
+            try: crawler._crawl_index_page(index_url); crawler._finish_item(index_url, None, failed=False)
+            except HostUnavailable as e: print(f"索引の作成: {e}。待機します。"); time.sleep(e.retry_after)
+            except Exception as e: print(f"索引の作成: {index_url} の取得に失敗: {e}"); crawler._finish_item(index_url, None, failed=True)
+        entries = {}
+        for url, title in crawler.progress["page_queue"]:
+            if title and url not in entries: entries[url] = {"title": title, "url": url, "site": urllib.parse.urlparse(url).netloc, "aliases": []}
+    if not entries: print("エラー: 一覧ページから任務ページが見つかりませんでした。", file=sys.stderr); return 1
+    with open(output_path, "w", encoding="utf-8") as f: json.dump({"entries": list(entries.values())}, f, ensure_ascii=False, indent=1)
+    print(f"同梱用の任務名索引を作成しました: {output_path} ({len(entries)}件)"); return 0
+
+def toggle_guide_prefetch():
+    """GUIの「攻略ページを先読み」チェックボックスに合わせて先読みを開始・停止する"""
+    global prefetch_enabled_var, guide_prefetcher
+    if prefetch_enabled_var.get():
+        if guide_prefetcher is None: guide_prefetcher = GuidePrefetcher()
+        guide_prefetcher.start(); status_label_var.set(f"攻略ページの先読みを開始しました {guide_prefetcher.stats()}")
+    elif guide_prefetcher is not None:
+        guide_prefetcher.stop(); status_label_var.set(f"攻略ページの先読みを停止しました {guide_prefetcher.stats()}")
 
 # --- GUIイベントハンドラ関数 ---
+# --- 結果表示 (任務ごとのペイン。タブの中身は初めて選択されたときに作る) ---
+RESULT_FONT_FAMILY = "MS Gothic" # または適切なフォント
+RESULT_FONT_SIZE = 9 # ScrolledTextの基本フォントサイズを想定
+
+def format_bullet_lines(items):
+    """文字列のリスト・タプルを「- 項目」の行にした (テキスト, タグ) の区切りリストを返す"""
+    if not items or not isinstance(items, (list, tuple)): return [("(情報なし)\n", None)]
+    return [("".join(f"- {item}\n" for item in items), None)]
+
+def format_sortie_item(sortie_item):
+    segments = []
+    if sortie_item.fleet_examples:
+        segments.append(("編成例:\n", "sub_header_style"))
+        segments.append(("".join(f"  - {comp}\n" for comp in sortie_item.fleet_examples), "fleet_example_style"))
+    if sortie_item.fleet_notes:
+        segments.append(("\n編成備考:\n", "sub_header_style"))
+        segments.append(("".join(f"  - {note}\n" for note in sortie_item.fleet_notes), None))
+    return segments
+
+def format_expedition_item(expedition_item):
+    lines = []
+    for table_row_dict in expedition_item.table.rows():
+        row_str = "  " + "".join(f"{rk}: {rv}; " for rk, rv in table_row_dict.items())
+        lines.append(row_str.strip().rstrip(';') + "\n")
+    return [("".join(lines), None)]
+
+def format_arsenal_items(arsenal_items):
+    """開発レシピ表 (CompactTable) または文字列のタプル"""
+    if not arsenal_items: return [("(情報なし)\n", None)]
+    lines = []
+    for item_idx, item in enumerate(arsenal_items.rows() if isinstance(arsenal_items, CompactTable) else arsenal_items):
+        if isinstance(item, dict):
+            display_text = f"  ● ({item_idx + 1}) " + "".join(f"{dk}: {dv}; " for dk, dv in item.items())
+            lines.append(display_text.strip().rstrip(';') + "\n")
+        else: lines.append(f"- {item}\n")
+    return [("".join(lines), None)]
+
+def join_text_segments(segments):
+    """(テキスト, タグ) の区切りを1つの文字列と、タグごとの (開始, 終了) 文字位置にまとめる (同じタグの連続区間は結合)"""
+    parts = []; tag_ranges = []; offset = 0
+    for text, tag in segments:
+        if not text: continue
+        parts.append(text)
+        if tag:
+            if tag_ranges and tag_ranges[-1][0] == tag and tag_ranges[-1][2] == offset: tag_ranges[-1] = (tag, tag_ranges[-1][1], offset + len(text))
+            else: tag_ranges.append((tag, offset, offset + len(text)))
+        offset += len(text)
+    return "".join(parts), tag_ranges
+
+def create_result_text(parent, segments, height=10):
+    """読み取り専用の ScrolledText を作り、全文を1回の insert で入れてからタグ範囲を付ける"""
+    widget = scrolledtext.ScrolledText(parent, wrap=tk.WORD, height=height, relief=tk.GROOVE, borderwidth=1)
+    widget.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
+    widget.tag_configure("fleet_example_style", font=(RESULT_FONT_FAMILY, RESULT_FONT_SIZE + 3, "bold"), foreground="blue")
+    widget.tag_configure("sub_header_style", font=(RESULT_FONT_FAMILY, RESULT_FONT_SIZE + 1, "bold"))
+    text, tag_ranges = join_text_segments(segments)
+    widget.insert("1.0", text)
+    for tag, start, end in tag_ranges: widget.tag_add(tag, f"1.0 + {start} chars", f"1.0 + {end} chars")
+    widget.config(state=tk.DISABLED)
+    return widget
+
+class LazyNotebook(ttk.Notebook):
+    """タブが初めて選択されたときに builder(タブのフレーム) を呼んで中身を作る Notebook"""
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+        self._pending_builders = {} # タブのフレーム名 -> builder
+        self.bind("<<NotebookTabChanged>>", self.build_selected, add="+")
+
+    def add_lazy(self, text, builder):
+        frame = ttk.Frame(self); self.add(frame, text=text)
+        self._pending_builders[str(frame)] = builder
+        return frame
+
+    def build_selected(self, event=None):
+        selected = self.select()
+        builder = self._pending_builders.pop(selected, None) if selected else None
+        if builder: builder(self.nametowidget(selected))
+
+class MissionResultPane:
+    """1つの任務の抽出結果を表示するペイン。カテゴリのタブと、出撃/遠征の海域・遠征ごとのサブタブは遅延生成する"""
+    def __init__(self, parent_notebook, slot_idx, details):
+        self.slot_idx = slot_idx; self.details = details # MissionDetails
+        self.frame = ttk.Frame(parent_notebook)
+        self.notebook = LazyNotebook(self.frame); self.notebook.pack(expand=True, fill=tk.BOTH, pady=5)
+        self.notebook.add_lazy('任務内容', lambda tab: create_result_text(tab, format_bullet_lines(details.conditions), height=4))
+        self.notebook.add_lazy('報酬', lambda tab: create_result_text(tab, format_bullet_lines(details.rewards), height=4))
+        self.notebook.add_lazy('出撃情報', self._build_sortie_tab)
+        self.notebook.add_lazy('遠征詳細', self._build_expedition_tab)
+        self.notebook.add_lazy('開発レシピ', lambda tab: create_result_text(tab, format_arsenal_items(details.arsenal), height=6))
+
+    @property
+    def tab_title(self):
+        title = self.details.ocr_name or self.details.title or "任務"
+        return f"{self.slot_idx + 1}: {title[:12]}"
+
+    def show(self): self.notebook.build_selected() # ペインが選択されたら表示中のタブだけ作る
+
+    def _build_sortie_tab(self, tab):
+        sortie_data_list = self.details.sorties
+        if not sortie_data_list: ttk.Label(tab, text="(出撃情報なし)").pack(padx=5, pady=5); return
+        sortie_notebook = LazyNotebook(tab); sortie_notebook.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
+        for sortie_item in sortie_data_list:
+            sortie_notebook.add_lazy(sortie_item.map_name[:20], lambda sub_tab, item=sortie_item: create_result_text(sub_tab, format_sortie_item(item), height=10)) # タブ名は20文字まで
+        sortie_notebook.build_selected()
+
+    def _build_expedition_tab(self, tab):
+        expedition_data_list = self.details.expeditions
+        if not expedition_data_list: ttk.Label(tab, text="(遠征詳細なし)").pack(padx=5, pady=5); return
+        expedition_notebook = LazyNotebook(tab); expedition_notebook.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
+        for ed_item in expedition_data_list:
+            expedition_notebook.add_lazy(ed_item.name[:20], lambda sub_tab, item=ed_item: create_result_text(sub_tab, format_expedition_item(item), height=6))
+        expedition_notebook.build_selected()
+
+def show_selected_mission_pane(event=None):
+    """任務ペインのタブが切り替わったら、上部の任務名・サイト名・URL表示をその任務に合わせる"""
+    global mission_name_var, site_name_var, url_var
+    if not results_notebook or not results_notebook.select(): return
+    selected = str(results_notebook.select())
+    for pane in mission_result_panes.values():
+        if str(pane.frame) != selected: continue
+        if mission_name_var: mission_name_var.set(pane.details.title or "N/A")
+        if site_name_var: site_name_var.set(pane.details.site or "N/A")
+        if url_var: url_var.set(pane.details.url or "N/A")
+        pane.show(); return
+
 def clear_mission_details_gui():
-    global mission_name_var, site_name_var, url_var, content_text, rewards_text, sortie_info_text, expedition_info_text, arsenal_info_text
+    global mission_name_var, site_name_var, url_var, mission_result_panes
     if mission_name_var: mission_name_var.set("")
     if site_name_var: site_name_var.set("")
     if url_var: url_var.set("")
-    widgets = [content_text, rewards_text, sortie_info_text, expedition_info_text, arsenal_info_text]
-    for widget in widgets:
-        if widget and widget.winfo_exists(): widget.config(state=tk.NORMAL); widget.delete('1.0', tk.END); widget.config(state=tk.DISABLED)
-
-def update_mission_details_gui(details_dict):
-    """抽出された詳細情報 (details_dict) を対応するGUIウィジェットに表示する (サブタブ対応・スタイル適用版)"""
-    # グローバル変数として定義されたGUIウィジェットとStringVarを参照
-    global mission_name_var, site_name_var, url_var
-    global content_text, rewards_text, arsenal_info_text # これらは直接 ScrolledText を参照
-    global tab_sortie, tab_expedition # これらはサブNotebookを配置する親の ttk.Frame を参照
-    global root
-
-    if not root or not root.winfo_exists(): 
+    for pane in mission_result_panes.values():
+        if pane.frame.winfo_exists(): pane.frame.destroy()
+    mission_result_panes = {}
+
+@traced_stage("render")
+def update_mission_details_gui(details, slot_idx=0):
+    """抽出された詳細情報 (MissionDetails) をスロットごとの結果ペインに表示する
+    同じスロットの既存ペインは置き換え、ほかのスロットの結果は残す。中身はタブが選択されたときに作る"""
+    global mission_result_panes, results_notebook, root
+    if not root or not root.winfo_exists() or not results_notebook: 
         print("エラー: update_mission_details_gui - rootウィンドウが無効です。")
         return 
 
-    clear_mission_details_gui() # まず既存の表示をクリア
-
-    # 任務名、サイト名、URLをStringVar経由でラベルに設定
-    if mission_name_var: mission_name_var.set(details_dict.get("タイトル", "N/A"))
-    if site_name_var: site_name_var.set(details_dict.get("サイト名", "N/A"))
-    if url_var: url_var.set(details_dict.get("URL", "N/A"))
-
-    # --- 任務内容タブの処理 ---
-    if content_text and content_text.winfo_exists():
-        content_text.config(state=tk.NORMAL); content_text.delete('1.0', tk.END)
-        data_content = details_dict.get("任務内容")
-        if data_content and isinstance(data_content, list) and data_content:
-            for item in data_content: content_text.insert(tk.END, f"- {item}\n")
-        else: content_text.insert(tk.END, "(情報なし)\n")
-        content_text.config(state=tk.DISABLED)
-
-    # --- 報酬タブの処理 ---
-    if rewards_text and rewards_text.winfo_exists():
-        rewards_text.config(state=tk.NORMAL); rewards_text.delete('1.0', tk.END)
-        data_rewards = details_dict.get("報酬")
-        if data_rewards and isinstance(data_rewards, list) and data_rewards:
-            for item in data_rewards: rewards_text.insert(tk.END, f"- {item}\n")
-        else: rewards_text.insert(tk.END, "(情報なし)\n")
-        rewards_text.config(state=tk.DISABLED)
-
-    # --- 出撃情報タブの処理 (サブタブ形式) ---
-    if 'tab_sortie' in globals() and tab_sortie and tab_sortie.winfo_exists():
-        for widget in tab_sortie.winfo_children(): # 既存のウィジェットをクリア
-            widget.destroy()
-
-        sortie_data_list = details_dict.get("出撃情報")
-        if sortie_data_list and isinstance(sortie_data_list, list) and sortie_data_list:
-            sortie_notebook = ttk.Notebook(tab_sortie) # 出撃情報タブ内に新しいNotebook
-            sortie_notebook.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-
-            for sortie_item in sortie_data_list:
-                map_name = sortie_item.get('海域', '海域不明')
-                map_tab_frame = ttk.Frame(sortie_notebook) 
-                sortie_notebook.add(map_tab_frame, text=map_name[:20]) # タブ名は20文字まで
-
-                map_details_st = scrolledtext.ScrolledText(map_tab_frame, wrap=tk.WORD, height=10, relief=tk.GROOVE, borderwidth=1) # heightは適宜調整
-                map_details_st.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-                
-                # スタイルタグを設定 (フォント設定は __main__ で定義したものを参照する形が良いが、ここでは直接定義)
-                font_family = "MS Gothic" # または適切なフォント
-                font_size_normal = 9
-                font_size_large_bold = font_size_normal + 3
-                
-                map_details_st.tag_configure("fleet_example_style", font=(font_family, font_size_large_bold, "bold"), foreground="blue")
-                map_details_st.tag_configure("sub_header_style", font=(font_family, font_size_normal + 1, "bold"))
-
-                map_details_st.config(state=tk.NORMAL)
-                if sortie_item.get("編成例"):
-                    map_details_st.insert(tk.END, "編成例:\n", "sub_header_style")
-                    for comp in sortie_item.get("編成例"):
-                        map_details_st.insert(tk.END, f"  - {comp}\n", "fleet_example_style") 
-                if sortie_item.get("編成備考"):
-                    map_details_st.insert(tk.END, "\n編成備考:\n", "sub_header_style")
-                    for note in sortie_item.get("編成備考"):
-                        map_details_st.insert(tk.END, f"  - {note}\n")
-                map_details_st.config(state=tk.DISABLED)
-        else:
-            ttk.Label(tab_sortie, text="(出撃情報なし)").pack(padx=5, pady=5)
-
-    # --- 遠征詳細タブの処理 (サブタブ形式) ---
-    if 'tab_expedition' in globals() and tab_expedition and tab_expedition.winfo_exists():
-        for widget in tab_expedition.winfo_children(): # 既存のウィジェットをクリア
-            widget.destroy()
-        expedition_data_list = details_dict.get("遠征詳細")
-        if expedition_data_list and isinstance(expedition_data_list, list) and expedition_data_list:
-            expedition_notebook = ttk.Notebook(tab_expedition)
-            expedition_notebook.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-            for ed_item in expedition_data_list:
-                exp_name = ed_item.get('遠征名', '遠征名不明')
-                exp_tab_frame = ttk.Frame(expedition_notebook)
-                expedition_notebook.add(exp_tab_frame, text=exp_name[:20])
-
-                exp_details_st = scrolledtext.ScrolledText(exp_tab_frame, wrap=tk.WORD, height=6, relief=tk.GROOVE, borderwidth=1)
-                exp_details_st.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-                exp_details_st.config(state=tk.NORMAL)
-
-                # 遠征詳細用のスタイルタグ (必要なら)
-                # font_family = "MS Gothic"; font_size_normal = 9
-                # exp_details_st.tag_configure("sub_header_style", font=(font_family, font_size_normal + 1, "bold"))
-
-                if ed_item.get("情報表"):
-                    # exp_details_st.insert(tk.END, "情報表:\n", "sub_header_style") # オプション
-                    for table_row_dict in ed_item.get("情報表", []):
-                        row_str = "  "
-                        for rk, rv in table_row_dict.items():
-                            row_str += f"{rk}: {rv}; "
-                        exp_details_st.insert(tk.END, row_str.strip().rstrip(';') + "\n")
-                exp_details_st.config(state=tk.DISABLED)
-        else:
-            ttk.Label(tab_expedition, text="(遠征詳細なし)").pack(padx=5, pady=5)
-            
-    # --- 開発レシピ表タブの処理 ---
-    if 'arsenal_info_text' in globals() and arsenal_info_text and arsenal_info_text.winfo_exists():
-        widget = arsenal_info_text
-        widget.config(state=tk.NORMAL); widget.delete('1.0', tk.END)
-        data_arsenal = details_dict.get("開発レシピ表")
-        if data_arsenal and isinstance(data_arsenal, list) and data_arsenal:
-            for item_idx, item in enumerate(data_arsenal):
-                if isinstance(item, dict):
-                    display_text = f"  ● ({item_idx + 1}) "
-                    for dk, dv in item.items(): display_text += f"{dk}: {dv}; "
-                    widget.insert(tk.END, display_text.strip().rstrip(';') + "\n")
-                else: widget.insert(tk.END, f"- {item}\n")
-        else: widget.insert(tk.END, "(情報なし)\n")
-        widget.config(state=tk.DISABLED)
-            
-    if root and root.winfo_exists(): 
-        root.update_idletasks()
+    old_pane = mission_result_panes.pop(slot_idx, None)
+    insert_at = tk.END
+    if old_pane is not None and old_pane.frame.winfo_exists():
+        insert_at = results_notebook.index(old_pane.frame); old_pane.frame.destroy()
+        if insert_at >= results_notebook.index(tk.END): insert_at = tk.END # 末尾のペインだった
+    else: # スロット番号順に並べる
+        following = [p for idx, p in mission_result_panes.items() if idx > slot_idx and p.frame.winfo_exists()]
+        if following: insert_at = min(results_notebook.index(p.frame) for p in following)
+    pane = MissionResultPane(results_notebook, slot_idx, details)
+    mission_result_panes[slot_idx] = pane
+    if insert_at == tk.END: results_notebook.add(pane.frame, text=pane.tab_title)
+    else: results_notebook.insert(insert_at, pane.frame, text=pane.tab_title)
+    results_notebook.select(pane.frame) # 最新の結果を表示する (選択イベントで上部の表示と最初のタブが作られる)
+    show_selected_mission_pane()
 
 def process_one_mission_in_thread(slot_idx, ocr_name, status_var_ref, root_ref):
-    global processed_missions_details_gui # スレッド内からは直接GUIリストを更新しない方が安全
-    
+    """スロットの任務検索をスケジューラに登録し、完了したら結果をGUIに反映する (現在の世代の結果のみ)
+    このセッションで検索済みの任務は、検索せずに履歴 (result_history) の結果を表示する"""
+    generation = lookup_scheduler.generation
+
     def schedule_update(func, *args):
-        if root_ref and root_ref.winfo_exists(): root_ref.after(0, lambda: func(*args))
+        if lookup_scheduler.is_current(generation) and root_ref and root_ref.winfo_exists(): root_ref.after(0, lambda: func(*args))
     def update_status(msg):
         if status_var_ref and isinstance(status_var_ref, tk.StringVar): schedule_update(status_var_ref.set, msg)
 
+    def on_done(future):
+        if future.cancelled(): return
+        error = future.exception()
+        if isinstance(error, LookupCancelled): print(f"スロット{slot_idx+1}:「{ocr_name}」の検索は新しい処理により中断されました。"); return
+        if error:
+            error_msg = f"「{ocr_name}」処理中エラー: {error}"; schedule_update(messagebox.showerror, "処理エラー", error_msg); update_status(f"スロット{slot_idx+1}:エラー発生。"); return
+        result = future.result()
+        if result["status"] == "no_source":
+            schedule_update(messagebox.showwarning, "情報源なし", f"「{ocr_name}」の情報源が見つかりません。"); update_status(f"スロット{slot_idx+1}:情報源なし")
+        elif result["status"] == "manual":
+            schedule_update(messagebox.showinfo, "手動確認", f"「{ocr_name}」は次のURLを手動で確認してください:\n{result['url']}"); update_status(f"スロット{slot_idx+1}:手動確認")
+        else:
+            schedule_update(update_mission_details_gui, result_history.put(ocr_name, result["details"]), slot_idx)
+            update_status(f"スロット{slot_idx+1}:「{ocr_name[:15]}...」表示完了。")
+
+    remembered = result_history.get(ocr_name)
+    if remembered is not None: # このセッションで検索済みの任務は検索を省略する
+        print(f"スロット{slot_idx+1}:「{ocr_name}」は検索済みのため履歴の結果を表示します {result_history.stats()}")
+        schedule_update(update_mission_details_gui, remembered, slot_idx); update_status(f"スロット{slot_idx+1}:「{ocr_name[:15]}...」表示完了 (履歴)。")
+        return None
     update_status(f"スロット{slot_idx+1}:「{ocr_name[:15]}...」検索中...")
-    final_details = None
-    try:
-        source_opts = get_mission_source_urls(ocr_name)
-        if not source_opts: schedule_update(messagebox.showwarning, "情報源なし", f"「{ocr_name}」の情報源が見つかりません。"); update_status(f"スロット{slot_idx+1}:情報源なし"); return
-        
-        chosen_url, chosen_site = source_opts[0] # 最初の候補を使用
-        # GUIへの途中経過表示は update_mission_details_gui でまとめて行う
-        if "Google検索 (手動確認用)" in chosen_site:
-            schedule_update(messagebox.showinfo, "手動確認", f"「{ocr_name}」はGoogle検索URL参照:\n{chosen_url}"); update_status(f"スロット{slot_idx+1}:Google手動確認"); return
-
-        update_status(f"スロット{slot_idx+1}:「{chosen_site}」から取得中...")
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        page_resp = requests.get(chosen_url, headers=headers, timeout=15); page_resp.raise_for_status(); page_resp.encoding = page_resp.apparent_encoding
-        html = page_resp.text; soup_obj = BeautifulSoup(html, 'html.parser')
-        title_tag = soup_obj.find('title'); title = title_tag.get_text(strip=True) if title_tag else "タイトル不明"
-        
-        final_details = {"OCR任務名": ocr_name, "タイトル": title, "サイト名": chosen_site, "URL": chosen_url, "任務内容": [], "報酬": [], "出撃情報": [], "遠征詳細": [], "開発レシピ表": []}
-        extract_specific_mission_details(soup_obj, final_details)
-        
-        schedule_update(update_mission_details_gui, final_details) 
-        # processed_missions_details_gui.append(final_details) # メインスレッド側で追加した方が安全
-        update_status(f"スロット{slot_idx+1}:「{ocr_name[:15]}...」表示完了。")
-    except Exception as e:
-        error_msg = f"「{ocr_name}」処理中エラー: {e}"; schedule_update(messagebox.showerror, "処理エラー", error_msg); update_status(f"スロット{slot_idx+1}:エラー発生。")
+    def show_partial(partial_details): # 任務内容・報酬だけ先に表示し、完了時に全体で置き換える
+        schedule_update(update_mission_details_gui, MissionDetails.from_dict(partial_details), slot_idx); update_status(f"スロット{slot_idx+1}:任務内容と報酬を表示 (残りを取得中)...")
+    future = lookup_scheduler.submit(ocr_name, lambda is_cancelled: lookup_mission_details(ocr_name, lambda msg: update_status(f"スロット{slot_idx+1}:{msg}"), is_cancelled, on_partial=show_partial))
+    future.add_done_callback(on_done)
+    return future
 
 def handle_capture_button_click():
-    global captured_kancolle_image_for_gui, status_label_var, slot_entry_widget, process_slots_button_widget, root
+    global captured_kancolle_image_for_gui, current_slot_coordinates, status_label_var, slot_entry_widget, process_slots_button_widget, root
     print("キャプチャボタンクリック。"); status_label_var.set("艦これウィンドウを検索中..."); root.update_idletasks()
     img = capture_kancolle_window()
     if img:
-        captured_kancolle_image_for_gui = img; messagebox.showinfo("成功", "艦これウィンドウキャプチャ成功！\nステップ2で処理スロットを指定してください。")
+        lookup_scheduler.new_generation() # 前回のキャプチャに対する検索は不要になるので打ち切る
+        current_slot_coordinates = get_slot_layout_detector().resolve(img)
+        captured_kancolle_image_for_gui = RetainedSlotCrops.from_image(img, current_slot_coordinates) # ウィンドウ全体の画像はここで手放す
+        print(f"キャプチャ {img.size[0]}x{img.size[1]} ({img.mode}) からスロットの切り抜き {captured_kancolle_image_for_gui.nbytes // 1024}KB を保持します。")
+        del img; messagebox.showinfo("成功", "艦これウィンドウキャプチャ成功！\nステップ2で処理スロットを指定してください。")
         status_label_var.set("キャプチャ成功！ステップ2へ。"); 
         if slot_entry_widget: slot_entry_widget.config(state=tk.NORMAL)
         if process_slots_button_widget: process_slots_button_widget.config(state=tk.NORMAL)
@@ -612,42 +2803,174 @@ def handle_capture_button_click():
     else: messagebox.showerror("エラー", "艦これウィンドウをキャプチャできませんでした。"); status_label_var.set("キャプチャ失敗。")
 
 def handle_process_slots_button_click():
-    global captured_kancolle_image_for_gui, status_label_var, slot_entry_var, root, MISSION_SLOT_COORDINATES
+    global captured_kancolle_image_for_gui, status_label_var, slot_entry_var, root, current_slot_coordinates
     if not captured_kancolle_image_for_gui: messagebox.showwarning("注意", "先にウィンドウをキャプチャ。"); return
     choice_str = slot_entry_var.get()
     if not choice_str: messagebox.showwarning("入力エラー", "スロット番号未入力。"); return
     clear_mission_details_gui(); status_label_var.set("選択スロットの処理を開始します..."); root.update_idletasks()
-    selected_indices = []
-    try:
-        if choice_str.lower() == 'all': selected_indices = list(range(len(MISSION_SLOT_COORDINATES)))
-        else:
-            parts = choice_str.split(','); temp_indices = []; valid = True
-            for p_str in parts:
-                s_idx_str = p_str.strip(); 
-                if not s_idx_str: continue
-                idx = int(s_idx_str) - 1
-                if 0 <= idx < len(MISSION_SLOT_COORDINATES): 
-                    if idx not in temp_indices: temp_indices.append(idx)
-                else: messagebox.showerror("入力エラー", f"{idx+1}は無効な番号。"); valid=False; break
-            if valid and temp_indices: selected_indices = sorted(temp_indices)
-            elif valid and not temp_indices: messagebox.showwarning("入力エラー", "有効な番号なし。"); status_label_var.set("入力エラー。"); return
-            elif not valid: status_label_var.set("入力エラー。"); return
-    except ValueError: messagebox.showerror("入力エラー", "番号をカンマ区切りで。例:1,2,3 or all"); status_label_var.set("入力エラー。"); return
+    try: selected_indices = parse_slot_spec(choice_str, len(current_slot_coordinates))
+    except ValueError as e: messagebox.showerror("入力エラー", str(e)); status_label_var.set("入力エラー。"); return
     except Exception as e: messagebox.showerror("エラー", f"スロット番号処理中エラー: {e}"); status_label_var.set("処理エラー。"); return
-    if not selected_indices: status_label_var.set("処理スロット未選択。"); return
+    if not selected_indices: messagebox.showwarning("入力エラー", "有効な番号なし。"); status_label_var.set("入力エラー。"); return
     
+    lookup_scheduler.new_generation() # 再クリック時は前回の検索ジョブを打ち切る
     status_label_var.set(f"処理対象スロット: {[i+1 for i in selected_indices]} の処理を開始...")
     root.update_idletasks()
     
+    if OCR_BATCH_MODE and len(selected_indices) > 1: status_label_var.set(f"{len(selected_indices)}スロットを一括OCR中..."); root.update_idletasks()
+    ocr_texts = ocr_selected_slots(captured_kancolle_image_for_gui, current_slot_coordinates, selected_indices)
+
     for slot_idx in selected_indices:
-        coords = MISSION_SLOT_COORDINATES[slot_idx]
-        ocr_name = ocr_specific_slot(captured_kancolle_image_for_gui, coords, slot_idx + 1) # デバッグ用に番号渡し
-        if not ocr_name: messagebox.showwarning("OCR結果なし", f"スロット {slot_idx + 1} からテキストを読み取れませんでした。スキップします。"); continue
-        
-        thread = threading.Thread(target=process_one_mission_in_thread, args=(slot_idx, ocr_name, status_label_var, root), daemon=True)
-        thread.start()
-    # 全てのスレッドが開始された後のメッセージ
-    # status_label_var.set("全選択スロットの処理を開始しました。(バックグラウンド実行)") # これは各スレッド完了時に更新
+        ocr_name = ocr_texts[slot_idx]
+        if not ocr_name: messagebox.showwarning("OCR結果なし", f"スロット {slot_idx + 1} から任務名を読み取れませんでした。スキップします。"); continue
+
+        process_one_mission_in_thread(slot_idx, ocr_name, status_label_var, root)
+
+# --- 監視モード ---
+class SlotChangeDetector:
+    """スロットごとに縮小グレースケール画像を前フレームと比較し、内容が変わって落ち着いたスロットを返す"""
+    def __init__(self, slot_count, threshold=WATCH_DIFF_THRESHOLD, debounce_frames=WATCH_DEBOUNCE_FRAMES, signature_size=WATCH_SIGNATURE_SIZE):
+        self.threshold = threshold; self.debounce_frames = max(0, debounce_frames); self.signature_size = signature_size
+        self.previous = [None] * slot_count # 前フレームの縮小画像
+        self.processed = [None] * slot_count # 最後にOCRへ回したときの縮小画像
+        self.stable_counts = [0] * slot_count
+
+    def signature(self, slot_image):
+        return slot_image.convert("L").resize(self.signature_size, Image.BOX)
+
+    def differs(self, a, b):
+        if a is None or b is None: return True
+        return ImageChops.difference(a, b).getextrema()[1] > self.threshold
+
+    def update(self, slot_images):
+        """今回のフレームのスロット画像を受け取り、OCRすべきスロット番号(0始まり)のリストを返す"""
+        ready = []
+        for i, slot_image in enumerate(slot_images):
+            sig = self.signature(slot_image)
+            if self.differs(sig, self.previous[i]): self.stable_counts[i] = 0
+            else: self.stable_counts[i] += 1
+            self.previous[i] = sig
+            if self.stable_counts[i] >= self.debounce_frames and self.differs(sig, self.processed[i]):
+                self.processed[i] = sig; ready.append(i)
+        return ready
+
+    def forget(self, slot_idx):
+        """OCRに失敗したスロットを次のフレームで再試行させる"""
+        self.processed[slot_idx] = None
+
+class WatchModeController:
+    """バックグラウンドで定期的にキャプチャし、変化したスロットだけ process_one_mission_in_thread に渡す"""
+    def __init__(self, root_ref, status_var_ref, fps=WATCH_FPS, debounce_frames=WATCH_DEBOUNCE_FRAMES):
+        self.root_ref = root_ref; self.status_var_ref = status_var_ref
+        self.interval = 1.0 / max(fps, 0.01); self.debounce_frames = debounce_frames
+        self._stop_event = threading.Event(); self._thread = None
+        self._layout_checked_at = float("-inf")
+        self._layout_key = None; self._layout_coords = None # 最後にスロット座標を解決したウィンドウと、その結果 (手動座標への代替を含む)
+        self._layout_retry = False # 未キャリブレーションのまま、スロットに変化があった (次の確認時にキャリブレーションを再試行する)
+
+    @property
+    def running(self): return self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set()
+
+    def start(self):
+        if self.running: return
+        # 停止直後の再開でも前のスレッドが動き続けないよう、開始ごとに新しいイベントを渡す
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_event,), name="watch-mode", daemon=True); self._thread.start()
+        print(f"監視モード開始 ({1.0 / self.interval:g}fps, デバウンス{self.debounce_frames}フレーム)")
+
+    def stop(self):
+        """停止を指示してすぐ戻る (Tkのスレッドから呼ぶため join しない)。スレッドは処理中のフレームを終えたら自分で終わる"""
+        self._stop_event.set(); self._thread = None; print("監視モード停止")
+
+    def _set_status(self, msg):
+        if self.root_ref and self.status_var_ref: self.root_ref.after(0, lambda: self.status_var_ref.set(msg))
+
+    def _run(self, stop_event):
+        global captured_kancolle_image_for_gui, current_slot_coordinates
+        detector = None; slot_coords = None
+        capturer = RegionCapturer(); window_missing = False
+        while not stop_event.is_set():
+            started = time.perf_counter()
+            try:
+                coords = self._resolve_slot_coordinates(capturer)
+                if coords != slot_coords: # ウィンドウの大きさが変わった等。前フレームとの比較をやり直す
+                    slot_coords = coords; detector = SlotChangeDetector(len(coords), debounce_frames=self.debounce_frames) if coords else None
+                frame = capturer.grab_slots(slot_coords) if slot_coords else None
+                if frame is None:
+                    if not window_missing: self._set_status("監視中: 艦これウィンドウが見つかりません。")
+                    window_missing = True
+                else:
+                    if window_missing: self._set_status("監視中: ウィンドウを再検出しました。")
+                    window_missing = False
+                    # 手動のスロット処理 (ステップ2) でも最新フレームを使えるようにする
+                    captured_kancolle_image_for_gui = RetainedSlotCrops.from_region(frame, slot_coords); current_slot_coordinates = slot_coords
+                    slot_images = [frame.crop(c) for c in slot_coords]
+                    changed = detector.update(slot_images)
+                    if changed: self._layout_retry = True; self._process_changed_slots(frame, slot_coords, changed, detector, stop_event)
+            except Exception as e: print(f"監視モードの処理中にエラー: {e}")
+            stop_event.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def _resolve_slot_coordinates(self, capturer):
+        """ウィンドウの大きさに対応するスロット座標。ウィンドウが変わったときはすぐに、それ以外は
+        WATCH_LAYOUT_RECHECK_SECONDS ごとに全体をキャプチャして検出し直す (大きさが同じままブラウザのズームだけ変わった場合に追従するため)
+        キャリブレーションできていない (手動座標で代用中の) ウィンドウは、スロットに変化があったときだけ再試行する
+        (キャリブレーションの確認はOCRを伴うので、変化の無い画面で繰り返さない)"""
+        layout_detector = get_slot_layout_detector(); window_key = capturer.window_key()
+        if window_key is None: return None
+        if layout_detector.mode == "manual": return layout_detector.cached(window_key)
+        if window_key == self._layout_key and self._layout_coords is not None:
+            if time.monotonic() - self._layout_checked_at < WATCH_LAYOUT_RECHECK_SECONDS: return self._layout_coords
+            if not self._layout_retry and layout_detector.cached(window_key) is None: return self._layout_coords
+        self._layout_checked_at = time.monotonic(); self._layout_retry = False
+        full_frame = capture_kancolle_window(activate_window=False, verbose=False)
+        if not full_frame: return self._layout_coords if window_key == self._layout_key else layout_detector.cached(window_key)
+        self._layout_key = window_key; self._layout_coords = layout_detector.resolve(full_frame)
+        return self._layout_coords
+
+    def _process_changed_slots(self, frame, slot_coords, changed, detector, stop_event):
+        print(f"監視モード: 変化したスロット {[i+1 for i in changed]} をOCRします。")
+        self._set_status(f"監視中: スロット {[i+1 for i in changed]} の変化を検出。")
+        texts = ocr_selected_slots(frame.image, [frame.local_coords(c) for c in slot_coords], changed)
+        for slot_idx in changed:
+            if stop_event.is_set(): return
+            ocr_name = texts[slot_idx]
+            if not ocr_name: detector.forget(slot_idx); continue # 空きスロット等。次のフレームで再試行
+            process_one_mission_in_thread(slot_idx, ocr_name, self.status_var_ref, self.root_ref)
+
+def toggle_watch_mode():
+    """GUIの「監視モード」チェックボックスに合わせて監視を開始・停止する"""
+    global watch_mode_var, watch_controller, slot_entry_widget, process_slots_button_widget
+    if watch_mode_var.get():
+        if watch_controller is None: watch_controller = WatchModeController(root, status_label_var)
+        watch_controller.start(); status_label_var.set("監視モード: 変化したスロットを自動で処理します。")
+        if slot_entry_widget: slot_entry_widget.config(state=tk.NORMAL)
+        if process_slots_button_widget: process_slots_button_widget.config(state=tk.NORMAL)
+    elif watch_controller is not None:
+        watch_controller.stop(); status_label_var.set("監視モードを停止しました。")
+
+def handle_reset_slot_layout_click():
+    """保存済みのスロット位置の検出結果を捨て、次のキャプチャで検出し直す"""
+    get_slot_layout_detector().clear()
+    status_label_var.set("スロット位置の検出結果を破棄しました。次のキャプチャで再検出します。")
+
+def toggle_stage_tracing():
+    """GUIの「処理時間を計測」チェックボックスに合わせて計測を切り替える"""
+    global trace_enabled_var
+    if trace_enabled_var.get(): stage_tracer.enable(TRACE_FILE)
+    else: stage_tracer.disable()
+
+def show_stage_timing_summary():
+    """段階ごとの直近の処理時間 (p50/p95/最大) を表示する"""
+    summary = stage_tracer.summary()
+    if not summary:
+        messagebox.showinfo("処理時間", "計測結果がありません。\n「処理時間を計測」をオンにしてから処理を実行してください。"); return
+    lines = [f"{stage}: {s['count']}件  p50 {s['p50_ms']}ms / p95 {s['p95_ms']}ms / 最大 {s['max_ms']}ms" for stage, s in summary.items()]
+    if _ocr_backend is not None:
+        ocr_latency = _ocr_backend.latency_summary()
+        lines.append(f"OCRエンジン ({ocr_latency['backend']}): {ocr_latency['calls']}回 / 平均 {ocr_latency['avg_ms']}ms / 直近 {ocr_latency['last_ms']}ms")
+    for host, h in host_health.stats().items():
+        lines.append(f"{host}: 平均 {h['avg_ms']}ms / タイムアウト {h['timeout_s']}秒 / 失敗 {h['failures']}件" + (f" / 遮断中 (あと{h['open_s']}秒)" if h['open_s'] else ""))
+    messagebox.showinfo("処理時間 (直近の集計)", "\n".join(lines))
 
 def copy_url_to_clipboard():
     """表示されているURLをクリップボードにコピーする"""
@@ -681,8 +3004,383 @@ def copy_url_to_clipboard():
         messagebox.showwarning("コピー対象なし", "コピーする有効なURLがありません。")
         if status_label_var: status_label_var.set("コピーするURLがありません。")
 
+# --- オフラインベンチマーク ---
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench")
+BENCH_CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+BENCH_BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+BENCH_LATENCY_TOLERANCE = 0.5 # 基準値より p50 がこの割合を超えて遅くなったら回帰とみなす
+BENCH_LATENCY_SLACK_MS = 1.0 # ごく短い処理で計測誤差を回帰と誤判定しないための余裕 (ms)
+
+class BenchmarkStage:
+    """1つの処理段階の計測結果 (処理時間のサンプルと正解数)"""
+    def __init__(self, name):
+        self.name = name; self.samples_ms = []; self.correct = 0; self.total = 0
+
+    def time_call(self, func, *args):
+        with contextlib.redirect_stdout(io.StringIO()): # 処理中のログ出力は計測に含めない
+            started = time.perf_counter(); result = func(*args); self.samples_ms.append((time.perf_counter() - started) * 1000)
+        return result
+
+    def score(self, correct, total=1):
+        self.correct += correct; self.total += total
+
+    def summary(self):
+        samples = sorted(self.samples_ms)
+        def percentile(q): return round(samples[round((len(samples) - 1) * q)], 3) if samples else 0.0
+        return {"samples": len(samples), "p50_ms": percentile(0.5), "p90_ms": percentile(0.9), "p99_ms": percentile(0.99), "max_ms": round(samples[-1], 3) if samples else 0.0,
+                "mean_ms": round(statistics.fmean(samples), 3) if samples else 0.0, "accuracy": round(self.correct / self.total, 4) if self.total else None}
+
+def _bench_new_details(soup):
+    title_tag = soup.find('title')
+    return {"タイトル": title_tag.get_text(strip=True) if title_tag else "タイトル不明", "任務内容": [], "報酬": [], "出撃情報": [], "遠征詳細": [], "開発レシピ表": []}
+
+def _bench_extract(html, url=None, adapter=None):
+    adapter = adapter or get_site_adapter(url)
+    soup = parse_guide_page(html, adapter.area_classes); details = _bench_new_details(soup); details["URL"] = url
+    extract_specific_mission_details(soup, details, adapter)
+    return details
+
+def _bench_reuse_stored_details(store, html, url):
+    """一時的な保存先 store で同じページを2回抽出し、(2回目の結果, 2回目に解析した回数, 2回目の処理時間ms) を返す"""
+    load_or_extract_details(None, url, None, html, store=store)
+    tracer = StageTracer(); tracer.enabled = True # 2回目の parse の回数を数える (ファイルには書き出さない)
+    started = time.perf_counter(); details = load_or_extract_details(None, url, None, html, store=store, tracer=tracer); elapsed_ms = (time.perf_counter() - started) * 1000
+    return details, tracer.summary().get("parse", {}).get("count", 0), elapsed_ms
+
+BENCH_LAYOUT_SLOTS = [(0.36, 0.30 + 0.1 * i, 0.94, 0.335 + 0.1 * i) for i in range(5)] # 合成キャプチャのスロット (ゲーム画面に対する相対位置)
+BENCH_LAYOUT_DESIGN = ((1650, 1000), (200, 120, 1450, 870)) # 手動座標を作ったときの (ウィンドウの大きさ, ゲーム画面)
+# (ウィンドウの大きさ, ゲーム画面, キャリブレーション済みになるべきか)。最初は手動座標と違うズーム、次に手動座標のズーム、その後はリサイズとズーム変更
+BENCH_LAYOUT_SCENARIOS = [((1650, 1000), (100, 60, 1550, 930), False), (*BENCH_LAYOUT_DESIGN, True),
+                          ((1200, 800), (100, 80, 1100, 680), True), ((1200, 800), (50, 50, 1150, 710), True), ((1200, 800), (100, 80, 1100, 680), True)]
+BENCH_LAYOUT_TOLERANCE = 6 # 期待するスロット座標とのずれの許容 (px。ゲーム画面の検出は縮小画像で行うため数px ずれる)
+
+def _bench_layout_slots(canvas):
+    cw, ch = canvas[2] - canvas[0], canvas[3] - canvas[1]
+    return [(canvas[0] + round(r[0] * cw), canvas[1] + round(r[1] * ch), canvas[0] + round(r[2] * cw), canvas[1] + round(r[3] * ch)) for r in BENCH_LAYOUT_SLOTS]
+
+def _bench_layout_capture(window_size, canvas):
+    """模様のあるゲーム画面と、単色 (赤) で塗ったスロットを描いた合成キャプチャ"""
+    img = Image.new("RGB", window_size, (200, 200, 200))
+    img.paste(Image.effect_noise((canvas[2] - canvas[0], canvas[3] - canvas[1]), 64).convert("RGB"), canvas[:2])
+    for slot in _bench_layout_slots(canvas): img.paste((255, 0, 0), slot)
+    return img
+
+def _bench_layout_slots_marked(img, slot_coords_list):
+    """OCRの代わりのキャリブレーション確認: 手動座標の中央がどれも合成キャプチャのスロット (赤) に当たっているか"""
+    return all(img.getpixel(((x1 + x2) // 2, (y1 + y2) // 2)) == (255, 0, 0) for x1, y1, x2, y2 in slot_coords_list)
+
+def _bench_score_search(html, query):
+    soup = parse_search_results_page(html)
+    if is_zekamashi_no_results_page(soup): return None
+    best_url, best_score = score_zekamashi_search_results(soup, normalize_mission_name(query))
+    return best_url if best_score >= ZEKAMASHI_MIN_SEARCH_SCORE else None
+
+def _bench_ocr_available():
+    try:
+        if get_ocr_backend().name == "pytesseract": pytesseract.get_tesseract_version()
+        return True
+    except Exception: return False
+
+def add_bench_screenshot(image_path, slot_names, corpus_dir=BENCH_CORPUS_DIR):
+    """スクリーンショットをコーパスにコピーし、スロットごとの正しい任務名 (先頭から順に。"-" は対象外) をmanifestに追加する"""
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    with open(manifest_path, encoding="utf-8") as f: manifest = json.load(f)
+    slots = {str(i + 1): name for i, name in enumerate(slot_names) if name and name != "-"}
+    if not slots: print("エラー: 正しい任務名が1つも指定されていません。", file=sys.stderr); return 2
+    rel_path = "screenshots/" + os.path.basename(image_path)
+    os.makedirs(os.path.join(corpus_dir, "screenshots"), exist_ok=True)
+    shutil.copyfile(image_path, os.path.join(corpus_dir, rel_path))
+    manifest.setdefault("screenshots", []).append({"file": rel_path, "slots": slots})
+    with open(manifest_path, "w", encoding="utf-8") as f: json.dump(manifest, f, ensure_ascii=False, indent=1)
+    print(f"コーパスにスクリーンショットを追加しました: {rel_path} (スロット {', '.join(slots)})"); return 0
+
+def add_bench_guide_page(url, corpus_dir=BENCH_CORPUS_DIR):
+    """攻略ページを全体取得してコーパスに保存し、現在の抽出結果を期待結果として manifest に追加する
+    期待結果はそのまま正解とはかぎらないため、ページと見比べて確かめてから基準値に加える"""
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    with open(manifest_path, encoding="utf-8") as f: manifest = json.load(f)
+    page = fetch_page(url, accept_truncated=False) # 本文を打ち切ったキャッシュは使わない
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", urllib.parse.unquote(urllib.parse.urlparse(url).path).strip("/").rsplit("/", 1)[-1]).strip("_-") or hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+    rel_path = f"pages/{slug}.html"; expected_rel_path = f"pages/{slug}.expected.json"
+    os.makedirs(os.path.join(corpus_dir, "pages"), exist_ok=True)
+    with open(os.path.join(corpus_dir, rel_path), "w", encoding="utf-8") as f: f.write(page.text)
+    details = _bench_extract(page.text, url)
+    with open(os.path.join(corpus_dir, expected_rel_path), "w", encoding="utf-8") as f: json.dump({key: details.get(key) for key in DETAIL_RECORD_KEYS}, f, ensure_ascii=False, indent=1)
+    manifest.setdefault("guide_pages", []).append({"file": rel_path, "expected": expected_rel_path, "url": url})
+    with open(manifest_path, "w", encoding="utf-8") as f: json.dump(manifest, f, ensure_ascii=False, indent=1)
+    print(f"コーパスに攻略ページを追加しました: {rel_path}。期待結果 {expected_rel_path} をページと見比べて確かめてください。"); return 0
+
+def run_offline_benchmark(corpus_dir=BENCH_CORPUS_DIR, baseline_path=BENCH_BASELINE_FILE, update_baseline=False, repeat=5):
+    """保存済みのスクリーンショット・検索結果・攻略ページで各処理の速度と正確さを計測し、基準値と比較する
+    回帰があれば 1、なければ 0 を返す"""
+    global OCR_CACHE_ENABLED
+    with open(os.path.join(corpus_dir, "manifest.json"), encoding="utf-8") as f: manifest = json.load(f)
+    def corpus_file(rel_path): return os.path.join(corpus_dir, rel_path)
+    stages = {name: BenchmarkStage(name) for name in ("ocr_specific_slot", "search_scoring", "parse_tablepress_table", "extract_specific_mission_details", "details_store_reuse", "slot_layout")}
+
+    screenshots = manifest.get("screenshots", [])
+    if not screenshots: print("警告: コーパスにスクリーンショットが無いため、OCRの回帰は計測されません (--bench-add-screenshot で追加できます)。")
+    elif not _bench_ocr_available(): print("警告: Tesseractが見つからないため、OCRの計測を省略します。"); screenshots = []
+    if not any(not entry.get("synthetic") for entry in manifest.get("guide_pages", [])):
+        print("警告: コーパスの攻略ページが構造を模したサンプルだけのため、実際のページでの抽出の回帰は計測されません (--bench-add-page で追加できます)。")
+    ocr_cache_was_enabled = OCR_CACHE_ENABLED; OCR_CACHE_ENABLED = False # キャッシュが効くとOCRの計測にならない
+    try:
+        for entry in screenshots:
+            image = Image.open(corpus_file(entry["file"])); image.load()
+            slot_coordinates = entry.get("slot_coordinates", MISSION_SLOT_COORDINATES)
+            for slot_number, expected_text in entry["slots"].items():
+                coords = slot_coordinates[int(slot_number) - 1]
+                for _ in range(repeat): text = stages["ocr_specific_slot"].time_call(ocr_specific_slot, image, coords, int(slot_number))
+                stages["ocr_specific_slot"].score(quest_match_key(text) == quest_match_key(expected_text))
+    finally: OCR_CACHE_ENABLED = ocr_cache_was_enabled
+
+    # スロット位置の自動検出: 手動座標と違うズームのキャプチャを基準にせず、リサイズとズーム変更に追従すること
+    with tempfile.TemporaryDirectory() as layout_dir:
+        detector = SlotLayoutDetector(os.path.join(layout_dir, "slot_layout.json"), _bench_layout_slots(BENCH_LAYOUT_DESIGN[1]), mode="auto", persist=False, verify_calibration=_bench_layout_slots_marked)
+        for window_size, canvas, calibrated in BENCH_LAYOUT_SCENARIOS:
+            coords = stages["slot_layout"].time_call(detector.resolve, _bench_layout_capture(window_size, canvas))
+            expected = _bench_layout_slots(canvas) if calibrated else detector.manual_coords
+            matched = (detector._reference is not None) == calibrated and all(abs(p - q) <= BENCH_LAYOUT_TOLERANCE for c, e in zip(coords, expected) for p, q in zip(c, e))
+            stages["slot_layout"].score(matched)
+            if not matched: print(f"  不一致: スロット位置 (ウィンドウ {window_size}, ゲーム画面 {canvas}) {coords}")
+
+    for entry in manifest.get("search_pages", []):
+        with open(corpus_file(entry["file"]), encoding="utf-8") as f: html = f.read()
+        for _ in range(repeat): best_url = stages["search_scoring"].time_call(_bench_score_search, html, entry["query"])
+        stages["search_scoring"].score(best_url == entry.get("expected_url"))
+
+    for entry in manifest.get("guide_pages", []):
+        with open(corpus_file(entry["file"]), encoding="utf-8") as f: html = f.read()
+        with open(corpus_file(entry["expected"]), encoding="utf-8") as f: expected = json.load(f)
+        for table in parse_guide_page(html).find_all('table', class_=lambda x: x and 'tablepress' in x):
+            for _ in range(repeat): stages["parse_tablepress_table"].time_call(parse_tablepress_table, table)
+        for _ in range(repeat): details = stages["extract_specific_mission_details"].time_call(_bench_extract, html, entry.get("url"))
+        field_matches = [details.get(key) == expected.get(key) for key in DETAIL_RECORD_KEYS]
+        stages["extract_specific_mission_details"].score(sum(field_matches), len(field_matches))
+        for key, matched in zip(DETAIL_RECORD_KEYS, field_matches):
+            if not matched: print(f"  不一致: {entry['file']} の「{key}」")
+        # 抽出計画ごとにも計測する (manifest の url のドメインで決まる。段階名は extract[アダプタ名])。
+        # サイト用の計画があるページは汎用の計画でも計測し、extract[generic] と比べられるようにする
+        site_adapter = get_site_adapter(entry.get("url"))
+        for adapter in dict.fromkeys((site_adapter, GENERIC_SITE_ADAPTER)):
+            adapter_stage = stages.setdefault(f"extract[{adapter.name}]", BenchmarkStage(f"extract[{adapter.name}]"))
+            for _ in range(repeat): adapter_details = adapter_stage.time_call(_bench_extract, html, entry.get("url"), adapter)
+            adapter_stage.score(sum(adapter_details.get(key) == expected.get(key) for key in DETAIL_RECORD_KEYS), len(DETAIL_RECORD_KEYS))
+        # 2回目の検索は保存済みの抽出結果を使い、解析し直さないこと (保存先は毎回空の一時ファイル)
+        with tempfile.TemporaryDirectory() as store_dir:
+            store = MissionDetailsStore(os.path.join(store_dir, "details.sqlite3"))
+            try:
+                with contextlib.redirect_stdout(io.StringIO()): stored_details, parse_count, elapsed_ms = _bench_reuse_stored_details(store, html, entry.get("url"))
+            finally: store.close()
+        stages["details_store_reuse"].samples_ms.append(elapsed_ms)
+        stages["details_store_reuse"].score(parse_count == 0 and all(stored_details.get(key) == details.get(key) for key in DETAIL_RECORD_KEYS))
+        if parse_count: print(f"  再解析: {entry['file']} の2回目の抽出で保存済みの結果が使われませんでした")
+
+    results = {name: stage.summary() for name, stage in stages.items() if stage.samples_ms}
+    baseline = {}
+    if os.path.exists(baseline_path) and not update_baseline:
+        with open(baseline_path, encoding="utf-8") as f: baseline = json.load(f).get("stages", {})
+
+    print(f"\nオフラインベンチマーク (コーパス: {corpus_dir}, パーサ: {HTML_PARSER}, 繰り返し: {repeat}回)")
+    print(f"{'段階':<34} {'p50[ms]':>9} {'p90[ms]':>9} {'p99[ms]':>9} {'正解率':>7} {'基準p50':>9} {'判定':>6}")
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name); verdict = "-"
+        if base:
+            verdict = "OK"
+            if result["accuracy"] is not None and base.get("accuracy") is not None and result["accuracy"] < base["accuracy"]:
+                verdict = "NG"; regressions.append(f"{name}: 正解率 {base['accuracy']} -> {result['accuracy']}")
+            if result["p50_ms"] > base["p50_ms"] * (1 + BENCH_LATENCY_TOLERANCE) + BENCH_LATENCY_SLACK_MS:
+                verdict = "NG"; regressions.append(f"{name}: p50 {base['p50_ms']}ms -> {result['p50_ms']}ms")
+        accuracy_text = f"{result['accuracy']:.0%}" if result["accuracy"] is not None else "-"
+        base_text = f"{base['p50_ms']:.3f}" if base else "-"
+        print(f"{name:<34} {result['p50_ms']:>9.3f} {result['p90_ms']:>9.3f} {result['p99_ms']:>9.3f} {accuracy_text:>7} {base_text:>9} {verdict:>6}")
+    for name in stages:
+        if name not in results: print(f"{name:<34} (コーパスに対象データなし)")
+
+    if update_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"html_parser": HTML_PARSER, "python": sys.version.split()[0], "stages": results}, f, ensure_ascii=False, indent=1)
+        print(f"基準値を更新しました: {baseline_path}"); return 0
+    if regressions:
+        print("回帰を検出しました:")
+        for r in regressions: print(f"  - {r}")
+        return 1
+    print("回帰はありません。" if baseline else "基準値がありません (--update-baseline で作成できます)。")
+    if "ocr_specific_slot" not in results: print("注意: OCR (ocr_specific_slot) は計測していないため、OCRの回帰は判定していません。")
+    return 0
+
+# --- ヘッドレス一括処理 (スクリーンショットのファイル/フォルダ -> JSONL) ---
+BATCH_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+
+def iter_batch_image_paths(paths):
+    """指定されたファイルと、フォルダ内 (サブフォルダを含む) の画像ファイルを名前順に列挙する"""
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.lower().endswith(BATCH_IMAGE_EXTENSIONS): yield os.path.join(dir_path, file_name)
+        else: yield path
+
+def _batch_worker_init(slot_layout_mode):
+    """OCR用の子プロセスの初期化。ログは標準エラーに出し、標準出力はJSONL専用にする
+    OCRキャッシュとスロット位置は読み込むだけにし、追加分は結果と一緒に親プロセスへ返す
+    (複数のプロセスが同じJSONファイルを書き直すと、最後に書いたプロセス以外の追加分が失われるため)"""
+    global SLOT_LAYOUT_MODE, _slot_ocr_cache, _slot_layout_detector
+    sys.stdout = sys.stderr; SLOT_LAYOUT_MODE = slot_layout_mode
+    _slot_ocr_cache = SlotOcrCache(persist=False) if OCR_CACHE_ENABLED else None
+    _slot_layout_detector = SlotLayoutDetector(mode=slot_layout_mode, persist=False)
+
+def _batch_ocr_image(image_path, slot_spec):
+    """子プロセスで1枚の画像のスロットをOCRする (プロセスをまたいで渡せるよう、結果は辞書で返す)"""
+    started = time.perf_counter()
+    try:
+        with Image.open(image_path) as opened: img = opened.convert("RGB")
+        slot_coords = get_slot_layout_detector().resolve(img)
+        selected_indices = parse_slot_spec(slot_spec, len(slot_coords))
+        texts = ocr_selected_slots(img, slot_coords, selected_indices)
+        result = {"image": image_path, "slots": [(i, texts[i]) for i in selected_indices], "ocr_ms": round((time.perf_counter() - started) * 1000, 1), "error": None}
+    except Exception as e: result = {"image": image_path, "slots": [], "ocr_ms": round((time.perf_counter() - started) * 1000, 1), "error": f"{type(e).__name__}: {e}"}
+    cache = get_slot_ocr_cache()
+    result.update(cache_updates=cache.take_updates() if cache else [], layout_updates=get_slot_layout_detector().take_updates())
+    return result
+
+def run_headless_batch(paths, slot_spec="all", output=None, ocr_workers=None, lookup_workers=LOOKUP_MAX_WORKERS, ocr_only=False):
+    """GUIを使わずに画像群を処理し、スロットごとに1行のJSONを結果が出た順に書き出す
+    OCRはプロセスプール (CPUコア数ぶん並列)、検索・取得・抽出は上限付きのスレッドプールで行う。戻り値は終了コード"""
+    image_paths = list(iter_batch_image_paths(paths))
+    if not image_paths: print("エラー: 処理する画像がありません。", file=sys.stderr); return 2
+    try: parse_slot_spec(slot_spec, len(MISSION_SLOT_COORDINATES))
+    except ValueError as e: print(f"エラー: スロット指定が不正です: {e}", file=sys.stderr); return 2
+    out = open(output, "w", encoding="utf-8") if output else sys.stdout
+    write_lock = threading.Lock(); all_emitted = threading.Condition(write_lock)
+    counts = {"slots": 0, "ok": 0, "errors": 0, "pending_lookups": 0}
+    def emit(record):
+        with write_lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n"); out.flush()
+            counts["slots"] += 1
+            if record.get("status") == "ok": counts["ok"] += 1
+            if record.get("error"): counts["errors"] += 1
+    scheduler = MissionLookupScheduler(max_workers=lookup_workers)
+    def lookup_done(record, future):
+        try:
+            result = future.result(); record.update(status=result["status"], url=result["url"], details=result["details"])
+        except Exception as e: record.update(status="error", error=f"{type(e).__name__}: {e}")
+        emit(record)
+        with all_emitted: counts["pending_lookups"] -= 1; all_emitted.notify_all()
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr): # ログがJSONLに混ざらないようにする
+        print(f"一括処理: 画像{len(image_paths)}枚 / スロット指定「{slot_spec}」 / OCRプロセス{ocr_workers or os.cpu_count()} / 検索スレッド{lookup_workers}")
+        with ProcessPoolExecutor(max_workers=ocr_workers, initializer=_batch_worker_init, initargs=(SLOT_LAYOUT_MODE,)) as ocr_pool:
+            ocr_futures = {ocr_pool.submit(_batch_ocr_image, image_path, slot_spec): image_path for image_path in image_paths}
+            cache = get_slot_ocr_cache()
+            for ocr_future in as_completed(ocr_futures):
+                try: ocr_result = ocr_future.result()
+                except Exception as e: # 子プロセスの異常終了 (BrokenProcessPool) など。その画像だけエラーとして書き出して続ける
+                    ocr_result = {"image": ocr_futures[ocr_future], "slots": [], "ocr_ms": None, "error": f"{type(e).__name__}: {e}"}
+                if cache: cache.merge(ocr_result.get("cache_updates", []))
+                if ocr_result.get("layout_updates"): get_slot_layout_detector().merge(ocr_result["layout_updates"])
+                if ocr_result["error"]:
+                    emit({"image": ocr_result["image"], "slot": None, "ocr": None, "status": "error", "error": ocr_result["error"]}); continue
+                for slot_idx, ocr_name in ocr_result["slots"]:
+                    record = {"image": ocr_result["image"], "slot": slot_idx + 1, "ocr": ocr_name, "ocr_ms": ocr_result["ocr_ms"]}
+                    if not ocr_name: record.update(status="no_text"); emit(record); continue
+                    if ocr_only: record.update(status="ocr_only"); emit(record); continue
+                    with all_emitted: counts["pending_lookups"] += 1
+                    future = scheduler.submit(ocr_name, lambda is_cancelled, name=ocr_name: lookup_mission_details(name, is_cancelled=is_cancelled))
+                    future.add_done_callback(functools.partial(lookup_done, record))
+        with all_emitted: all_emitted.wait_for(lambda: counts["pending_lookups"] == 0) # 完了コールバックで書き出し終わるまで待つ
+        elapsed = time.perf_counter() - started
+        print(f"一括処理完了: {len(image_paths)}枚 / {counts['slots']}スロット (取得成功 {counts['ok']} / エラー {counts['errors']}) {elapsed:.1f}秒 {scheduler.stats()}")
+    if output: out.close()
+    return 0
+
+# --- 起動時間の計測とウォームアップ ---
+def warm_up_in_background(on_done=None):
+    """ウィンドウ表示後に、遅延読み込みのモジュールとOCRエンジンをバックグラウンドで先に読み込んでおく
+    (ユーザーが最初にキャプチャ・検索したときに読み込みを待たせないため)。失敗しても実際に使うときに再試行される"""
+    def load_module(module):
+        try: module.load()
+        except Exception as e: print(f"警告: ウォームアップ中に {module._module_name} の読み込みに失敗: {e}")
+
+    def run():
+        started = time.perf_counter()
+        for module in STARTUP_WARMUP_CAPTURE_MODULES: load_module(module)
+        try: get_ocr_backend()
+        except Exception as e: print(f"警告: ウォームアップ中にOCRエンジンの初期化に失敗: {e}")
+        for module in STARTUP_WARMUP_LOOKUP_MODULES: load_module(module)
+        record_startup_event("ウォームアップ完了", (time.perf_counter() - started) * 1000)
+        if on_done: on_done()
+    thread = threading.Thread(target=run, name="startup-warmup", daemon=True); thread.start()
+    return thread
+
+def format_startup_report():
+    """起動からの出来事 (ウィンドウ表示・遅延インポート・OCRエンジン初期化) を時刻順の表にする
+    インタプリタ自体の起動と標準ライブラリの import の内訳は python -X importtime で確認する"""
+    with _startup_timings_lock: events = sorted(startup_timings)
+    lines = ["起動時間の内訳 (このモジュールの読み込み開始からの経過):", f"{'経過[ms]':>10} {'所要[ms]':>10}  {'スレッド':<16} 内容"]
+    for elapsed_ms, label, duration_ms, thread_name in events:
+        lines.append(f"{elapsed_ms:>10.1f} {'-' if duration_ms is None else f'{duration_ms:.1f}':>10}  {thread_name:<16} {label}")
+    lazy_modules = [value for value in globals().values() if isinstance(value, _LazyModule)]
+    pending = sorted(module._module_name for module in lazy_modules if not module.loaded)
+    lines.append(f"未読み込みの遅延モジュール: {', '.join(pending) if pending else 'なし'}")
+    return "\n".join(lines)
+
+def print_startup_report():
+    print(format_startup_report(), file=sys.stderr)
+
+def parse_command_line_args(argv=None):
+    parser = argparse.ArgumentParser(description="艦これ任務サポート GUI (v0.7)")
+    parser.add_argument("--trace", metavar="JSONL", help="処理段階ごとの時間をJSONL形式で記録する (環境変数 OCR_TRACE_FILE と同じ)")
+    parser.add_argument("--bench-parse", nargs="+", metavar="HTML", help="保存した攻略ページのHTML解析時間とピークメモリを計測して終了する")
+    parser.add_argument("--bench", nargs="?", const=BENCH_CORPUS_DIR, metavar="CORPUS_DIR", help="保存済みコーパスでオフラインベンチマークを実行し、基準値より遅く/不正確になっていれば終了コード1で終了する")
+    parser.add_argument("--bench-baseline", default=BENCH_BASELINE_FILE, metavar="JSON", help="ベンチマークの基準値ファイル")
+    parser.add_argument("--bench-repeat", type=int, default=5, metavar="N", help="ベンチマークで各処理を繰り返す回数")
+    parser.add_argument("--update-baseline", action="store_true", help="ベンチマーク結果で基準値ファイルを上書きする")
+    parser.add_argument("--bench-add-screenshot", nargs="+", metavar=("IMAGE", "NAME"), help="任務画面のスクリーンショットと、スロット1から順の正しい任務名 (対象外のスロットは -) をベンチマークのコーパスに追加する")
+    parser.add_argument("--bench-add-page", metavar="URL", help="攻略ページを取得してベンチマークのコーパスに追加する (現在の抽出結果を期待結果として保存するので、内容を確かめてから使う)")
+    parser.add_argument("--batch", nargs="+", metavar="PATH", help="GUIを起動せず、スクリーンショット(ファイルまたはフォルダ)を一括処理して結果をJSONLで出力する")
+    parser.add_argument("--slots", default="all", metavar="SPEC", help="--batch で処理するスロット (例: 1,3 or all)")
+    parser.add_argument("--output", metavar="JSONL", help="--batch の出力先 (省略時は標準出力)")
+    parser.add_argument("--ocr-workers", type=int, metavar="N", help="--batch でOCRに使うプロセス数 (省略時はCPUコア数)")
+    parser.add_argument("--lookup-workers", type=int, default=LOOKUP_MAX_WORKERS, metavar="N", help="--batch で同時に検索・取得する任務の数")
+    parser.add_argument("--ocr-only", action="store_true", help="--batch でOCRまで行い、検索・取得はしない")
+    parser.add_argument("--prefetch", action="store_true", help="GUIを起動せず、攻略ページの先読みを実行して終了する (中断しても次回続きから)")
+    parser.add_argument("--prefetch-limit", type=int, metavar="N", help="--prefetch で先読みする任務ページの上限")
+    parser.add_argument("--build-quest-index", nargs="?", const=QUEST_INDEX_BUNDLED_FILE, metavar="JSON", help="攻略サイトの一覧ページから同梱用の任務名索引を作って終了する (配布物を作る前に実行する)")
+    parser.add_argument("--slot-layout", choices=["auto", "manual"], default=SLOT_LAYOUT_MODE, help="スロット位置をキャプチャから自動検出するか、手動設定の座標をそのまま使うか")
+    parser.add_argument("--no-warmup", action="store_true", help="ウィンドウ表示後のモジュール・OCRエンジンの先読み込みをしない (最初のキャプチャ・検索時に読み込む)")
+    parser.add_argument("--startup-report", action="store_true", help="起動時間の内訳 (ウィンドウ表示までの時間・遅延インポートごとの時間) を標準エラーに表示する")
+    parser.add_argument("--watch", action="store_true", help="起動時から監視モードを有効にする")
+    parser.add_argument("--watch-fps", type=float, default=WATCH_FPS, metavar="FPS", help="監視モードで1秒あたりにキャプチャする回数")
+    parser.add_argument("--watch-debounce", type=int, default=WATCH_DEBOUNCE_FRAMES, metavar="N", help="変化後、N回連続で同じ内容になってからOCRする")
+    return parser.parse_args(argv)
+
 # --- Tkinter GUIのメイン処理 ---
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # PyInstallerでexe化した場合も一括処理の子プロセスを起動できるようにする
+    record_startup_event("モジュール読み込み完了")
+    cli_args = parse_command_line_args()
+    if cli_args.trace: TRACE_FILE = cli_args.trace; stage_tracer.enable(TRACE_FILE)
+    SLOT_LAYOUT_MODE = cli_args.slot_layout
+    if cli_args.bench_parse:
+        run_html_parse_benchmark(cli_args.bench_parse); sys.exit(0)
+    if cli_args.bench_add_screenshot:
+        sys.exit(add_bench_screenshot(cli_args.bench_add_screenshot[0], cli_args.bench_add_screenshot[1:]))
+    if cli_args.bench_add_page:
+        sys.exit(add_bench_guide_page(cli_args.bench_add_page))
+    if cli_args.bench:
+        sys.exit(run_offline_benchmark(cli_args.bench, cli_args.bench_baseline, cli_args.update_baseline, cli_args.bench_repeat))
+    if cli_args.prefetch:
+        GuidePrefetcher().run(page_limit=cli_args.prefetch_limit); sys.exit(0)
+    if cli_args.build_quest_index:
+        sys.exit(build_bundled_quest_index(cli_args.build_quest_index))
+    if cli_args.batch:
+        sys.exit(run_headless_batch(cli_args.batch, cli_args.slots, cli_args.output, cli_args.ocr_workers, cli_args.lookup_workers, cli_args.ocr_only))
+
     root = tk.Tk() 
     status_label_var = tk.StringVar()
     slot_entry_var = tk.StringVar()
@@ -708,6 +3406,11 @@ if __name__ == "__main__":
     capture_frame.pack(side=tk.LEFT, padx=(0,5), fill=tk.X) # expand=True を削除または調整
     capture_button_widget = ttk.Button(capture_frame, text="艦これウィンドウをキャプチャ", command=handle_capture_button_click)
     capture_button_widget.pack(pady=5, padx=5)
+    WATCH_FPS = cli_args.watch_fps; WATCH_DEBOUNCE_FRAMES = cli_args.watch_debounce
+    watch_controller = WatchModeController(root, status_label_var, WATCH_FPS, WATCH_DEBOUNCE_FRAMES)
+    watch_mode_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(capture_frame, text="監視モード (変化したスロットを自動処理)", variable=watch_mode_var, command=toggle_watch_mode).pack(pady=(0,5), padx=5)
+    ttk.Button(capture_frame, text="スロット位置を再検出", command=handle_reset_slot_layout_click).pack(pady=(0,5), padx=5)
 
     slot_selection_frame = ttk.LabelFrame(input_controls_frame, text="ステップ2: 処理スロット指定 & 実行", padding="10")
     slot_selection_frame.pack(side=tk.LEFT, padx=(5,0), fill=tk.X, expand=True) # こちらを expand=True に
@@ -718,6 +3421,17 @@ if __name__ == "__main__":
     process_slots_button_widget = ttk.Button(slot_selection_frame, text="選択スロットの情報取得・表示", command=handle_process_slots_button_click)
     process_slots_button_widget.pack(side=tk.LEFT, padx=5); process_slots_button_widget.config(state=tk.DISABLED)
 
+    timing_frame = ttk.LabelFrame(input_controls_frame, text="計測", padding="10")
+    timing_frame.pack(side=tk.LEFT, padx=(5,0))
+    trace_enabled_var = tk.BooleanVar(value=stage_tracer.enabled)
+    ttk.Checkbutton(timing_frame, text="処理時間を計測", variable=trace_enabled_var, command=toggle_stage_tracing).pack(side=tk.LEFT, padx=(0,5))
+    ttk.Button(timing_frame, text="内訳", command=show_stage_timing_summary, width=6).pack(side=tk.LEFT)
+
+    prefetch_frame = ttk.LabelFrame(input_controls_frame, text="先読み", padding="10")
+    prefetch_frame.pack(side=tk.LEFT, padx=(5,0))
+    prefetch_enabled_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(prefetch_frame, text="攻略ページを先読み", variable=prefetch_enabled_var, command=toggle_guide_prefetch).pack(side=tk.LEFT)
+
     results_display_frame = ttk.LabelFrame(main_frame, text="ステップ3: 抽出された任務詳細", padding="10")
     results_display_frame.pack(expand=True, fill=tk.BOTH, pady=5, padx=5) # ← 元の設定に戻してみる
     
@@ -742,47 +3456,22 @@ if __name__ == "__main__":
 
     top_info_frame.columnconfigure(1, weight=1) 
 
-    notebook = ttk.Notebook(results_display_frame) # results_display_frame を親に
-    notebook.pack(expand=True, fill=tk.BOTH, pady=5) # notebook自体は親フレーム内で拡張
-
-    tab_content = ttk.Frame(notebook); notebook.add(tab_content, text='任務内容')
-    content_text = scrolledtext.ScrolledText(tab_content, wrap=tk.WORD, height=4, state=tk.DISABLED, relief=tk.GROOVE, borderwidth=1) # 例: 2->4
-    content_text.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-
-    tab_rewards = ttk.Frame(notebook); notebook.add(tab_rewards, text='報酬')
-    rewards_text = scrolledtext.ScrolledText(tab_rewards, wrap=tk.WORD, height=4, state=tk.DISABLED, relief=tk.GROOVE, borderwidth=1) # 例: 2->4
-    rewards_text.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-
-    tab_sortie = ttk.Frame(notebook); notebook.add(tab_sortie, text='出撃情報')
-    sortie_info_text = scrolledtext.ScrolledText(tab_sortie, wrap=tk.WORD, height=25, state=tk.DISABLED, relief=tk.GROOVE, borderwidth=1) # 例: 4->10 (ここは情報量が多いので大きく)
-    sortie_info_text.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-    
-    # --- ↓↓↓ 「出撃情報」の「編成例」用スタイルタグを設定 ↓↓↓ ---
-    # ベースとなるフォント情報を取得（またはデフォルト値を設定）
-    # ウィジェットが実際に表示されるまでは正確なフォント取得が難しい場合があるため、
-    # 固定値で設定するか、一般的なフォントを指定するのが無難です。
-    # ここでは、現在のフォントサイズを基準に少し大きくしてみます。
-    # (実際のフォントファミリーやサイズは、お使いの環境や好みで調整してください)
-    default_font_family = "MS Gothic" 
-    default_font_size = 9          # ScrolledTextの基本フォントサイズを想定
-    
-    sortie_info_text.tag_configure(
-        "fleet_example_style", 
-        font=(default_font_family, default_font_size + 3, "bold"), # サイズを+3に、太字
-        foreground="blue"                                        # 文字色を青に (下線指定を削除)
-    )
-    
-    tab_expedition = ttk.Frame(notebook); notebook.add(tab_expedition, text='遠征詳細')
-    expedition_info_text = scrolledtext.ScrolledText(tab_expedition, wrap=tk.WORD, height=6, state=tk.DISABLED, relief=tk.GROOVE, borderwidth=1) # 例: 3->6
-    expedition_info_text.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
-
-    tab_arsenal = ttk.Frame(notebook); notebook.add(tab_arsenal, text='開発レシピ')
-    arsenal_info_text = scrolledtext.ScrolledText(tab_arsenal, wrap=tk.WORD, height=6, state=tk.DISABLED, relief=tk.GROOVE, borderwidth=1) # 例: 3->6
-    arsenal_info_text.pack(expand=True, fill=tk.BOTH, padx=2, pady=2)
+    results_notebook = ttk.Notebook(results_display_frame) # 処理した任務ごとに1つのタブ (MissionResultPane)
+    results_notebook.pack(expand=True, fill=tk.BOTH, pady=5) # notebook自体は親フレーム内で拡張
+    results_notebook.bind("<<NotebookTabChanged>>", show_selected_mission_pane)
 
     status_bar = ttk.Label(root, textvariable=status_label_var, relief=tk.SUNKEN, anchor=tk.W, padding=(5,2))
     status_label_var.set("「艦これウィンドウをキャプチャ」ボタンを押してください。")
     status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+
+    # 重いモジュールとOCRエンジン(jpn学習データ)は、ウィンドウが表示されてからバックグラウンドで読み込んでおく
+    def on_window_shown():
+        record_startup_event("ウィンドウ表示")
+        if cli_args.startup_report: print_startup_report()
+        if STARTUP_WARMUP_ENABLED and not cli_args.no_warmup:
+            root.after(STARTUP_WARMUP_DELAY_MS, lambda: warm_up_in_background(on_done=print_startup_report if cli_args.startup_report else None))
+    root.after_idle(on_window_shown)
+    if cli_args.watch: watch_mode_var.set(True); toggle_watch_mode()
     
     # processed_missions_details_gui = [] # これはメインループの外、関数の外でグローバルとして初期化済み想定
 